@@ -401,6 +401,27 @@ export default function ChatPage() {
         setIsTyping(true);
       } catch (err) {
         console.error("Error with AI query:", err);
+        if (err.response?.status === 429) {
+          const retryAfter = err.response.headers?.["retry-after"];
+          setMessages((prev) => [
+            ...prev,
+            {
+              channelId,
+              sender: {
+                _id: "6908f424d1e6c64d8c83d2e5",
+                fullName: "AI Bot",
+                profilePic: "/ai-avatar.png",
+              },
+              text: `The AI assistant is busy right now${
+                retryAfter ? `, please try again in ${retryAfter}s` : ""
+              }.`,
+              isRead: true,
+              isAi: true,
+              tempId: uuidv4(),
+              createdAt: new Date().toISOString(),
+            },
+          ]);
+        }
       }
 
       return;
@@ -473,45 +494,72 @@ export default function ChatPage() {
   const theme = themes[currentTheme] || themes.base;
 
   useEffect(() => {
-    const socket = new WebSocket(
-      `ws://localhost/ai/ws/${channelId}?authId=${authUser._id}`
-    );
-    socketRef.current = socket;
+    // Reconnects resume from the last frame received (its stream id), so an
+    // answer that finished while the socket was down is still delivered.
+    let lastId = null;
+    let closed = false;
+    let retryTimer = null;
+
+    const connect = () => {
+      const resume = lastId ? `&lastId=${encodeURIComponent(lastId)}` : "";
+      const socket = new WebSocket(
+        `ws://localhost/ai/ws/${channelId}?authId=${authUser._id}${resume}`
+      );
+      socketRef.current = socket;
 
-    socket.onopen = () => {
-      console.log("WebSocket connected");
-    };
+      socket.onopen = () => {
+        console.log("WebSocket connected");
+      };
 
-    socket.onmessage = (event) => {
-      console.log("WebSocket message received:", event.data);
-      const data = JSON.parse(event.data);
-
-      if (data && data.response) {
-        setIsTyping(false);
-        const aiMessage = {
-          channelId,
-          sender: {
-            _id: "6908f424d1e6c64d8c83d2e5",
-            fullName: "AI Bot",
-            profilePic: "/ai-avatar.png",
-          },
-          text: data.response,
-          isRead: true,
-          isAi: true,
-          tempId: uuidv4(),
-          createdAt: new Date().toISOString(),
-        };
+      socket.onmessage = (event) => {
+        console.log("WebSocket message received:", event.data);
+        const data = JSON.parse(event.data);
+
+        if (!data) return;
+        if (data.id) lastId = data.id;
+
+        // Streamed answers arrive as "chunk" frames and end with a "done" frame
+        // holding the full text; both share the task id as the message tempId.
+        if (data.type === "chunk" || data.response) {
+          setIsTyping(false);
+          const tempId = data.task_id || uuidv4();
+          setMessages((prev) => {
+            const existing = prev.find((m) => m.tempId === tempId);
+            if (existing) {
+              const text =
+                data.type === "chunk" ? existing.text + data.delta : data.response;
+              return prev.map((m) => (m.tempId === tempId ? { ...m, text } : m));
+            }
+            const aiMessage = {
+              channelId,
+              sender: {
+                _id: "6908f424d1e6c64d8c83d2e5",
+                fullName: "AI Bot",
+                profilePic: "/ai-avatar.png",
+              },
+              text: data.type === "chunk" ? data.delta : data.response,
+              isRead: true,
+              isAi: true,
+              tempId,
+              createdAt: new Date().toISOString(),
+            };
+            return [...prev, aiMessage];
+          });
+        }
+      };
 
-        setMessages((prev) => [...prev, aiMessage]);
-      }
+      socket.onclose = () => {
+        console.log("WebSocket disconnected");
+        if (!closed) retryTimer = setTimeout(connect, 1000);
+      };
     };
 
-    socket.onclose = () => {
-      console.log("WebSocket disconnected");
-    };
+    connect();
 
     return () => {
-      socket.close();
+      closed = true;
+      clearTimeout(retryTimer);
+      socketRef.current?.close();
     };
   }, [channelId]);
 
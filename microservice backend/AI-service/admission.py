@@ -0,0 +1,119 @@
+import os
+import re
+import math
+import hashlib
+from typing import Optional
+from redis_client import redis_client, async_redis_client
+
+# Admission control for POST /: token buckets per user and per channel, a
+# global backlog cap, and coalescing of repeated in-flight questions onto the
+# task that is already answering them.
+
+AI_RATE_LIMIT_ENABLED = os.getenv("AI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+AI_RATE_USER_PER_MIN = float(os.getenv("AI_RATE_USER_PER_MIN", 10))
+AI_RATE_USER_BURST = int(os.getenv("AI_RATE_USER_BURST", 5))
+AI_RATE_CHANNEL_PER_MIN = float(os.getenv("AI_RATE_CHANNEL_PER_MIN", 60))
+AI_RATE_CHANNEL_BURST = int(os.getenv("AI_RATE_CHANNEL_BURST", 20))
+# Requests are refused while more than this many jobs wait in the worker queue.
+AI_MAX_QUEUE_DEPTH = int(os.getenv("AI_MAX_QUEUE_DEPTH", 500))
+AI_QUEUE_RETRY_AFTER_S = int(os.getenv("AI_QUEUE_RETRY_AFTER_S", 5))
+AI_COALESCE_TTL_S = int(os.getenv("AI_COALESCE_TTL_S", 120))
+
+CELERY_QUEUE = "celery"
+
+# Refills and takes one token from every bucket in KEYS, or from none of them.
+# ARGV holds (capacity, refill per second) per key. Returns {1, 0} when
+# admitted, else {0, ms until the emptiest bucket has a token again}.
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local levels = {}
+local wait_ms = 0
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2 - 1])
+  local rate = tonumber(ARGV[i * 2]) / 1000
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or capacity
+  local ts = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + (now - ts) * rate)
+  levels[i] = tokens
+  if tokens < 1 then
+    wait_ms = math.max(wait_ms, math.ceil((1 - tokens) / rate))
+  end
+end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2 - 1])
+  local rate = tonumber(ARGV[i * 2]) / 1000
+  local tokens = levels[i]
+  if wait_ms == 0 then tokens = tokens - 1 end
+  redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(capacity / rate) + 1000)
+end
+if wait_ms > 0 then return {0, wait_ms} end
+return {1, 0}
+"""
+
+# Deletes KEYS[1] only if it still holds ARGV[1] (this task; compaction.py's run token).
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_take_tokens = async_redis_client.register_script(TOKEN_BUCKET_LUA)
+_release = redis_client.register_script(RELEASE_LUA)
+_release_async = async_redis_client.register_script(RELEASE_LUA)
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def inflight_key(channel_id: str, user_id: str, query: str) -> str:
+    # Answers are phrased for the asker, so only the same user's repeats share a task.
+    normalized = re.sub(r"\s+", " ", query.strip().lower())
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    return f"ai_inflight:{channel_id}:{user_id}:{digest}"
+
+
+async def inflight_task(channel_id: str, user_id: str, query: str) -> Optional[str]:
+    return await async_redis_client.get(inflight_key(channel_id, user_id, query))
+
+
+async def claim(channel_id: str, user_id: str, query: str, task_id: str) -> Optional[str]:
+    """Registers task_id as the answerer of this question; returns the existing task id if one won the race."""
+    key = inflight_key(channel_id, user_id, query)
+    if await async_redis_client.set(key, task_id, nx=True, ex=AI_COALESCE_TTL_S):
+        return None
+    return await async_redis_client.get(key)
+
+
+def release(channel_id: str, user_id: str, query: str, task_id: str):
+    _release(keys=[inflight_key(channel_id, user_id, query)], args=[task_id])
+
+
+async def release_async(channel_id: str, user_id: str, query: str, task_id: str):
+    await _release_async(keys=[inflight_key(channel_id, user_id, query)], args=[task_id])
+
+
+async def check_backlog(queue_key: str):
+    depth = await async_redis_client.llen(queue_key)
+    if depth > AI_MAX_QUEUE_DEPTH:
+        raise Rejected(f"AI queue is full ({depth} waiting)", AI_QUEUE_RETRY_AFTER_S)
+
+
+async def take_token(channel_id: str, user_id: str):
+    """Spends one request from the user's and the channel's buckets, or raises Rejected."""
+    if not AI_RATE_LIMIT_ENABLED:
+        return
+    admitted, wait_ms = await _take_tokens(
+        keys=[f"ai_rate:user:{user_id}", f"ai_rate:channel:{channel_id}"],
+        args=[AI_RATE_USER_BURST, AI_RATE_USER_PER_MIN / 60.0,
+              AI_RATE_CHANNEL_BURST, AI_RATE_CHANNEL_PER_MIN / 60.0],
+    )
+    if not admitted:
+        raise Rejected("Too many AI requests, please slow down", max(1, math.ceil(int(wait_ms) / 1000)))
@@ -1,15 +1,93 @@
-import json
+import time
+import logging
+from celery import chord, group
 from celery_worker import celery
-from chat import answer_with_ai
-from redis_client import redis_client
-
-@celery.task(name="ai.generate_response")
-def generate_ai_response(query, user_id, channel_id):
-    response = answer_with_ai(query, user_id, channel_id)
-
-    message = json.dumps({
-        "user_id": user_id,
-        "channel_id": channel_id,
-        "response": response
-    })
-    redis_client.publish(f"ai_response_{channel_id}_{user_id}", message)
+from chat import answer_with_ai, build_turn_docs, AI_UNAVAILABLE_REPLY
+from response_stream import AI_STREAMING, ChunkPublisher
+import admission
+import metrics
+import digest
+import turn_writer
+
+logger = logging.getLogger(__name__)
+
+
+@celery.task(name="ai.generate_response", bind=True)
+def generate_ai_response(self, query, user_id, channel_id, enqueued_at=None):
+    started = time.time()
+    if enqueued_at:
+        metrics.observe("ai_queue_wait_seconds", started - enqueued_at, mode="celery")
+    metrics.start_trace(self.request.id, channel_id=channel_id, user_id=user_id)
+    # enqueued_at rides along on every frame so the API side can time end-to-end delivery.
+    publisher = ChunkPublisher(
+        channel_id, user_id,
+        {"task_id": self.request.id, "user_id": user_id, "channel_id": channel_id, "enqueued_at": enqueued_at},
+    )
+
+    try:
+        response = answer_with_ai(query, user_id, channel_id, on_delta=publisher if AI_STREAMING else None)
+
+        with metrics.span("publish"):
+            publisher.flush()
+            publisher.publish("done", response=response, published_at=time.time())
+    finally:
+        admission.release(channel_id, user_id, query, self.request.id)
+        metrics.observe("ai_task_seconds", time.time() - started, mode="celery")
+        metrics.finish_trace()
+
+
+@celery.task(name="ai.digest", bind=True)
+def generate_digest(self, items, user_id, channel_id, enqueued_at=None):
+    """Retrieves for every item, then fans the LLM work out as a chord whose callback publishes the answer."""
+    started = time.time()
+    if enqueued_at:
+        metrics.observe("ai_queue_wait_seconds", started - enqueued_at, mode="digest")
+    metrics.observe("ai_digest_items", len(items), buckets=metrics.SIZE_BUCKETS)
+    base = {"task_id": self.request.id, "user_id": user_id, "channel_id": channel_id, "enqueued_at": enqueued_at}
+    try:
+        prepared = digest.prepare(items)
+    except Exception as e:
+        logger.warning("⚠️ Digest retrieval failed: %s", e)
+        publisher = ChunkPublisher(channel_id, user_id, base)
+        publisher.publish("done", response=AI_UNAVAILABLE_REPLY, published_at=time.time())
+        return
+
+    header = group(digest_part.s(part, user_id) for part in digest.split(prepared))
+    # If a part dies outside run_item (lost worker, time limit, backend error) the
+    # callback never runs; the errback still ends the task with a done frame.
+    callback = collect_digest.s(user_id, channel_id, base, started).on_error(
+        digest_failed.s(user_id=user_id, channel_id=channel_id, base=base),
+    )
+    chord(header)(callback)
+
+
+# Chord members must keep their results for the callback to collect them.
+@celery.task(name="ai.digest_part", ignore_result=False)
+def digest_part(items, user_id):
+    return [digest.run_item(item, user_id) for item in items]
+
+
+@celery.task(name="ai.digest_collect")
+def collect_digest(parts, user_id, channel_id, base, started):
+    results = [result for part in parts for result in part]
+    response = digest.render(results)
+    # Queued before the publish, so nothing after the done frame can fail into the errback.
+    turn_writer.submit(build_turn_docs(f"Digest of {len(results)} channel(s)", response, user_id, channel_id))
+    with metrics.span("publish"):
+        ChunkPublisher(channel_id, user_id, base).publish(
+            "done", response=response, items=sorted(results, key=lambda r: r["index"]), published_at=time.time(),
+        )
+    metrics.observe("ai_task_seconds", time.time() - started, mode="digest")
+
+
+@celery.task(name="ai.digest_failed")
+def digest_failed(request, exc, traceback, user_id=None, channel_id=None, base=None):
+    logger.warning("⚠️ Digest %s failed: %r", base and base.get("task_id"), exc)
+    ChunkPublisher(channel_id, user_id, base).publish("done", response=AI_UNAVAILABLE_REPLY, published_at=time.time())
+
+
+@celery.task(name="ai.compact_vectors")
+def compact_vectors():
+    # Imported here so answer-only workers don't load the ingest pipeline.
+    import compaction
+    return compaction.compact()
@@ -1,23 +1,197 @@
+import os
 import json
-from fastapi import WebSocket
-from redis_client import get_pubsub
+import time
 import asyncio
-from redis_client import redis_client 
+import logging
+from collections import defaultdict
+from typing import Optional
+from fastapi import WebSocket
 from fastapi import WebSocketDisconnect  
+from redis_client import get_async_pubsub
+from async_worker import AI_EXECUTION_MODE, request_cancel
+import metrics
+import response_stream
 
-async def ai_websocket(websocket: WebSocket, channel_id: str, authId: str):
-    await websocket.accept()
-    pubsub = get_pubsub()
-    pubsub.subscribe(f"ai_response_{channel_id}_{authId}")
+logger = logging.getLogger(__name__)
+
+AI_RESPONSE_PATTERN = "ai_response_*"
+RECONNECT_BACKOFF_S = 1.0
+AI_CANCEL_GRACE_S = float(os.getenv("AI_CANCEL_GRACE_S", 10))
+# Frames queued per socket, and how long one send may take, before a slow client is dropped.
+AI_WS_QUEUE_SIZE = int(os.getenv("AI_WS_QUEUE_SIZE", 256))
+AI_WS_SEND_TIMEOUT_S = float(os.getenv("AI_WS_SEND_TIMEOUT_S", 5))
+
+# One pattern subscription per worker process fans out to every socket
+# registered under (channel_id, authId). Each socket has its own bounded
+# queue and sender task, so a stalled client never holds up the others.
+# Frames also land in a response stream (response_stream.py), which a
+# reconnecting socket replays from the last id it saw before live frames resume.
+_sockets = defaultdict(set)
+_listener_task = None
+
+
+class _Subscriber:
+    """A socket and the newest stream id sent to it, so replayed and live frames go out once and in order."""
+
+    def __init__(self, websocket: WebSocket, last_id: Optional[str] = None):
+        self.websocket = websocket
+        try:
+            self.last_id = response_stream.parse_id(last_id) if last_id else None
+        except ValueError:
+            self.last_id = None  # not a stream id: no replay, live frames only
+        self.resume_from = last_id if self.last_id is not None else None
+        self.queue = asyncio.Queue(maxsize=AI_WS_QUEUE_SIZE)
+        self.sender = None
+
+    def offer(self, data) -> bool:
+        """Queues a live frame; False when the client has fallen too far behind."""
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _send(self, data) -> bool:
+        frame_id = data.get("id")
+        if frame_id:
+            parsed = response_stream.parse_id(frame_id)
+            if self.last_id is not None and parsed <= self.last_id:
+                return False
+            self.last_id = parsed
+        await asyncio.wait_for(self.websocket.send_json(data), AI_WS_SEND_TIMEOUT_S)
+        return True
+
+    async def run(self, channel_id: str, user_id: str):
+        # Replayed frames go first; live ones queue up meanwhile and are deduped by id.
+        if self.resume_from:
+            for data in await response_stream.replay(channel_id, user_id, self.resume_from):
+                await self._send(data)
+        while True:
+            data = await self.queue.get()
+            if await self._send(data):
+                _observe_delivery(data)
+
+
+def _observe_delivery(data):
+    enqueued_at = data.get("enqueued_at")
+    if not enqueued_at:
+        return
+    now = time.time()
+    if data.get("seq") == 0:
+        metrics.observe("ai_first_frame_e2e_seconds", now - enqueued_at)
+    if data.get("type") == "done":
+        metrics.observe("ai_end_to_end_seconds", now - enqueued_at)
+        if data.get("published_at"):
+            metrics.observe("ai_delivery_seconds", now - data["published_at"])
+
+
+def _deliver(key, data):
+    for subscriber in list(_sockets.get(key, ())):
+        if not subscriber.offer(data):
+            logger.warning("Dropping AI socket for %s: %d frame(s) behind", key, AI_WS_QUEUE_SIZE)
+            _unregister(key, subscriber)
+            if subscriber.sender is not None:
+                subscriber.sender.cancel()
+
+
+async def _listen():
+    while True:
+        pubsub = get_async_pubsub()
+        try:
+            await pubsub.psubscribe(AI_RESPONSE_PATTERN)
+            logger.info("📡 Subscribed to %s", AI_RESPONSE_PATTERN)
+            async for message in pubsub.listen():
+                if message.get("type") != "pmessage":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    logger.warning("Ignoring malformed AI response on %s", message.get("channel"))
+                    continue
+                _deliver((data.get("channel_id"), data.get("user_id")), data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("AI response listener error, reconnecting: %s", e)
+            await asyncio.sleep(RECONNECT_BACKOFF_S)
+        finally:
+            await pubsub.aclose()
 
+
+def _ensure_listener():
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_listen())
+
+
+def _unregister(key, subscriber):
+    sockets = _sockets.get(key)
+    if not sockets:
+        return
+    sockets.discard(subscriber)
+    if not sockets:
+        del _sockets[key]
+
+
+async def stop_listener():
+    global _listener_task
+    if _listener_task is None:
+        return
+    _listener_task.cancel()
+    try:
+        await _listener_task
+    except asyncio.CancelledError:
+        pass
+    _listener_task = None
+
+
+async def _cancel_if_abandoned(key):
+    await asyncio.sleep(AI_CANCEL_GRACE_S)
+    if key in _sockets:
+        return
+    try:
+        await request_cancel(*key)
+    except Exception as e:
+        logger.warning("Could not publish cancellation for %s: %s", key, e)
+
+
+async def _receive(websocket: WebSocket, channel_id: str):
+    # Nothing is expected from the client; this just parks until it disconnects.
     try:
         while True:
-            message = pubsub.get_message()  
-            if message:
-                data = json.loads(message["data"])
-                await websocket.send_json(data)
-            await asyncio.sleep(0.01)
+            await websocket.receive_text()
     except WebSocketDisconnect:
         print(f"Client disconnected from channel {channel_id}")
+
+
+def connected_sockets() -> int:
+    return sum(len(s) for s in _sockets.values())
+
+
+async def ai_websocket(websocket: WebSocket, channel_id: str, authId: str, last_id: Optional[str] = None):
+    await websocket.accept()
+    key = (channel_id, authId)
+    subscriber = _Subscriber(websocket, last_id)
+    _sockets[key].add(subscriber)
+    _ensure_listener()
+
+    subscriber.sender = asyncio.create_task(subscriber.run(channel_id, authId))
+    receiver = asyncio.create_task(_receive(websocket, channel_id))
+    try:
+        await asyncio.wait({subscriber.sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        if subscriber.sender.done() and not receiver.done():
+            # The sender stopped first: a send timed out or failed, or the client fell too far behind.
+            error = None if subscriber.sender.cancelled() else subscriber.sender.exception()
+            logger.warning("Closing slow AI socket for %s: %r", key, error)
+            try:
+                await asyncio.wait_for(websocket.close(), AI_WS_SEND_TIMEOUT_S)
+            except Exception:
+                pass
     finally:
-        pubsub.close()
+        subscriber.sender.cancel()
+        receiver.cancel()
+        _unregister(key, subscriber)
+        # In async mode, work nobody is left to receive is cancelled, after a
+        # grace period in which a reconnecting socket can resume it instead.
+        if AI_EXECUTION_MODE == "async" and key not in _sockets:
+            asyncio.create_task(_cancel_if_abandoned(key))
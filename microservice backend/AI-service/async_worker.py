@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import uuid
+import signal
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Optional
+from redis_client import async_redis_client, get_async_pubsub
+from chat import answer_with_ai_async, AI_UNAVAILABLE_REPLY
+from response_stream import AI_STREAMING, AsyncChunkPublisher
+import turn_writer
+import admission
+import metrics
+import resources
+
+# Alternative to the Celery hop: POST / pushes jobs onto a Redis list and this
+# process runs them as asyncio tasks, so concurrency is bounded by
+# AI_ASYNC_CONCURRENCY rather than by the number of pool processes.
+#
+#   AI_EXECUTION_MODE=async python async_worker.py
+
+AI_EXECUTION_MODE = os.getenv("AI_EXECUTION_MODE", "celery")  # "celery" or "async"
+AI_JOBS_KEY = "ai_jobs"
+AI_CANCEL_CHANNEL = "ai_cancel"
+AI_ASYNC_CONCURRENCY = int(os.getenv("AI_ASYNC_CONCURRENCY", 200))
+# Jobs pulled from Redis ahead of a free slot; they wait in the per-user fair queue.
+AI_ASYNC_PREFETCH = int(os.getenv("AI_ASYNC_PREFETCH", AI_ASYNC_CONCURRENCY))
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue(query: str, user_id: str, channel_id: str, task_id: Optional[str] = None) -> str:
+    """Queues a job for the async worker and returns its task id (same contract as the Celery task)."""
+    task_id = task_id or str(uuid.uuid4())
+    await async_redis_client.lpush(AI_JOBS_KEY, json.dumps({
+        "task_id": task_id,
+        "query": query,
+        "user_id": user_id,
+        "channel_id": channel_id,
+        "enqueued_at": time.time(),
+    }))
+    return task_id
+
+
+async def request_cancel(channel_id: str, user_id: str):
+    """Asks the async workers to drop queued and running jobs for this socket."""
+    await async_redis_client.publish(AI_CANCEL_CHANNEL, json.dumps({"channel_id": channel_id, "user_id": user_id}))
+
+
+class FairQueue:
+    """Round-robin over users, so one user's burst can't starve everyone else."""
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._size = 0
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, job: dict):
+        self._queues.setdefault(job["user_id"], deque()).append(job)
+        self._size += 1
+        self._ready.set()
+
+    async def get(self) -> dict:
+        while not self._size:
+            self._ready.clear()
+            await self._ready.wait()
+        user_id, jobs = self._queues.popitem(last=False)
+        job = jobs.popleft()
+        if jobs:
+            self._queues[user_id] = jobs  # back of the line
+        self._size -= 1
+        return job
+
+    def cancel(self, channel_id: str, user_id: str) -> int:
+        jobs = self._queues.get(user_id)
+        if not jobs:
+            return 0
+        kept = deque(j for j in jobs if j["channel_id"] != channel_id)
+        dropped = len(jobs) - len(kept)
+        if kept:
+            self._queues[user_id] = kept
+        else:
+            del self._queues[user_id]
+        self._size -= dropped
+        return dropped
+
+
+class AsyncJobEngine:
+    def __init__(self, concurrency: int = AI_ASYNC_CONCURRENCY, prefetch: int = AI_ASYNC_PREFETCH):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.prefetch = prefetch
+        self.queue = FairQueue()
+        self.running = {}  # task_id -> (job, asyncio.Task)
+        self.stopping = asyncio.Event()
+
+    async def fetch(self):
+        while not self.stopping.is_set():
+            if len(self.queue) >= self.prefetch:
+                await asyncio.sleep(0.05)
+                continue
+            item = await async_redis_client.brpop(AI_JOBS_KEY, timeout=1)
+            if item:
+                self.queue.put(json.loads(item[1]))
+
+    async def dispatch(self):
+        while True:
+            await self.slots.acquire()
+            job = await self.queue.get()
+            task = asyncio.create_task(self.run(job))
+            self.running[job["task_id"]] = (job, task)
+            task.add_done_callback(lambda _, task_id=job["task_id"]: self._finished(task_id))
+
+    def _finished(self, task_id):
+        self.running.pop(task_id, None)
+        self.slots.release()
+
+    async def run(self, job: dict):
+        user_id, channel_id = job["user_id"], job["channel_id"]
+        enqueued_at, started = job.get("enqueued_at"), time.time()
+        if enqueued_at:
+            metrics.observe("ai_queue_wait_seconds", started - enqueued_at, mode="async")
+        # Each job runs in its own asyncio task, so the trace context stays per job.
+        metrics.start_trace(job["task_id"], channel_id=channel_id, user_id=user_id)
+        publisher = AsyncChunkPublisher(
+            channel_id, user_id,
+            {"task_id": job["task_id"], "user_id": user_id, "channel_id": channel_id, "enqueued_at": enqueued_at},
+        )
+        try:
+            response = await answer_with_ai_async(
+                job["query"], user_id, channel_id, on_delta=publisher if AI_STREAMING else None,
+            )
+            with metrics.span("publish"):
+                await publisher.flush()
+                await publisher.publish("done", response=response, published_at=time.time())
+        except asyncio.CancelledError:
+            logger.info("🛑 Cancelled job %s (client disconnected)", job["task_id"])
+            raise
+        except Exception as e:
+            logger.exception("❌ Job %s failed: %s", job["task_id"], e)
+            await publisher.publish("done", response=AI_UNAVAILABLE_REPLY, published_at=time.time())
+        finally:
+            await admission.release_async(channel_id, user_id, job["query"], job["task_id"])
+            metrics.observe("ai_task_seconds", time.time() - started, mode="async")
+            metrics.finish_trace()
+
+    async def listen_cancellations(self):
+        pubsub = get_async_pubsub()
+        await pubsub.subscribe(AI_CANCEL_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                data = json.loads(message["data"])
+                channel_id, user_id = data["channel_id"], data["user_id"]
+                dropped = self.queue.cancel(channel_id, user_id)
+                for job, task in list(self.running.values()):
+                    if job["channel_id"] == channel_id and job["user_id"] == user_id:
+                        task.cancel()
+                        dropped += 1
+                if dropped:
+                    logger.info("Cancelled %d job(s) for %s/%s", dropped, channel_id, user_id)
+        finally:
+            await pubsub.aclose()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        dispatcher = asyncio.create_task(self.dispatch())
+        canceller = asyncio.create_task(self.listen_cancellations())
+        metrics.ensure_flusher()
+        # Loaded in a thread now rather than by the first question's context packing.
+        resources.warm_up(["tokenizer"])
+        logger.info("🚀 Async AI worker started (concurrency=%d)", AI_ASYNC_CONCURRENCY)
+        await self.fetch()
+
+        # Graceful stop: no new jobs are pulled; queued ones go back to Redis, running ones finish.
+        dispatcher.cancel()
+        queued = []
+        while len(self.queue):
+            queued.append(await self.queue.get())
+        if queued:
+            await async_redis_client.rpush(AI_JOBS_KEY, *(json.dumps(j) for j in reversed(queued)))
+        in_flight = [task for _, task in self.running.values()]
+        logger.info("Draining %d running job(s), requeued %d", len(in_flight), len(queued))
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        canceller.cancel()
+        await asyncio.to_thread(turn_writer.flush)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(AsyncJobEngine().serve())
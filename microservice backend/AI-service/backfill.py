@@ -0,0 +1,280 @@
+import os
+import time
+import signal
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ASCENDING
+from qdrant_client import models
+import resources
+import consumer
+from mongo_utils import as_utc, resolve_names
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Rebuilds the vectors of every stored chat message into a fresh collection,
+# then points the QDRANT_COLLECTION alias at it. Searches and the live
+# consumer keep using the old collection until the alias switch.
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 512))
+BACKFILL_LOG_EVERY_S = int(os.getenv("BACKFILL_LOG_EVERY_S", 10))
+# ObjectIds minted on different hosts are only roughly ordered; the final
+# catch-up pass re-reads this much history (upserts are idempotent).
+BACKFILL_CATCHUP_MARGIN_S = int(os.getenv("BACKFILL_CATCHUP_MARGIN_S", 120))
+BACKFILL_INDEX_TIMEOUT_S = int(os.getenv("BACKFILL_INDEX_TIMEOUT_S", 3600))
+
+
+def checkpoint_key(target: str) -> str:
+    return f"backfill:{target}"
+
+
+def load_checkpoint(target: str) -> dict:
+    return redis_client.hgetall(checkpoint_key(target))
+
+
+def save_checkpoint(target: str, **fields):
+    fields["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    redis_client.hset(checkpoint_key(target), mapping={k: str(v) for k, v in fields.items()})
+
+
+def to_message(doc, names: dict) -> dict:
+    """Shapes a Mongo message like the chat-messages Kafka payload the consumer ingests."""
+    created_at = doc.get("createdAt")
+    if isinstance(created_at, datetime):
+        created_at = as_utc(created_at).isoformat()
+    sender = doc.get("sender")
+    return {
+        "messageId": str(doc["_id"]),
+        "channelId": doc.get("channelId"),
+        "sender": {"_id": str(sender), "fullName": names.get(sender)} if sender else None,
+        "text": doc.get("text") or "",
+        "createdAt": created_at,
+        "parentMessage": str(doc["parentMessage"]) if doc.get("parentMessage") else None,
+    }
+
+
+def iter_batches(messages_collection, after=None):
+    """Yields (last _id, chunks) per BACKFILL_BATCH_SIZE messages, in _id order."""
+    query = {"isAi": {"$ne": True}, "text": {"$nin": [None, ""]}}
+    if after is not None:
+        query["_id"] = {"$gt": after}
+    cursor = messages_collection.find(
+        query, {"channelId": 1, "sender": 1, "text": 1, "createdAt": 1, "parentMessage": 1},
+    ).sort("_id", ASCENDING).batch_size(BACKFILL_BATCH_SIZE)
+
+    users = messages_collection.database["users"]
+    names = {}
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= BACKFILL_BATCH_SIZE:
+            yield docs[-1]["_id"], build_chunks(docs, users, names)
+            docs = []
+    if docs:
+        yield docs[-1]["_id"], build_chunks(docs, users, names)
+
+
+def build_chunks(docs, users, names: dict):
+    resolve_names(users, docs, names)
+    chunks = []
+    for doc in docs:
+        message_obj = to_message(doc, names)
+        key = message_obj["messageId"]
+        chunks.extend(consumer.chunk_points(key, message_obj["text"], consumer.build_meta(message_obj, key)))
+    return len(docs), chunks
+
+
+def _init_worker():
+    # The parent decides when to stop; workers finish the batch they hold.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def embed_and_upsert(target: str, chunks) -> int:
+    """Pool task: embeds one batch and upserts it into the target collection."""
+    if not chunks:
+        return 0
+    points = consumer.embed_points(chunks, target)
+    resources.get("qdrant").upsert(collection_name=target, points=points, wait=True)
+    return len(points)
+
+
+def prepare_target(target: str):
+    """Creates the target collection with HNSW indexing off, so bulk upserts don't rebuild the graph."""
+    qdrant_client = resources.get("qdrant")
+    if qdrant_client.collection_exists(target):
+        return
+    consumer.create_collection(target)
+    qdrant_client.update_collection(collection_name=target, hnsw_config=consumer.hnsw_config(bulk_load=True))
+
+
+def finish_target(target: str):
+    """Turns HNSW indexing back on and waits until the collection is fully indexed."""
+    qdrant_client = resources.get("qdrant")
+    qdrant_client.update_collection(collection_name=target, hnsw_config=consumer.hnsw_config())
+    deadline = time.monotonic() + BACKFILL_INDEX_TIMEOUT_S
+    while qdrant_client.get_collection(target).status != models.CollectionStatus.GREEN:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"'{target}' was not indexed within {BACKFILL_INDEX_TIMEOUT_S}s")
+        time.sleep(5)
+    logger.info("🗂️ '%s' indexed", target)
+
+
+def run_pass(pool, workers: int, target: str, after, stop: dict, total: int = 0, state: dict = None) -> dict:
+    """
+    Streams messages with _id > after through the pool, keeping at most two
+    batches per worker in flight. The checkpoint only advances past batches
+    that completed in order, so an interrupted run resumes without gaps.
+    """
+    state = state or {"lastId": after, "messages": 0, "chunks": 0}
+    pending = deque()
+    started = last_log = time.monotonic()
+    done_in_pass = 0
+
+    def settle_oldest():
+        nonlocal done_in_pass, last_log
+        last_id, count, result = pending.popleft()
+        state["chunks"] += result.get()
+        state["messages"] += count
+        state["lastId"] = last_id
+        done_in_pass += count
+        save_checkpoint(target, lastId=last_id, messages=state["messages"], chunks=state["chunks"])
+
+        if time.monotonic() - last_log >= BACKFILL_LOG_EVERY_S:
+            last_log = time.monotonic()
+            rate = done_in_pass / (last_log - started)
+            eta = f", ETA {timedelta(seconds=int(max(0, total - state['messages']) / rate))}" if total and rate else ""
+            logger.info(
+                "⏩ %d/%s message(s), %d chunk(s), %.0f msg/s%s",
+                state["messages"], total or "?", state["chunks"], rate, eta,
+            )
+
+    for last_id, (count, chunks) in iter_batches(resources.get("messages_collection"), after):
+        if stop["requested"]:
+            break
+        pending.append((last_id, count, pool.apply_async(embed_and_upsert, (target, chunks))))
+        while len(pending) >= workers * 2:
+            settle_oldest()
+    while pending:
+        settle_oldest()
+    return state
+
+
+def switch_alias(alias: str, target: str, replace_collection: bool = False):
+    """
+    Points `alias` at `target` and returns the collection it pointed to before.
+
+    Repointing an existing alias is one atomic alias update. Replacing a real
+    collection named like the alias (the first migration) is not atomic: Qdrant
+    has no swap of a collection for an alias, so the collection is dropped and
+    the alias created after it, and searches and upserts against that name fail
+    in between. Stop ingest for that run; the catch-up pass after the switch
+    re-reads the messages written meanwhile from Mongo.
+    """
+    qdrant_client = resources.get("qdrant")
+    if alias in {c.name for c in qdrant_client.get_collections().collections}:
+        # First migration: the live data sits in a real collection named like the alias.
+        if not replace_collection:
+            raise RuntimeError(
+                f"'{alias}' is a collection, not an alias; rerun with --replace-collection to drop it "
+                f"and alias '{target}' in its place"
+            )
+        logger.warning("⚠️ Dropping collection '%s' to replace it with an alias; '%s' is unavailable until it exists",
+                       alias, alias)
+        qdrant_client.delete_collection(alias)
+
+    previous = None
+    operations = []
+    for entry in qdrant_client.get_aliases().aliases:
+        if entry.alias_name == alias:
+            previous = entry.collection_name
+            operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=target, alias_name=alias),
+    ))
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info("🔀 Alias '%s' -> '%s' (was %s)", alias, target, previous)
+    return previous
+
+
+def backfill(target: str, workers: int, switch: bool = True, replace_collection: bool = False,
+             drop_old: bool = False):
+    """
+    Full reindex of streamify_db.messages into `target`, resumable from its checkpoint.
+
+    After the bulk pass a catch-up pass picks up messages written meanwhile,
+    the alias is switched, and a last catch-up pass covers the messages the
+    live consumer stored in the old collection during the switch. Edits and
+    deletes made while the bulk pass runs are only applied to the old
+    collection for messages that were already copied.
+    """
+    alias = consumer.QDRANT_COLLECTION
+    checkpoint = load_checkpoint(target)
+    if checkpoint.get("status") == "switched":
+        logger.info("✅ '%s' was already backfilled and switched in", target)
+        return
+
+    prepare_target(target)
+    after = ObjectId(checkpoint["lastId"]) if checkpoint.get("lastId") not in (None, "None") else None
+    state = {
+        "lastId": after,
+        "messages": int(checkpoint.get("messages", 0)),
+        "chunks": int(checkpoint.get("chunks", 0)),
+    }
+    save_checkpoint(target, status="running", alias=alias)
+    logger.info("🚚 Backfilling '%s' with %d worker(s)%s", target, workers, f" from {after}" if after else "")
+
+    stop = {"requested": False}
+
+    def request_stop(signum, frame):
+        logger.info("🛑 Signal %d received, finishing in-flight batches (rerun to resume)...", signum)
+        stop["requested"] = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker) as pool:
+        total = resources.get("messages_collection").estimated_document_count()
+        state = run_pass(pool, workers, target, state["lastId"], stop, total, state)
+        if stop["requested"]:
+            return
+        state = run_pass(pool, workers, target, state["lastId"], stop, state=state)
+        if stop["requested"] or not switch:
+            save_checkpoint(target, status="loaded")
+            return
+
+        finish_target(target)
+        previous = switch_alias(alias, target, replace_collection)
+        save_checkpoint(target, status="switched", previous=previous)
+
+        if state["lastId"] is not None:
+            margin = ObjectId.from_datetime(state["lastId"].generation_time - timedelta(seconds=BACKFILL_CATCHUP_MARGIN_S))
+            state = run_pass(pool, workers, target, margin, stop, state=state)
+
+    logger.info("✅ Backfill of '%s' done: %d message(s), %d chunk(s)", target, state["messages"], state["chunks"])
+    if drop_old and previous and previous != target:
+        resources.get("qdrant").delete_collection(previous)
+        logger.info("🗑️ Dropped previous collection '%s'", previous)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the Qdrant chat collection from MongoDB.")
+    parser.add_argument("--target", default=None,
+                        help="collection to build (pass an earlier target to resume it; default: a new one)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="embedding processes")
+    parser.add_argument("--no-switch", action="store_true", help="load the target but leave the alias alone")
+    parser.add_argument("--replace-collection", action="store_true",
+                        help="drop a real collection named like the alias so the alias can take its place "
+                             "(not atomic: stop the ingest consumers for this run)")
+    parser.add_argument("--drop-old", action="store_true", help="delete the previous collection after the switch")
+    args = parser.parse_args()
+
+    target = args.target or f"{consumer.QDRANT_COLLECTION}_{datetime.now(timezone.utc):%Y%m%d%H%M}"
+    backfill(target, max(1, args.workers), switch=not args.no_switch,
+             replace_collection=args.replace_collection, drop_old=args.drop_old)
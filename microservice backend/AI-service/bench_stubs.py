@@ -0,0 +1,558 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List
+import numpy as np
+from bson import ObjectId
+from langchain_core.embeddings import Embeddings
+from mongo_utils import to_mongo
+
+logger = logging.getLogger(__name__)
+
+# Local stand-ins for the AI service's external dependencies, used by
+# benchmark.py. Redis is the only real service a benchmark run needs.
+#
+#   python bench_stubs.py llm --port 8090
+#       OpenAI-compatible chat completions with a fixed first-token latency
+#       and token rate.
+#   python bench_stubs.py backend --report /tmp/backend.json
+#       The Kafka consumer loop fed from an in-process topic and the Celery
+#       worker (threads pool), both on Qdrant :memory: and an in-memory Mongo.
+
+BENCH_LLM_LATENCY_MS = int(os.getenv("BENCH_LLM_LATENCY_MS", 300))
+BENCH_LLM_TOKENS_PER_S = float(os.getenv("BENCH_LLM_TOKENS_PER_S", 50))
+BENCH_LLM_ANSWER_TOKENS = int(os.getenv("BENCH_LLM_ANSWER_TOKENS", 120))
+# Fraction of completions answered with a 503, to exercise retries and fallbacks.
+BENCH_LLM_ERROR_RATE = float(os.getenv("BENCH_LLM_ERROR_RATE", 0))
+
+TOPICS = [
+    "the deploy pipeline", "the database migration", "release notes", "the on-call rota", "the billing bug",
+    "the design review", "kubernetes upgrades", "API latency", "a customer escalation", "the Q3 roadmap",
+]
+WORDS = (
+    "we should check whether it works after the change because yesterday someone saw errors in staging "
+    "and the logs point at a timeout so maybe retry later or roll back before the demo tomorrow"
+).split()
+
+
+# --- Corpus -----------------------------------------------------------------
+
+def object_id(seed: int, kind: str, index: int) -> ObjectId:
+    # Derived from the seed so benchmark.py and the backend agree on ids without talking.
+    return ObjectId(hashlib.md5(f"{seed}:{kind}:{index}".encode()).digest()[:12])
+
+
+def channel_ids(seed: int, channels: int) -> List[str]:
+    return [str(object_id(seed, "channel", i)) for i in range(channels)]
+
+
+def user_ids(seed: int, users: int) -> List[str]:
+    return [str(object_id(seed, "user", i)) for i in range(users)]
+
+
+def make_message(rng: random.Random, seed: int, index: int, channels: int, users: int,
+                 created_at: datetime, parent=None) -> dict:
+    topic = rng.choice(TOPICS)
+    words = rng.sample(WORDS, rng.randint(6, min(30, len(WORDS))))
+    position = rng.randint(0, len(words))
+    text = " ".join(words[:position] + ["about", topic] + words[position:])
+    return {
+        "_id": object_id(seed, "message", index),
+        "channelId": str(object_id(seed, "channel", rng.randrange(channels))),
+        "sender": object_id(seed, "user", rng.randrange(users)),
+        "text": text[0].upper() + text[1:] + ".",
+        "createdAt": created_at,
+        "parentMessage": parent,
+        "isAi": False,
+    }
+
+
+def make_corpus(seed: int, messages: int, channels: int, users: int, days: int = 7):
+    """(user docs, message docs) spread over the last `days`, about one in ten a thread reply."""
+    rng = random.Random(seed)
+    user_docs = [{"_id": object_id(seed, "user", i), "fullName": f"Bench User {i}"} for i in range(users)]
+    # The stand-in stores datetimes the way pymongo returns them.
+    start = to_mongo(datetime.now(timezone.utc)) - timedelta(days=days)
+    step = timedelta(days=days) / max(1, messages)
+    docs = []
+    for i in range(messages):
+        parent = docs[rng.randrange(len(docs))]["_id"] if docs and rng.random() < 0.1 else None
+        docs.append(make_message(rng, seed, i, channels, users, start + step * i, parent))
+    return user_docs, docs
+
+
+# --- Embeddings -------------------------------------------------------------
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors: no model download, negligible CPU."""
+
+    def __init__(self, size: int = 384):
+        self.size = size
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.size] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+# --- Mongo ------------------------------------------------------------------
+
+def _compare(value, op, arg) -> bool:
+    if op == "$in":
+        return value in arg
+    if op == "$nin":
+        return value not in arg
+    if op == "$ne":
+        return value != arg
+    if op == "$exists":
+        return (value is not None) == bool(arg)
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > arg
+    if op == "$gte":
+        return value >= arg
+    if op == "$lt":
+        return value < arg
+    if op == "$lte":
+        return value <= arg
+    raise NotImplementedError(op)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """The subset of Mongo query syntax the AI service uses."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif field == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            if not all(_compare(doc.get(field), op, arg) for op, arg in condition.items()):
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda d: (d.get(key) is not None, d.get(key)), reverse=direction == -1)
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class MemoryCollection:
+    """Thread-safe list of documents with find/insert_many, standing in for a pymongo collection."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._docs = []
+        self._lock = threading.Lock()
+
+    def insert_many(self, docs, ordered=True):
+        with self._lock:
+            for doc in docs:
+                doc.setdefault("_id", ObjectId())
+                self._docs.append(doc)
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def find(self, query=None, projection=None):
+        with self._lock:
+            found = [d for d in self._docs if matches(d, query or {})]
+        if projection:
+            keep = {k for k, v in projection.items() if v} | {"_id"}
+            found = [{k: v for k, v in d.items() if k in keep} for d in found]
+        else:
+            found = [dict(d) for d in found]
+        return MemoryCursor(found)
+
+    def find_one(self, query=None, projection=None):
+        return next(iter(self.find(query, projection).limit(1)), None)
+
+    def count_documents(self, query):
+        return sum(1 for _ in self.find(query))
+
+    def create_index(self, keys, **kwargs):
+        return "_".join(f"{k}_{d}" for k, d in keys)
+
+
+class MemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+
+class MemoryMongo:
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+
+# --- Kafka ------------------------------------------------------------------
+
+class FeedMessage:
+    """Quacks like a confluent_kafka Message."""
+
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value")
+
+    def __init__(self, topic, partition, offset, key, value):
+        self._topic, self._partition, self._offset = topic, partition, offset
+        self._key, self._value = key, value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+
+class FeedTopic:
+    """In-process, partitioned append-only log standing in for the chat-messages topic."""
+
+    def __init__(self, topic: str, partitions: int = 3):
+        self.topic = topic
+        self.logs = [[] for _ in range(partitions)]
+        self.committed = [0] * partitions
+        self.cond = threading.Condition()
+
+    def produce(self, key: bytes, value: bytes):
+        with self.cond:
+            partition = zlib.crc32(key) % len(self.logs)
+            log = self.logs[partition]
+            log.append(FeedMessage(self.topic, partition, len(log), key, value))
+            self.cond.notify_all()
+
+    def produced(self) -> int:
+        with self.cond:
+            return sum(len(log) for log in self.logs)
+
+    def wait_committed(self, total: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while sum(self.committed) < total:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+
+class FeedConsumer:
+    """The confluent_kafka Consumer calls consumer.start_consumer makes, served from a FeedTopic."""
+
+    def __init__(self, feed: FeedTopic, conf: dict = None):
+        self.feed = feed
+        self.positions = {}
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        from confluent_kafka import TopicPartition
+        with self.feed.cond:
+            self.positions = {p: self.feed.committed[p] for p in range(len(self.feed.logs))}
+        if on_assign:
+            on_assign(self, [TopicPartition(self.feed.topic, p) for p in self.positions])
+
+    def _take(self, count: int):
+        batch = []
+        for partition, log in enumerate(self.feed.logs):
+            position = self.positions[partition]
+            taken = log[position:position + count - len(batch)]
+            self.positions[partition] = position + len(taken)
+            batch.extend(taken)
+            if len(batch) >= count:
+                break
+        return batch
+
+    def consume(self, num_messages=1, timeout=-1):
+        deadline = time.monotonic() + (timeout if timeout >= 0 else 3600)
+        with self.feed.cond:
+            while True:
+                batch = self._take(num_messages)
+                remaining = deadline - time.monotonic()
+                if batch or remaining <= 0:
+                    return batch
+                self.feed.cond.wait(remaining)
+
+    def commit(self, offsets=None, asynchronous=True):
+        with self.feed.cond:
+            for tp in offsets or []:
+                self.feed.committed[tp.partition] = max(self.feed.committed[tp.partition], tp.offset)
+            self.feed.cond.notify_all()
+
+    def seek(self, partition):
+        with self.feed.cond:
+            self.positions[partition.partition] = partition.offset
+
+    def assignment(self):
+        from confluent_kafka import TopicPartition
+        return [TopicPartition(self.feed.topic, p) for p in self.positions]
+
+    def position(self, partitions):
+        from confluent_kafka import TopicPartition
+        return [TopicPartition(tp.topic, tp.partition, self.positions[tp.partition]) for tp in partitions]
+
+    def get_watermark_offsets(self, partition, timeout=None, cached=False):
+        return 0, len(self.feed.logs[partition.partition])
+
+    def close(self):
+        pass
+
+
+# --- Stub LLM ---------------------------------------------------------------
+
+def llm_app():
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+    # Leading messages seen before count as prefix-cache hits, like a provider's prompt cache.
+    seen_prefixes = set()
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        if BENCH_LLM_ERROR_RATE and random.random() < BENCH_LLM_ERROR_RATE:
+            return JSONResponse({"error": {"message": "stub overloaded"}}, status_code=503)
+
+        model = body.get("model", "bench")
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4 + 1
+        cached_tokens = 0
+        for i, message in enumerate(messages[:-1]):
+            prefix = hashlib.sha1(json.dumps(messages[:i + 1], sort_keys=True).encode()).hexdigest()
+            if prefix not in seen_prefixes:
+                seen_prefixes.add(prefix)
+                break
+            cached_tokens += len(message.get("content") or "") // 4
+        tokens = [random.choice(WORDS) + " " for _ in range(BENCH_LLM_ANSWER_TOKENS)]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        created = int(time.time())
+        interval = 1.0 / BENCH_LLM_TOKENS_PER_S if BENCH_LLM_TOKENS_PER_S > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(BENCH_LLM_LATENCY_MS / 1000.0 + interval * len(tokens))
+            return {
+                "id": "bench", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        def chunk(delta, finish_reason=None, **extra):
+            choices = [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []
+            frame = {"id": "bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": choices, **extra}
+            return f"data: {json.dumps(frame)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(BENCH_LLM_LATENCY_MS / 1000.0)
+            started = time.monotonic()
+            for i, token in enumerate(tokens):
+                # Paced against the start so the rate holds even when sleeps overshoot.
+                delay = started + i * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+# --- Backend ----------------------------------------------------------------
+
+def install_stand_ins(feed: FeedTopic, embeddings: str) -> MemoryMongo:
+    """Points the resource registry and the consumer at the local stand-ins."""
+    import resources
+    import consumer
+    from qdrant_client import QdrantClient
+
+    mongo = MemoryMongo()
+    resources.resource("qdrant")(lambda: QdrantClient(location=":memory:"))
+    resources.resource("mongo")(lambda: mongo)
+    if embeddings == "hash":
+        resources.resource("embeddings")(HashEmbeddings)
+    consumer.Consumer = lambda conf: FeedConsumer(feed, conf)
+    # kafka_config() insists on credentials; nothing connects with them.
+    for name in ("KAFKA_BROKER", "KAFKA_USERNAME", "KAFKA_PASSWORD"):
+        os.environ.setdefault(name, "in-process")
+    return mongo
+
+
+def produce(feed: FeedTopic, docs, names: dict):
+    from backfill import to_message
+    for doc in docs:
+        payload = {"type": "send_message", "payload": to_message(doc, names)}
+        feed.produce(str(doc["_id"]).encode(), json.dumps(payload).encode("utf-8"))
+
+
+def feed_continuously(feed, collection, names, args, stop: threading.Event):
+    """Keeps producing new messages at args.ingest_rate per second while the load runs."""
+    rng = random.Random(args.seed + 1)
+    index = args.messages
+    while not stop.is_set():
+        started = time.monotonic()
+        docs = [make_message(rng, args.seed, index + i, args.channels, args.users,
+                             to_mongo(datetime.now(timezone.utc)))
+                for i in range(max(1, int(args.ingest_rate / 10)))]
+        index += len(docs)
+        collection.insert_many(docs)
+        produce(feed, docs, names)
+        stop.wait(max(0.0, 0.1 - (time.monotonic() - started)))
+
+
+def run_backend(args):
+    import consumer
+    feed = FeedTopic(consumer.INGEST_TOPIC, args.partitions)
+    mongo = install_stand_ins(feed, args.embeddings)
+    messages_collection = mongo["streamify_db"]["messages"]
+
+    user_docs, docs = make_corpus(args.seed, args.messages, args.channels, args.users)
+    mongo["streamify_db"]["users"].insert_many(user_docs)
+    messages_collection.insert_many(docs)
+    names = {u["_id"]: u["fullName"] for u in user_docs}
+
+    stop = threading.Event()
+    ingest = threading.Thread(target=consumer.start_consumer, args=(stop, "bench"), name="ingest", daemon=True)
+    ingest.start()
+
+    logger.info("📦 Ingesting %d message(s) across %d partition(s)...", len(docs), args.partitions)
+    started = time.perf_counter()
+    produce(feed, docs, names)
+    produced = time.perf_counter() - started
+    finished = feed.wait_committed(len(docs), timeout=args.ingest_timeout)
+    elapsed = time.perf_counter() - started
+    report = {
+        "pid": os.getpid(),
+        "ingest": {
+            "messages": len(docs),
+            "completed": finished,
+            "seconds": round(elapsed, 3),
+            "produce_seconds": round(produced, 3),
+            "messages_per_sec": round(len(docs) / elapsed, 2) if elapsed else 0.0,
+            "consumer": consumer.ingest_stats.snapshot(),
+        },
+    }
+    logger.info("✅ Ingested %d message(s) in %.2fs", len(docs), elapsed)
+
+    if args.ingest_rate > 0:
+        threading.Thread(target=feed_continuously, args=(feed, messages_collection, names, args, stop),
+                         name="feeder", daemon=True).start()
+
+    from celery.signals import worker_ready
+    from celery_worker import celery
+
+    @worker_ready.connect
+    def write_report(**kwargs):
+        # benchmark.py starts the load once this file exists.
+        with open(args.report + ".tmp", "w") as f:
+            json.dump(report, f)
+        os.replace(args.report + ".tmp", args.report)
+
+    try:
+        celery.worker_main([
+            "worker", "--pool=threads", f"--concurrency={args.concurrency}", "--loglevel=WARNING",
+            "--without-gossip", "--without-mingle", "--without-heartbeat",
+        ])
+    finally:
+        stop.set()
+        ingest.join(timeout=10)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Local stand-ins for benchmark.py.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    llm_parser = commands.add_parser("llm", help="OpenAI-compatible stub server")
+    llm_parser.add_argument("--port", type=int, default=8090)
+
+    backend_parser = commands.add_parser("backend", help="ingest + Celery worker on in-process stand-ins")
+    backend_parser.add_argument("--report", required=True, help="JSON file written once the worker is ready")
+    backend_parser.add_argument("--seed", type=int, default=42)
+    backend_parser.add_argument("--messages", type=int, default=5000)
+    backend_parser.add_argument("--channels", type=int, default=10)
+    backend_parser.add_argument("--users", type=int, default=50)
+    backend_parser.add_argument("--partitions", type=int, default=3)
+    backend_parser.add_argument("--concurrency", type=int, default=8, help="Celery worker threads")
+    backend_parser.add_argument("--embeddings", choices=["hash", "model"], default="hash",
+                                help="hash vectors, or the configured embedding model/service")
+    backend_parser.add_argument("--ingest-rate", type=float, default=0,
+                                help="messages per second produced while the load runs")
+    backend_parser.add_argument("--ingest-timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    if args.command == "llm":
+        import uvicorn
+        uvicorn.run(llm_app(), host="127.0.0.1", port=args.port, log_level="warning")
+    else:
+        run_backend(args)
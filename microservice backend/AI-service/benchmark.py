@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import logging
+import argparse
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import httpx
+import redis
+import websockets
+import bench_stubs
+from bench_stubs import TOPICS, channel_ids, user_ids
+
+logger = logging.getLogger(__name__)
+
+# Load and latency benchmark of the AI service against local stand-ins
+# (see bench_stubs.py); only Redis has to be running.
+#
+#   python benchmark.py --requests 500 --concurrency 50 --messages 20000
+#
+# Starts the stub LLM, the backend (ingest + Celery worker) and server.py,
+# measures the initial bulk ingest, then drives POST / with one WebSocket
+# per simulated user. Results are written as JSON; --compare prints the
+# change against an earlier run.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS = [
+    "What did people say about {topic}?",
+    "Who talked about {topic} and what did they decide?",
+    "Is anything still open around {topic}?",
+    "What was the outcome of {topic}?",
+]
+# (path in the results, label, higher is better)
+COMPARED = [
+    ("ingest.messages_per_sec", "ingest msgs/s", True),
+    ("ai.throughput_rps", "answers/s", True),
+    ("ai.e2e_ms.p50", "e2e p50 ms", False),
+    ("ai.e2e_ms.p95", "e2e p95 ms", False),
+    ("ai.e2e_ms.p99", "e2e p99 ms", False),
+    ("ai.ttft_ms.p50", "first frame p50 ms", False),
+    ("ai.ttft_ms.p95", "first frame p95 ms", False),
+    ("ai.accept_ms.p99", "POST p99 ms", False),
+    ("memory.api.peak_rss_mb", "api peak MB", False),
+    ("memory.backend.peak_rss_mb", "backend peak MB", False),
+]
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(p):
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))], 2)
+
+    return {
+        "count": len(ordered), "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": at(0.50), "p90": at(0.90), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1], 2),
+    }
+
+
+def process_memory(pid: int) -> Optional[dict]:
+    """Current and peak resident set size from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    mb = lambda name: round(int(fields[name].split()[0]) / 1024, 1) if name in fields else None  # noqa: E731
+    return {"rss_mb": mb("VmRSS"), "peak_rss_mb": mb("VmHWM")}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Stack:
+    """The stub LLM, backend and API server processes of one run."""
+
+    def __init__(self, args, env: dict, workdir: str):
+        self.args, self.env, self.workdir = args, env, workdir
+        self.processes: Dict[str, subprocess.Popen] = {}
+
+    def spawn(self, name: str, argv: List[str]):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        self.processes[name] = subprocess.Popen(argv, cwd=BASE_DIR, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        logger.info("🚀 Started %s (pid %d), log in %s", name, self.processes[name].pid, log.name)
+
+    def check_alive(self):
+        for name, process in self.processes.items():
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with {process.returncode}, see {self.workdir}/{name}.log")
+
+    async def wait_http(self, url: str, timeout: float = 120):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                self.check_alive()
+                try:
+                    if (await client.get(url, timeout=2)).status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.25)
+        raise TimeoutError(f"{url} not up after {timeout}s")
+
+    async def wait_file(self, path: str, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.check_alive()
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+            await asyncio.sleep(0.5)
+        raise TimeoutError(f"backend not ready after {timeout}s")
+
+    def memory(self) -> dict:
+        return {name: process_memory(process.pid) for name, process in self.processes.items()}
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for name, process in self.processes.items():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                logger.warning("⚠️ %s did not stop, killing it", name)
+                process.kill()
+
+
+class LoadResults:
+    def __init__(self):
+        self.accept_ms, self.ttft_ms, self.e2e_ms = [], [], []
+        self.rejected = self.errors = self.timeouts = self.coalesced = 0
+
+    def summary(self, requests: int, seconds: float) -> dict:
+        return {
+            "requests": requests,
+            "completed": len(self.e2e_ms),
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "coalesced": self.coalesced,
+            "seconds": round(seconds, 3),
+            "throughput_rps": round(len(self.e2e_ms) / seconds, 2) if seconds else 0.0,
+            "accept_ms": percentiles(self.accept_ms),
+            "ttft_ms": percentiles(self.ttft_ms),
+            "e2e_ms": percentiles(self.e2e_ms),
+        }
+
+
+async def simulated_user(index: int, args, api: str, http: httpx.AsyncClient, tickets: asyncio.Queue,
+                         results: LoadResults):
+    """One WebSocket plus sequential questions until the shared ticket queue is empty."""
+    rng = random.Random(args.seed * 1000 + index)
+    user_id = user_ids(args.seed, args.users)[index % args.users]
+    channel_id = channel_ids(args.seed, args.channels)[index % args.channels]
+    ws_url = api.replace("http://", "ws://") + f"/ws/{channel_id}?authId={user_id}"
+
+    async with websockets.connect(ws_url, max_size=None, open_timeout=30) as ws:
+        while True:
+            try:
+                number = tickets.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # Numbered so no two questions coalesce or hit the semantic cache.
+            query = rng.choice(QUESTIONS).format(topic=rng.choice(TOPICS)) + f" (#{number})"
+            started = time.perf_counter()
+            try:
+                response = await http.post(f"{api}/", json={"query": query, "userId": user_id, "channelId": channel_id})
+            except httpx.HTTPError:
+                results.errors += 1
+                continue
+            accepted = time.perf_counter()
+            if response.status_code == 429:
+                results.rejected += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            if response.status_code != 200:
+                results.errors += 1
+                continue
+            body = response.json()
+            results.coalesced += bool(body.get("coalesced"))
+
+            first = None
+            try:
+                async with asyncio.timeout(args.timeout):
+                    while True:
+                        frame = json.loads(await ws.recv())
+                        if frame.get("task_id") != body["task_id"]:
+                            continue  # a late frame of an earlier, timed-out question
+                        if first is None:
+                            first = time.perf_counter()
+                        if frame.get("type") == "done":
+                            break
+            except TimeoutError:
+                results.timeouts += 1
+                continue
+            done = time.perf_counter()
+            results.accept_ms.append((accepted - started) * 1000)
+            results.ttft_ms.append((first - started) * 1000)
+            results.e2e_ms.append((done - started) * 1000)
+
+
+async def sample_memory(stack: Stack, peaks: dict, stop: asyncio.Event):
+    # VmHWM already tracks the peak; sampling adds the RSS seen while under load.
+    while not stop.is_set():
+        for name, usage in stack.memory().items():
+            if usage and usage["rss_mb"] is not None:
+                peaks[name] = max(peaks.get(name, 0.0), usage["rss_mb"])
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except TimeoutError:
+            pass
+
+
+async def run(args) -> dict:
+    redis_client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db, decode_responses=True)
+    try:
+        redis_client.ping()
+    except redis.RedisError as e:
+        raise SystemExit(f"Redis at {args.redis_host}:{args.redis_port} is required: {e}")
+    # Leftover queues, rate buckets and metrics from an earlier run would skew this one.
+    logger.info("🧹 Flushing Redis db %d for the run", args.redis_db)
+    redis_client.flushdb()
+
+    workdir = os.path.abspath(os.path.join(args.output_dir, "logs"))
+    os.makedirs(workdir, exist_ok=True)
+    env = {
+        **os.environ,
+        "REDIS_HOST": args.redis_host, "REDIS_PORT": str(args.redis_port), "REDIS_DB": str(args.redis_db),
+        "REDIS_URL": f"redis://{args.redis_host}:{args.redis_port}/{args.redis_db}",
+        "QDRANT_COLLECTION": "bench_messages",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "OPENAI_API_KEY": "bench",
+        "LLM_MODEL": "bench-model", "LLM_MODELS": "bench-model",
+        "AI_EXECUTION_MODE": "celery",
+        "AI_RATE_LIMIT_ENABLED": "false",
+        "AI_MAX_QUEUE_DEPTH": str(max(args.requests, 1000)),
+        "INGEST_LAG_REPORT_S": "1",
+        "METRICS_FLUSH_S": "1",
+        "PYTHONUNBUFFERED": "1",
+    }
+    env.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+    env.setdefault("AI_WARMUP", "true")
+
+    report_path = os.path.join(workdir, "backend-ready.json")
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    api = f"http://127.0.0.1:{args.api_port}"
+    stack = Stack(args, env, workdir)
+    peaks, stop_sampling = {}, asyncio.Event()
+    try:
+        stack.spawn("llm", [sys.executable, "bench_stubs.py", "llm", "--port", str(args.llm_port)])
+        await stack.wait_http(f"http://127.0.0.1:{args.llm_port}/health")
+        stack.spawn("backend", [
+            sys.executable, "bench_stubs.py", "backend", "--report", report_path, "--seed", str(args.seed),
+            "--messages", str(args.messages), "--channels", str(args.channels), "--users", str(args.users),
+            "--partitions", str(args.partitions), "--concurrency", str(args.worker_concurrency),
+            "--embeddings", args.embeddings, "--ingest-rate", str(args.ingest_rate),
+        ])
+        stack.spawn("api", [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                            "--port", str(args.api_port), "--log-level", "warning"])
+        sampler = asyncio.create_task(sample_memory(stack, peaks, stop_sampling))
+        backend = await stack.wait_file(report_path, timeout=args.ingest_timeout)
+        logger.info("📦 Ingest: %s msgs/s", backend["ingest"]["messages_per_sec"])
+        await stack.wait_http(f"{api}/health")
+
+        tickets = asyncio.Queue()
+        for number in range(args.requests):
+            tickets.put_nowait(number)
+        results = LoadResults()
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        logger.info("🏁 %d question(s) from %d concurrent user(s)...", args.requests, args.concurrency)
+        started = time.perf_counter()
+        async with httpx.AsyncClient(limits=limits, timeout=30) as http:
+            await asyncio.gather(*(simulated_user(i, args, api, http, tickets, results)
+                                   for i in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            service_stats = (await http.get(f"{api}/stats")).json()
+        memory = stack.memory()
+        stop_sampling.set()
+        await sampler
+    finally:
+        stack.stop()
+
+    for name, usage in memory.items():
+        if usage:
+            usage["sampled_peak_rss_mb"] = peaks.get(name)
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+        "stub_llm": {
+            "latency_ms": bench_stubs.BENCH_LLM_LATENCY_MS, "tokens_per_s": bench_stubs.BENCH_LLM_TOKENS_PER_S,
+            "answer_tokens": bench_stubs.BENCH_LLM_ANSWER_TOKENS, "error_rate": bench_stubs.BENCH_LLM_ERROR_RATE,
+        },
+        "ingest": backend["ingest"],
+        "ai": results.summary(args.requests, elapsed),
+        "memory": memory,
+        "service_stats": service_stats,
+    }
+
+
+def lookup(results: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(results, dict) or part not in results:
+            return None
+        results = results[part]
+    return results
+
+
+def compare(current: dict, previous: dict) -> str:
+    lines = [f"{'metric':<22}{'before':>12}{'after':>12}{'change':>10}"]
+    for path, label, higher_is_better in COMPARED:
+        before, after = lookup(previous, path), lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  ⚠️" if worse and abs(change) >= 10 else ""
+        lines.append(f"{label:<22}{before:>12}{after:>12}{change:>+9.1f}%{flag}")
+    return "\n".join(lines)
+
+
+def print_summary(results: dict):
+    ai, ingest = results["ai"], results["ingest"]
+    print(f"\nIngest: {ingest['messages']} msgs in {ingest['seconds']}s = {ingest['messages_per_sec']} msgs/s")
+    print(f"AI: {ai['completed']}/{ai['requests']} answered in {ai['seconds']}s = {ai['throughput_rps']}/s "
+          f"(rejected {ai['rejected']}, errors {ai['errors']}, timeouts {ai['timeouts']})")
+    for name in ("accept_ms", "ttft_ms", "e2e_ms"):
+        stats = ai[name]
+        if stats["count"]:
+            print(f"  {name:<10} p50={stats['p50']} p95={stats['p95']} p99={stats['p99']} max={stats['max']}")
+    for name, usage in results["memory"].items():
+        if usage:
+            print(f"  memory {name:<8} rss={usage['rss_mb']}MB peak={usage['peak_rss_mb']}MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="AI service load and latency benchmark on local stand-ins.")
+    parser.add_argument("--requests", type=int, default=200, help="questions to send in total")
+    parser.add_argument("--concurrency", type=int, default=20, help="simulated users, one WebSocket each")
+    parser.add_argument("--messages", type=int, default=5000, help="chat messages ingested before the load")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--partitions", type=int, default=3)
+    parser.add_argument("--worker-concurrency", type=int, default=16, help="Celery worker threads")
+    parser.add_argument("--embeddings", choices=["hash", "model"], default="hash")
+    parser.add_argument("--ingest-rate", type=float, default=0, help="messages/s ingested during the load")
+    parser.add_argument("--ingest-timeout", type=float, default=600)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for one answer")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--api-port", type=int, default=8093)
+    parser.add_argument("--llm-port", type=int, default=8090)
+    parser.add_argument("--redis-host", default=os.getenv("REDIS_HOST", "localhost"))
+    parser.add_argument("--redis-port", type=int, default=int(os.getenv("REDIS_PORT", 6379)))
+    parser.add_argument("--redis-db", type=int, default=15, help="flushed at the start of the run")
+    parser.add_argument("--output-dir", default="bench_results")
+    parser.add_argument("--output", help="results file (default: <output-dir>/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = args.output or os.path.join(args.output_dir, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print_summary(results)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n" + compare(results, json.load(f)))
@@ -1,13 +1,87 @@
 # celery_worker.py
 from celery import Celery
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
 import os
+import resources
+import retrieval
+import context
+import turn_writer
+import metrics
 
 redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# Answers reach clients through response streams (response_stream.py), so
+# Celery's result backend is only written when explicitly asked for, and by
+# the digest chord members (ai_task.digest_part), which opt in per task.
+CELERY_STORE_RESULTS = os.getenv("CELERY_STORE_RESULTS", "false").lower() == "true"
 
 celery = Celery(
     "ai_tasks",
     broker=redis_url,     
-    backend=redis_url  
+    backend=redis_url
 )
+celery.conf.task_ignore_result = not CELERY_STORE_RESULTS
+# Vector retention (compaction.py) runs on this schedule under `celery -A celery_worker beat`.
+VECTOR_COMPACTION_INTERVAL_S = float(os.getenv("VECTOR_COMPACTION_INTERVAL_S", 86400))
+celery.conf.beat_schedule = {
+    "compact-vectors": {"task": "ai.compact_vectors", "schedule": VECTOR_COMPACTION_INTERVAL_S},
+}
+
+_initialized_pid = None
+_flushed_pid = None
+
+
+def init_process():
+    """Per-process setup; runs once per process whichever signal gets here first."""
+    global _initialized_pid
+    if _initialized_pid == os.getpid():
+        return
+    _initialized_pid = os.getpid()
+    # Each pool process builds its own clients instead of inheriting the parent's across fork.
+    resources.reset()
+    if resources.AI_WARMUP:
+        names = ["embeddings", "qdrant", "openai", "messages_collection", "tokenizer"]
+        if retrieval.RERANK_ENABLED:
+            names.append("reranker")
+        resources.warm_up(names)
+    else:
+        # Loaded from the bundled file, so the first question doesn't pay for it.
+        resources.warm_up(["tokenizer"])
+    # Start flushing right away so idle processes still join profiling runs.
+    metrics.ensure_flusher()
+
+
+def flush_process():
+    global _flushed_pid
+    if _flushed_pid == os.getpid():
+        return
+    _flushed_pid = os.getpid()
+    # Conversation turns still waiting in the write-behind queue.
+    turn_writer.flush()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    init_process()
+
+
+@worker_init.connect
+def init_worker(sender=None, **kwargs):
+    # Thread and solo pools (compose runs --pool=threads) run tasks in the main
+    # process, which never gets worker_process_init; prefork's parent runs none.
+    if not issubclass(get_implementation(sender.pool_cls), PreforkPool):
+        init_process()
+
+
+@worker_process_shutdown.connect
+def flush_turns(**kwargs):
+    flush_process()
+
+
+@worker_shutdown.connect
+def flush_worker_turns(**kwargs):
+    flush_process()
+
 
 import ai_task  
\ No newline at end of file
@@ -1,35 +1,28 @@
-import os
+import asyncio
+import logging
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from openai import OpenAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from typing import Optional, List
-from pymongo import MongoClient
+from qdrant_client import models
+from typing import Optional, Callable, Awaitable
 from bson import ObjectId
-from prompt import get_system_prompt
+from prompt import get_system_prompt, render_question
+from context import build_context, build_context_async
+from summary import summarize_window, WindowSummary
+import summary_cache
+import semantic_cache
+import retrieval
+import turn_writer
+import resources
+import llm
+import metrics
 
 load_dotenv()
 
-_openai_client = OpenAI(
-    base_url= os.getenv("OPENAI_BASE_URL"),
-    api_key = os.getenv("OPENAI_API_KEY")
-)
+logger = logging.getLogger(__name__)
 
-_embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-_qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"))
-
-_vector_store = QdrantVectorStore(
-    client=_qdrant_client,
-    collection_name=os.getenv("QDRANT_COLLECTION"),
-    embedding=_embedding_model,
-)
-
-MONGO_URI = os.getenv("MONGO_URI")
-_mongo_client = MongoClient(MONGO_URI)
-db = _mongo_client["streamify_db"]
-_messages_collection = db["messages"]
+AI_USER_ID = "6908f424d1e6c64d8c83d2e5"
+# Shown instead of provider error text when every model in the chain failed.
+AI_UNAVAILABLE_REPLY = "The AI assistant is having trouble right now, please try again in a moment."
 
 
 def extract_period(query: str) -> Optional[str]:
@@ -62,122 +55,42 @@ def get_time_range(period: str):
     return start, now
 
 
-def filter_docs_by_time(docs, start: datetime, end: datetime) -> List:
-    filtered = []
-    for doc in docs:
-        ts_str = doc.metadata.get("createdAt")
-        if not ts_str: continue
-        try:
-            ts = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-            if start <= ts <= end:
-                filtered.append(doc)
-        except:
-            continue
-    return filtered
-
-
-def format_context(docs) -> str:
-    lines = []
-    for d in docs:
-        meta = d.metadata
-        sender = meta.get("sender", "Unknown")
-        ts = meta.get("createdAt", "N/A")
-        try:
-            date = ts.split("T")[0]
-            time = ts.split("T")[1][:5]
-            timestamp = f"{date} {time}"
-        except:
-            timestamp = ts
-        text = d.page_content.strip()
-        lines.append(f"[{timestamp}] {sender}: {text}")
-    return "\n".join(lines)
-
-
-def answer_with_ai(query: str, user_id: str, channel_id: str) -> str:
-    global _embedding_model, _qdrant_client, _vector_store, _mongo_client, _openai_client, _messages_collection
-
-    if _embedding_model is None:
-        _embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    if _qdrant_client is None:
-        _qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"))
-    if _vector_store is None:
-        _vector_store = QdrantVectorStore(
-            client=_qdrant_client,
-            collection_name=os.getenv("QDRANT_COLLECTION"),
-            embedding=_embedding_model,
-        )
-    if _openai_client is None:
-        _openai_client = OpenAI(
-            base_url=os.getenv("OPENAI_BASE_URL"),
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-    if _mongo_client is None:
-        _mongo_client = MongoClient(os.getenv("MONGO_URI"))
-        db = _mongo_client["streamify_db"]
-        _messages_collection = db["messages"]
+def build_search_filter(channel_id: str, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> models.Filter:
+    """Qdrant payload filter for one channel, optionally bounded to [start, end]."""
+    must = [
+        models.FieldCondition(key="metadata.channelId", match=models.MatchValue(value=channel_id)),
+    ]
+    if start and end:
+        must.append(models.FieldCondition(
+            key="metadata.createdAtTs",
+            range=models.Range(gte=start.timestamp(), lte=end.timestamp()),
+        ))
+    return models.Filter(must=must)
 
-    query = query.strip()
-    if not query:
-        return "Please ask a question or request a summary."
 
-    period = extract_period(query)
-    is_summary = period is not None
+def complete_chat(messages, on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Runs one chat completion (with retries and fallback models) and returns its text.
 
-    try:
-        print("Starting vector search...")  # Debug
-        results = _vector_store.similarity_search(query)
-        print(f"Vector search results count: {len(results)}")  # Debug
-    except Exception as e:
-        print(f"Vector search error: {e}")  # Debug
-        return f"Vector search error: {e}"
+    With on_delta the completion is streamed and every content delta is handed
+    to it as it arrives.
+    """
+    return llm.complete(resources.get("openai"), messages, on_delta)
 
-    try:
-        results = [doc for doc in results if doc.metadata.get("channelId") == channel_id]
-        print(f"Results after channelId filter: {len(results)}")  # Debug
-    except Exception as e:
-        print(f"ChannelId filter error: {e}")  # Debug
-        return f"ChannelId filter error: {e}"
 
+def build_question_messages(query: str, user_id: str, context: str) -> list:
+    logger.debug("Context length: %d", len(context))
 
-    # Time filters
-    if is_summary:
-        start, end = get_time_range(period)
-        print(f"Time range: {start} to {end}")  # Debug
-        if not start:
-            print("Invalid time period.")  # Debug
-            return "Invalid time period."
-        docs = filter_docs_by_time(results, start, end)
-        print(f"Filtered docs count: {len(docs)}")  # Debug
-        if not docs:
-            print(f"No messages found for {period}")  # Debug
-            return f"No messages found for **{period.replace('_', ' ')}**."
-    else:
-        docs = results
-
-    context = format_context(docs)
-    print(f"Context length: {len(context)}")  # Debug
-
-    SYSTEM_PROMPT = get_system_prompt(is_summary)
-    user_query = f"""
-**User Question**: {query}
-** User ID**: {user_id}
-**Chat Context** (newest first):
-{context}
-"""
-
-    try:
-        response = _openai_client.chat.completions.create(
-            model="tngtech/deepseek-r1t2-chimera:free",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user",   "content": user_query}
-            ]
-        )
-        print("OpenAI response received.")  # Debug
-    except Exception as e:
-        print(f"OpenAI error: {str(e)}")  # Debug
-        return f"AI error: {str(e)}"
-    
+    # Static system prompt first: its bytes are identical on every call.
+    return [
+        {"role": "system", "content": get_system_prompt(False)},
+        {"role": "user",   "content": render_question(context, user_id, query)}
+    ]
+
+
+def build_turn_docs(query: str, answer: str, user_id: str, channel_id: str) -> list:
+    """The user's query and the AI's answer as they are stored in the messages collection."""
     now = datetime.now(timezone.utc)
 
     query_doc ={
@@ -189,20 +102,180 @@ def answer_with_ai(query: str, user_id: str, channel_id: str) -> str:
         "isAi" :  True,
         "user" : ObjectId(user_id)
     }
-    print(f"Inserting query_doc: {query_doc}")  # Debug
-    _messages_collection.insert_one(query_doc)
 
     ai_doc = {
-        "sender" :  ObjectId("6908f424d1e6c64d8c83d2e5"),  # AI user ID
+        "sender" :  ObjectId(AI_USER_ID),
         "channelId": channel_id,
-        "text": response.choices[0].message.content.strip(),
+        "text": answer,
         "createdAt": now,
         "isRead" :  True,
         "isAi" :  True,
         "user" : ObjectId(user_id)
     }
-    print(f"Inserting ai_doc: {ai_doc}") 
-    _messages_collection.insert_one(ai_doc)
+    return [query_doc, ai_doc]
+
+
+def answer_question(query: str, user_id: str, channel_id: str,
+                    on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """RAG path: top-k channel messages from Qdrant, then one LLM call."""
+    # The channel filter is applied inside Qdrant, so candidates are drawn
+    # only from this channel's messages (dense + BM25, see retrieval.py).
+    with metrics.span("embed"):
+        query_embedding = resources.get("embeddings").embed_query(query)
+    with metrics.span("retrieval"):
+        docs = retrieval.search_channel(query, query_embedding, build_search_filter(channel_id))
+    logger.debug("Vector search results count: %d", len(docs))
+
+    # The query embedding doubles as the semantic cache key.
+    fingerprint = semantic_cache.context_fingerprint(docs)
+    with metrics.span("semantic_cache"):
+        cached = semantic_cache.lookup(channel_id, user_id, query_embedding, fingerprint)
+    if cached is not None:
+        logger.debug("Semantic cache hit")
+        return cached
+
+    with metrics.span("context"):
+        messages = build_question_messages(query, user_id, build_context(docs, channel_id))
+    with metrics.span("llm"):
+        answer = complete_chat(messages, on_delta)
+    semantic_cache.store(channel_id, user_id, query, query_embedding, fingerprint, answer)
+    return answer
+
+
+def summarize_period(channel_id: str, period: str, start: datetime, end: datetime,
+                     on_delta: Optional[Callable[[str], None]] = None) -> Optional[str]:
+    """
+    Summary of the channel's messages in [start, end], served from the rolling cache when possible.
+
+    Summaries read the whole window from Mongo instead of a top-k sample. A
+    fresh cache entry is returned as is; a stale one is extended with only the
+    messages newer than its high-water mark.
+    """
+    cached = summary_cache.get(channel_id, period, start)
+    if cached and not cached["stale"]:
+        logger.debug("Summary cache hit")
+        metrics.inc("summary_cache_requests_total", result="hit")
+        return cached["summary"]
+    metrics.inc("summary_cache_requests_total", result="stale" if cached else "miss")
+
+    previous = WindowSummary(cached["summary"], cached["hwm"]) if cached else None
+    with metrics.span("summary"):
+        result = summarize_window(resources.get("messages_collection"), channel_id, start, end, complete_chat, on_delta, previous)
+    if result is None:
+        return None
+    summary_cache.put(channel_id, period, start, result.text, result.last_message_at)
+    return result.text
+
+
+def answer_with_ai(query: str, user_id: str, channel_id: str,
+                   on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Answers a question (or summarizes a period) from the channel's chat history.
+
+    When on_delta is given the completion is streamed and every text delta is
+    passed to it as it arrives; the full answer is still returned and persisted.
+    """
+    query = query.strip()
+    if not query:
+        return "Please ask a question or request a summary."
+
+    period = extract_period(query)
+    is_summary = period is not None
+
+    if is_summary:
+        start, end = get_time_range(period)
+        logger.debug("Time range: %s to %s", start, end)
+        if not start:
+            logger.warning("⚠️ Invalid time period %s", period)
+            return "Invalid time period."
+
+        try:
+            answer = summarize_period(channel_id, period, start, end, on_delta)
+        except Exception as e:
+            logger.warning("⚠️ Summary error: %s", e)
+            return AI_UNAVAILABLE_REPLY
+        if answer is None:
+            logger.debug("No messages found for %s", period)
+            return f"No messages found for **{period.replace('_', ' ')}**."
+    else:
+        try:
+            answer = answer_question(query, user_id, channel_id, on_delta)
+        except Exception as e:
+            logger.warning("⚠️ LLM error: %s", e)
+            return AI_UNAVAILABLE_REPLY
+
+    # Written behind the reply: the caller publishes the answer while the
+    # turn waits for the next batched insert_many.
+    turn_writer.submit(build_turn_docs(query, answer, user_id, channel_id))
+
+    return answer
+
+
+# --- asyncio pipeline (AI_EXECUTION_MODE=async, see async_worker.py) ---
+
+async def complete_chat_async(messages, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    return await llm.complete_async(resources.get("async_openai"), messages, on_delta)
+
+
+async def answer_question_async(query: str, user_id: str, channel_id: str,
+                                on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    with metrics.span("embed"):
+        query_embedding = await resources.get("embeddings").aembed_query(query)
+    with metrics.span("retrieval"):
+        docs = await retrieval.search_channel_async(query, query_embedding, build_search_filter(channel_id))
+
+    fingerprint = semantic_cache.context_fingerprint(docs)
+    with metrics.span("semantic_cache"):
+        cached = await asyncio.to_thread(semantic_cache.lookup, channel_id, user_id, query_embedding, fingerprint)
+    if cached is not None:
+        return cached
+
+    with metrics.span("context"):
+        context = await build_context_async(docs, channel_id)
+    with metrics.span("llm"):
+        answer = await complete_chat_async(build_question_messages(query, user_id, context), on_delta)
+    await asyncio.to_thread(semantic_cache.store, channel_id, user_id, query, query_embedding, fingerprint, answer)
+    return answer
+
+
+async def answer_with_ai_async(query: str, user_id: str, channel_id: str,
+                               on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """
+    asyncio counterpart of answer_with_ai with the same replies and persistence.
+
+    Questions run fully on async clients. Summaries reuse the thread-based
+    map-reduce engine via asyncio.to_thread; their deltas are bridged back
+    onto the event loop.
+    """
+    query = query.strip()
+    if not query:
+        return "Please ask a question or request a summary."
+
+    period = extract_period(query)
+    if period is not None:
+        start, end = get_time_range(period)
+        if not start:
+            return "Invalid time period."
+
+        sync_delta = None
+        if on_delta is not None:
+            loop = asyncio.get_running_loop()
+            sync_delta = lambda delta: asyncio.run_coroutine_threadsafe(on_delta(delta), loop).result()
+        try:
+            answer = await asyncio.to_thread(summarize_period, channel_id, period, start, end, sync_delta)
+        except Exception as e:
+            logger.warning("⚠️ Summary error: %s", e)
+            return AI_UNAVAILABLE_REPLY
+        if answer is None:
+            return f"No messages found for **{period.replace('_', ' ')}**."
+    else:
+        try:
+            answer = await answer_question_async(query, user_id, channel_id, on_delta)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("⚠️ LLM error: %s", e)
+            return AI_UNAVAILABLE_REPLY
 
-    print("Returning AI response.")  # Debug
-    return response.choices[0].message.content.strip()
+    turn_writer.submit(build_turn_docs(query, answer, user_id, channel_id))
+    return answer
@@ -0,0 +1,296 @@
+import os
+import time
+import uuid
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from qdrant_client import models
+import resources
+import consumer
+import summary
+import metrics
+from redis_client import redis_client
+from admission import RELEASE_LUA
+
+logger = logging.getLogger(__name__)
+
+# Retention for chat vectors. Points older than a channel's retention are
+# deleted, moved to an archive collection, or folded into one "daily digest"
+# point per (channel, UTC day), so the live collection grows with recent
+# activity instead of with the platform's whole history. Runs from Celery
+# beat (ai.compact_vectors) or as `python -m compaction`.
+
+VECTOR_RETENTION_DAYS = float(os.getenv("VECTOR_RETENTION_DAYS", 0))  # 0 keeps vectors forever
+VECTOR_COMPACTION_MODE = os.getenv("VECTOR_COMPACTION_MODE", "delete")  # "delete", "archive" or "digest"
+VECTOR_ARCHIVE_COLLECTION = os.getenv("VECTOR_ARCHIVE_COLLECTION", f"{consumer.QDRANT_COLLECTION}_archive")
+VECTOR_DIGEST_LLM = os.getenv("VECTOR_DIGEST_LLM", "true").lower() == "true"
+VECTOR_DIGEST_MAX_CHARS = int(os.getenv("VECTOR_DIGEST_MAX_CHARS", 2000))
+VECTOR_COMPACTION_BATCH = int(os.getenv("VECTOR_COMPACTION_BATCH", 256))
+VECTOR_COMPACTION_MAX_CHANNELS = int(os.getenv("VECTOR_COMPACTION_MAX_CHANNELS", 100000))
+VECTOR_COMPACTION_LOCK_TTL_S = int(os.getenv("VECTOR_COMPACTION_LOCK_TTL_S", 3600))
+
+# Per-channel retention in days (hash field = channelId), overriding the default; 0 keeps forever.
+RETENTION_KEY = "vector_retention:days"
+LOCK_KEY = "vector_compaction:lock"
+DAY_S = 86400
+DIGEST_KIND = "digest"
+
+# Deletes the lock only if it still holds this run's token.
+_release = redis_client.register_script(RELEASE_LUA)
+
+
+def set_retention(channel_id: str, days: Optional[float]):
+    """Overrides one channel's retention; None goes back to VECTOR_RETENTION_DAYS."""
+    if days is None:
+        redis_client.hdel(RETENTION_KEY, channel_id)
+    else:
+        redis_client.hset(RETENTION_KEY, channel_id, days)
+
+
+def retention_overrides() -> Dict[str, float]:
+    return {channel: float(days) for channel, days in redis_client.hgetall(RETENTION_KEY).items()}
+
+
+def old_points_filter(channel_id: str, cutoff: float, since: Optional[float] = None) -> models.Filter:
+    """The channel's raw chunks created before `cutoff` (digests are never compacted again)."""
+    return models.Filter(
+        must=[
+            models.FieldCondition(key="metadata.channelId", match=models.MatchValue(value=channel_id)),
+            models.FieldCondition(key="metadata.createdAtTs", range=models.Range(gte=since, lt=cutoff)),
+        ],
+        must_not=[
+            models.FieldCondition(key="metadata.kind", match=models.MatchValue(value=DIGEST_KIND)),
+        ],
+    )
+
+
+def channels_with_old_points(cutoff: float) -> List[str]:
+    """Channels holding points older than `cutoff`, via a facet over the tenant index."""
+    response = resources.get("qdrant").facet(
+        collection_name=consumer.QDRANT_COLLECTION,
+        key="metadata.channelId",
+        facet_filter=models.Filter(
+            must=[models.FieldCondition(key="metadata.createdAtTs", range=models.Range(lt=cutoff))],
+            must_not=[models.FieldCondition(key="metadata.kind", match=models.MatchValue(value=DIGEST_KIND))],
+        ),
+        limit=VECTOR_COMPACTION_MAX_CHANNELS,
+        exact=True,
+    )
+    return [str(hit.value) for hit in response.hits]
+
+
+def cutoffs(now: float, channel: Optional[str] = None) -> Dict[str, float]:
+    """{channelId: cutoff epoch} for every channel with a finite retention and old points."""
+    overrides = retention_overrides()
+    if channel is not None:
+        days = overrides.get(channel, VECTOR_RETENTION_DAYS)
+        return {channel: now - days * DAY_S} if days > 0 else {}
+
+    finite = [days for days in [VECTOR_RETENTION_DAYS, *overrides.values()] if days > 0]
+    if not finite:
+        return {}
+    result = {}
+    # Only channels with points older than the shortest retention can have anything to compact.
+    for channel_id in channels_with_old_points(now - min(finite) * DAY_S):
+        days = overrides.get(channel_id, VECTOR_RETENTION_DAYS)
+        if days > 0:
+            result[channel_id] = now - days * DAY_S
+    return result
+
+
+def scroll_old(channel_id: str, cutoff: float, with_vectors: bool = False, since: Optional[float] = None):
+    """Yields pages of the channel's points created in [since, cutoff)."""
+    qdrant_client = resources.get("qdrant")
+    offset = None
+    while True:
+        records, offset = qdrant_client.scroll(
+            collection_name=consumer.QDRANT_COLLECTION, scroll_filter=old_points_filter(channel_id, cutoff, since),
+            limit=VECTOR_COMPACTION_BATCH, offset=offset, with_payload=True, with_vectors=with_vectors,
+        )
+        if records:
+            yield records
+        if offset is None:
+            return
+
+
+def delete_ids(ids):
+    if ids:
+        resources.get("qdrant").delete(
+            collection_name=consumer.QDRANT_COLLECTION,
+            points_selector=models.PointIdsList(points=ids), wait=True,
+        )
+
+
+def ensure_archive():
+    if not resources.get("qdrant").collection_exists(VECTOR_ARCHIVE_COLLECTION):
+        consumer.create_collection(VECTOR_ARCHIVE_COLLECTION)
+        logger.info("🗄️ Created archive collection '%s'", VECTOR_ARCHIVE_COLLECTION)
+
+
+def compact_delete(channel_id: str, cutoff: float) -> int:
+    qdrant_client = resources.get("qdrant")
+    selector = old_points_filter(channel_id, cutoff)
+    count = qdrant_client.count(consumer.QDRANT_COLLECTION, count_filter=selector, exact=True).count
+    if count:
+        qdrant_client.delete(
+            collection_name=consumer.QDRANT_COLLECTION,
+            points_selector=models.FilterSelector(filter=selector), wait=True,
+        )
+    return count
+
+
+def compact_archive(channel_id: str, cutoff: float) -> int:
+    ensure_archive()
+    qdrant_client = resources.get("qdrant")
+    moved = 0
+    # Each page is written to the archive before it is deleted, so a crash only leaves duplicates there.
+    for records in scroll_old(channel_id, cutoff, with_vectors=True):
+        qdrant_client.upsert(
+            collection_name=VECTOR_ARCHIVE_COLLECTION, wait=True,
+            points=[models.PointStruct(id=r.id, vector=r.vector, payload=r.payload) for r in records],
+        )
+        delete_ids([r.id for r in records])
+        moved += len(records)
+    return moved
+
+
+def digest_id(channel_id: str, day: str) -> str:
+    return str(uuid.uuid5(consumer.POINT_ID_NAMESPACE, f"{DIGEST_KIND}:{channel_id}:{day}"))
+
+
+def format_line(meta: dict, text: str) -> str:
+    timestamp = datetime.fromtimestamp(meta.get("createdAtTs") or 0, timezone.utc).strftime("%H:%M")
+    return f"[{timestamp}] {meta.get('senderName') or meta.get('senderId') or 'Unknown'}: {text.strip()}"
+
+
+def digest_text(lines: List[str]) -> str:
+    text = None
+    if VECTOR_DIGEST_LLM:
+        try:
+            import chat
+            text = summary.summarize_lines(lines, chat.complete_chat)
+        except Exception as e:
+            logger.warning("⚠️ Digest summary failed, keeping an extract instead: %s", e)
+    # Without the LLM the digest is the day's opening lines.
+    return (text or "\n".join(lines)).strip()[:VECTOR_DIGEST_MAX_CHARS]
+
+
+def build_digest(channel_id: str, day: str, records, previous=None):
+    """(point id, payload) of the day's digest, folding in the digest already stored for it."""
+    records = sorted(records, key=lambda r: (r.payload["metadata"].get("createdAtTs") or 0,
+                                             r.payload["metadata"].get("chunkIndex") or 0))
+    lines = [format_line(r.payload["metadata"], r.payload.get("page_content") or "") for r in records]
+    count = len({r.payload["metadata"].get("messageId") for r in records})
+    if previous is not None:
+        lines.insert(0, f"Earlier digest: {previous.payload.get('page_content', '')}")
+        count += (previous.payload.get("metadata") or {}).get("messageCount", 0)
+
+    text = f"Daily digest for {day}:\n{digest_text(lines)}"
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+    meta = {
+        "messageId": f"{DIGEST_KIND}:{channel_id}:{day}",
+        "channelId": channel_id,
+        "senderId": DIGEST_KIND,
+        "senderName": "Daily digest",
+        "createdAtTs": start,
+        "parentMessageId": None,
+        "chunkIndex": 0,
+        "contentHash": consumer.content_hash(text),
+        "kind": DIGEST_KIND,
+        "day": day,
+        "messageCount": count,
+    }
+    return digest_id(channel_id, day), {"page_content": text, "metadata": meta}
+
+
+def oldest_day(channel_id: str, cutoff: float) -> Optional[float]:
+    """Epoch of the UTC midnight starting the day of the channel's oldest compactable point."""
+    records, _ = resources.get("qdrant").scroll(
+        collection_name=consumer.QDRANT_COLLECTION, scroll_filter=old_points_filter(channel_id, cutoff), limit=1,
+        order_by=models.OrderBy(key="metadata.createdAtTs", direction=models.Direction.ASC),
+        with_payload=["metadata.createdAtTs"],
+    )
+    if not records:
+        return None
+    ts = records[0].payload["metadata"]["createdAtTs"]
+    return ts - ts % DAY_S
+
+
+def compact_digest(channel_id: str, cutoff: float) -> int:
+    # One day in memory at a time: find the oldest remaining day, digest it, repeat.
+    qdrant_client = resources.get("qdrant")
+    replaced = 0
+    while (start := oldest_day(channel_id, cutoff)) is not None:
+        day = datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m-%d")
+        records = [r for page in scroll_old(channel_id, min(start + DAY_S, cutoff), since=start) for r in page]
+        if not records:
+            break
+        previous = qdrant_client.retrieve(
+            collection_name=consumer.QDRANT_COLLECTION, ids=[digest_id(channel_id, day)], with_payload=True,
+        )
+        chunk = build_digest(channel_id, day, records, previous[0] if previous else None)
+        # The digest is stored before the raw chunks go, so search never loses the day entirely.
+        qdrant_client.upsert(
+            collection_name=consumer.QDRANT_COLLECTION, points=consumer.embed_points([chunk]), wait=True,
+        )
+        delete_ids([r.id for r in records])
+        replaced += len(records)
+        logger.info("📰 Digested %d chunk(s) of channel %s on %s", len(records), channel_id, day)
+    return replaced
+
+
+MODES = {"delete": compact_delete, "archive": compact_archive, "digest": compact_digest}
+
+
+def compact(mode: str = VECTOR_COMPACTION_MODE, channel: Optional[str] = None, dry_run: bool = False) -> dict:
+    """
+    Applies retention to every channel (or just `channel`) and returns
+    {channelId: points compacted}. Only one run at a time holds the lock.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown compaction mode {mode!r}")
+    token = uuid.uuid4().hex
+    if not redis_client.set(LOCK_KEY, token, nx=True, ex=VECTOR_COMPACTION_LOCK_TTL_S):
+        logger.info("⏭️ Vector compaction already running, skipping")
+        return {}
+
+    started = time.perf_counter()
+    result = {}
+    try:
+        qdrant_client = resources.get("qdrant")
+        for channel_id, cutoff in cutoffs(time.time(), channel).items():
+            if dry_run:
+                result[channel_id] = qdrant_client.count(
+                    consumer.QDRANT_COLLECTION, count_filter=old_points_filter(channel_id, cutoff), exact=True,
+                ).count
+                continue
+            result[channel_id] = MODES[mode](channel_id, cutoff)
+            if result[channel_id]:
+                metrics.inc("vector_compacted_points_total", result[channel_id], mode=mode)
+    finally:
+        _release(keys=[LOCK_KEY], args=[token])
+
+    logger.info("🧹 Vector compaction (%s%s) done in %.1fs: %d point(s) across %d channel(s)",
+                mode, ", dry run" if dry_run else "", time.perf_counter() - started,
+                sum(result.values()), sum(1 for n in result.values() if n))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply vector retention to the Qdrant chat collection.")
+    parser.add_argument("--mode", choices=sorted(MODES), default=VECTOR_COMPACTION_MODE)
+    parser.add_argument("--channel", default=None, help="only compact this channel")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be compacted")
+    parser.add_argument("--set-retention", nargs=2, metavar=("CHANNEL", "DAYS"),
+                        help="override a channel's retention (DAYS=default clears the override)")
+    args = parser.parse_args()
+
+    if args.set_retention:
+        channel_id, days = args.set_retention
+        set_retention(channel_id, None if days == "default" else float(days))
+        logger.info("📅 Retention of %s set to %s", channel_id, days)
+    else:
+        for channel_id, count in compact(args.mode, args.channel, args.dry_run).items():
+            if count:
+                logger.info("  %s: %d", channel_id, count)
@@ -1,11 +1,24 @@
 import os
 import json
+import time
+import uuid
+import hashlib
 import logging
-from confluent_kafka import Consumer, KafkaException
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import wait as wait_for_exit
+from confluent_kafka import Consumer, KafkaException, TopicPartition
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_qdrant import QdrantVectorStore
-from langchain_core.documents import Document
+from qdrant_client import models
+import resources
+import summary_cache
+import retrieval
+import metrics
+from mongo_utils import to_epoch
+from redis_client import redis_client
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,23 +27,414 @@ CA_PATH = os.path.join(BASE_DIR, "ca.pem")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION")
+EMBEDDING_SIZE = 384  # all-MiniLM-L6-v2 output dimension
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2d0e-3b7a-4c55-9a61-2f7e1b0c9d42")
+CHUNK_SIZE = 1000
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=300)
 
-logger.info("Initializing embedding model and Qdrant vector store...")
+# Storage layout for new collections (existing ones are updated in place):
+# int8 scalar quantization keeps a 4x smaller copy of the vectors in RAM and
+# rescores with the originals, which can then live on disk.
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")  # "none" or "int8"
+QDRANT_ON_DISK_VECTORS = os.getenv("QDRANT_ON_DISK_VECTORS", "false").lower() == "true"
+# Multitenancy (opt-in): every search is filtered to one channel, so collections
+# can build one HNSW graph per channel (payload_m) instead of a global one
+# (m=0), with channelId as a tenant index keeping each channel's points
+# together. Only applied when a collection is created or rebuilt by backfill;
+# switching a live collection would force a full reindex.
+QDRANT_TENANT_HNSW = os.getenv("QDRANT_TENANT_HNSW", "false").lower() == "true"
+HNSW_M = 16
 
-try:
-    embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    logger.info("✅ HuggingFace embedding model loaded successfully.")
-except Exception as e:
-    logger.exception("❌ Failed to load embedding model: %s", e)
-    raise
+# Micro-batching: a batch is flushed once it holds INGEST_BATCH_SIZE messages
+# or INGEST_LINGER_MS has elapsed since its first message arrived.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256))
+INGEST_LINGER_MS = int(os.getenv("INGEST_LINGER_MS", 500))
+INGEST_RETRY_BACKOFF_S = float(os.getenv("INGEST_RETRY_BACKOFF_S", 2.0))
+
+INGEST_TOPIC = "chat-messages"
+INGEST_GROUP_ID = "ai-service-consumer"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))
+INGEST_LAG_REPORT_S = int(os.getenv("INGEST_LAG_REPORT_S", 30))
+INGEST_SHUTDOWN_TIMEOUT_S = int(os.getenv("INGEST_SHUTDOWN_TIMEOUT_S", 30))
+INGEST_LAG_KEY = "ingest:lag"
+# Each worker's snapshot lives under its own key and TTL; the heartbeat zset
+# (worker name -> last report time) lists them, so a dead worker drops out.
+INGEST_HEARTBEATS_KEY = "ingest:heartbeats"
+
+
+class IngestStats:
+    """Thread-safe throughput counters for the ingest pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.messages = 0
+        self.chunks = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.busy_seconds = 0.0
+        self.last_batch = {}
+
+    def record(self, messages: int, chunks: int, seconds: float):
+        with self._lock:
+            self.messages += messages
+            self.chunks += chunks
+            self.batches += 1
+            self.busy_seconds += seconds
+            self.last_batch = {
+                "messages": messages,
+                "chunks": chunks,
+                "seconds": round(seconds, 4),
+                "messages_per_sec": round(messages / seconds, 2) if seconds else 0.0,
+                "chunks_per_sec": round(chunks / seconds, 2) if seconds else 0.0,
+            }
+        metrics.observe("ingest_batch_messages", messages, buckets=metrics.SIZE_BUCKETS)
+        metrics.observe("ingest_batch_seconds", seconds)
+        metrics.inc("ingest_messages_total", messages)
+        metrics.inc("ingest_chunks_total", chunks)
+
+    def record_failure(self):
+        with self._lock:
+            self.failed_batches += 1
+        metrics.inc("ingest_failed_batches_total")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            uptime = time.monotonic() - self.started_at
+            busy = self.busy_seconds
+            return {
+                "messages": self.messages,
+                "chunks": self.chunks,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "uptime_seconds": round(uptime, 2),
+                "messages_per_sec": round(self.messages / uptime, 2) if uptime else 0.0,
+                "chunks_per_sec": round(self.chunks / uptime, 2) if uptime else 0.0,
+                "busy_messages_per_sec": round(self.messages / busy, 2) if busy else 0.0,
+                "busy_chunks_per_sec": round(self.chunks / busy, 2) if busy else 0.0,
+                "last_batch": dict(self.last_batch),
+            }
+
+
+ingest_stats = IngestStats()
+
+
+# Payload fields that retrieval filters on; indexed so filters don't scan the collection.
+# The tenant/principal flags let Qdrant lay storage out by channel, then by time.
+PAYLOAD_INDEXES = {
+    "metadata.channelId": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    if QDRANT_TENANT_HNSW else models.PayloadSchemaType.KEYWORD,
+    "metadata.createdAtTs": models.FloatIndexParams(type=models.FloatIndexType.FLOAT, is_principal=True)
+    if QDRANT_TENANT_HNSW else models.PayloadSchemaType.FLOAT,
+    "metadata.messageId": models.PayloadSchemaType.KEYWORD,
+}
+
+
+def quantization_config():
+    if QDRANT_QUANTIZATION != "int8":
+        return None
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True),
+    )
+
+
+def hnsw_config(bulk_load: bool = False) -> models.HnswConfigDiff:
+    """HNSW settings for the configured layout; bulk_load turns graph building off."""
+    m = 0 if bulk_load else HNSW_M
+    if QDRANT_TENANT_HNSW:
+        return models.HnswConfigDiff(m=0, payload_m=m)
+    return models.HnswConfigDiff(m=m)
+
+
+def create_collection(collection_name: str):
+    """Creates a collection with the configured vector layout and the payload indexes."""
+    qdrant_client = resources.get("qdrant")
+    qdrant_client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(
+            size=EMBEDDING_SIZE, distance=models.Distance.COSINE, on_disk=QDRANT_ON_DISK_VECTORS,
+        ),
+        sparse_vectors_config=retrieval.sparse_vectors_config(),
+        quantization_config=quantization_config(),
+        hnsw_config=hnsw_config(),
+    )
+    logger.info("🆕 Created Qdrant collection '%s'", collection_name)
+    ensure_payload_indexes(collection_name)
+
+
+def ensure_payload_indexes(collection_name: str):
+    # Existing indexes are left as they are, even without the tenant flags:
+    # rebuilding one would drop filtered search to a scan until it's done.
+    qdrant_client = resources.get("qdrant")
+    existing = qdrant_client.get_collection(collection_name).payload_schema
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field in existing:
+            continue
+        qdrant_client.create_payload_index(
+            collection_name=collection_name, field_name=field, field_schema=schema, wait=True,
+        )
+        logger.info("🗂️ Created payload index on %s", field)
+
+
+def ensure_collection():
+    """Creates the Qdrant collection on first run and brings an existing one up to the configured layout."""
+    qdrant_client = resources.get("qdrant")
+    if not qdrant_client.collection_exists(QDRANT_COLLECTION):
+        try:
+            create_collection(QDRANT_COLLECTION)
+            return
+        except Exception:
+            # Another ingest worker may have created it first.
+            if not qdrant_client.collection_exists(QDRANT_COLLECTION):
+                raise
+
+    config = qdrant_client.get_collection(QDRANT_COLLECTION).config
+    vectors = config.params.vectors
+    wants_quantization = quantization_config() is not None and config.quantization_config is None
+    wants_on_disk = QDRANT_ON_DISK_VECTORS and isinstance(vectors, models.VectorParams) and not vectors.on_disk
+    if wants_quantization or wants_on_disk:
+        qdrant_client.update_collection(
+            collection_name=QDRANT_COLLECTION,
+            vectors_config={"": models.VectorParamsDiff(on_disk=True)} if wants_on_disk else None,
+            quantization_config=quantization_config() if wants_quantization else None,
+        )
+        logger.info("🔧 Updated '%s' (int8=%s, on_disk=%s)", QDRANT_COLLECTION, wants_quantization, wants_on_disk)
+    if QDRANT_TENANT_HNSW and config.hnsw_config.m != 0:
+        # Not switched from the ingest path: that would rebuild the whole HNSW index.
+        logger.warning("⚠️ '%s' still has a global HNSW graph; run python -m backfill to get the tenant layout",
+                       QDRANT_COLLECTION)
+    if not retrieval.has_sparse(QDRANT_COLLECTION):
+        # Sparse vectors can't be added to an existing collection; rebuild it with python -m backfill.
+        logger.warning("⚠️ '%s' has no BM25 vectors, search stays dense-only until it is backfilled", QDRANT_COLLECTION)
+
+    ensure_payload_indexes(QDRANT_COLLECTION)
+
+
+def parse_message(msg):
+    """Decodes a Kafka record into (event type, message object)."""
+    try:
+        payload = json.loads(msg.value().decode("utf-8"))
+        return payload.get("type", "send_message"), payload.get("payload", payload)
+    except json.JSONDecodeError:
+        return "send_message", {"text": msg.value().decode("utf-8")}
+
+
+def message_key(message_obj) -> str:
+    """Stable identity of a chat message: its Mongo _id, else a hash of what identifies it."""
+    key = message_obj.get("messageId") or message_obj.get("_id")
+    if key:
+        return str(key)
+    sender = message_obj.get("sender")
+    sender_id = sender.get("_id") if isinstance(sender, dict) else sender
+    raw = "|".join(str(x) for x in (
+        message_obj.get("channelId"), sender_id, message_obj.get("createdAt"), message_obj.get("tempId"),
+        message_obj.get("text"),
+    ))
+    return "h:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def point_id(key: str, chunk_index: int) -> str:
+    """Deterministic Qdrant point id, so redelivered messages overwrite instead of duplicating."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{key}:{chunk_index}"))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def build_meta(message_obj, key: str) -> dict:
+    """Compact payload: only what retrieval, filtering and prompts read."""
+    sender = message_obj.get("sender")
+    if isinstance(sender, dict):
+        sender_id, sender_name = sender.get("_id"), sender.get("fullName")
+    else:
+        sender_id, sender_name = sender, None
+    parent = message_obj.get("parentMessage")
+    if isinstance(parent, dict):
+        parent = parent.get("_id")
+    return {
+        "messageId": key,
+        "channelId": message_obj.get("channelId"),
+        "senderId": sender_id,
+        "senderName": (sender_name or "")[:64] or None,
+        "createdAtTs": to_epoch(message_obj.get("createdAt")),
+        "parentMessageId": parent,
+    }
+
+
+def split_text(text: str):
+    # Nearly every chat message fits in one chunk; skip the splitter for those.
+    if len(text) <= CHUNK_SIZE:
+        return [text] if text.strip() else []
+    return text_splitter.split_text(text)
+
+
+def chunk_points(key: str, text: str, meta: dict):
+    """(point id, payload) for every chunk of a message."""
+    result = []
+    for index, chunk in enumerate(split_text(text)):
+        result.append((
+            point_id(key, index),
+            {"page_content": chunk, "metadata": {**meta, "chunkIndex": index, "contentHash": content_hash(chunk)}},
+        ))
+    return result
+
+
+def stored_hashes(point_ids) -> dict:
+    """{point id: contentHash} for the ids that already exist in the collection."""
+    if not point_ids:
+        return {}
+    records = resources.get("qdrant").retrieve(
+        collection_name=QDRANT_COLLECTION, ids=point_ids, with_payload=["metadata"], with_vectors=False,
+    )
+    return {str(r.id): (r.payload.get("metadata") or {}).get("contentHash") for r in records}
+
+
+def message_filter(key: str) -> models.Filter:
+    return models.Filter(must=[
+        models.FieldCondition(key="metadata.messageId", match=models.MatchValue(value=key)),
+    ])
+
+
+def embed_points(chunks, collection_name: str = QDRANT_COLLECTION):
+    """
+    Embeds (point id, payload) chunks in one call and returns them as Qdrant
+    points, with a BM25 sparse vector next to the dense one when the
+    collection has them.
+    """
+    texts = [payload["page_content"] for _, payload in chunks]
+    vectors = resources.get("embeddings").embed_documents(texts)
+    if not retrieval.has_sparse(collection_name):
+        return [
+            models.PointStruct(id=pid, vector=vector, payload=payload)
+            for (pid, payload), vector in zip(chunks, vectors)
+        ]
+    return [
+        models.PointStruct(id=pid, vector={"": vector, retrieval.SPARSE_VECTOR: retrieval.sparse_document(text)},
+                           payload=payload)
+        for (pid, payload), vector, text in zip(chunks, vectors, texts)
+    ]
+
+
+def upsert_chunks(chunks) -> int:
+    """Embeds and upserts the chunks whose content isn't already stored under the same id."""
+    existing = stored_hashes([pid for pid, _ in chunks])
+    fresh = [(pid, payload) for pid, payload in chunks
+             if existing.get(pid) != payload["metadata"]["contentHash"]]
+    if not fresh:
+        return 0
+
+    points = embed_points(fresh)
+    resources.get("qdrant").upsert(collection_name=QDRANT_COLLECTION, points=points, wait=True)
+    return len(points)
 
-QDRANT_URL = os.getenv("QDRANT_URL")
-QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION")
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300)
 
+def apply_edit(message_obj) -> int:
+    """Re-chunks an edited message in place, keeping the metadata stored with its original points."""
+    key = str(message_obj.get("messageId"))
+    qdrant_client = resources.get("qdrant")
+    records, _ = qdrant_client.scroll(
+        collection_name=QDRANT_COLLECTION, scroll_filter=message_filter(key),
+        limit=1, with_payload=["metadata"], with_vectors=False,
+    )
+    if not records:
+        logger.info("✏️ Edit for unknown message %s ignored", key)
+        return 0
 
-def start_consumer():
-    """Starts a blocking Kafka consumer to process chat messages."""
+    meta = {k: v for k, v in (records[0].payload.get("metadata") or {}).items()
+            if k not in ("chunkIndex", "contentHash")}
+    chunks = chunk_points(key, message_obj.get("text") or "", meta)
+    written = upsert_chunks(chunks)
+
+    # Drop chunks past the new end of the message.
+    qdrant_client.delete(
+        collection_name=QDRANT_COLLECTION,
+        points_selector=models.FilterSelector(filter=models.Filter(
+            must=message_filter(key).must,
+            must_not=[models.HasIdCondition(has_id=[pid for pid, _ in chunks])] if chunks else None,
+        )),
+        wait=True,
+    )
+    return written
+
+
+def apply_delete(message_obj):
+    key = str(message_obj.get("messageId"))
+    resources.get("qdrant").delete(
+        collection_name=QDRANT_COLLECTION,
+        points_selector=models.FilterSelector(filter=message_filter(key)),
+        wait=True,
+    )
+
+
+def collect_batch(consumer):
+    """Blocks for the first message, then lingers until the batch is full or the window closes."""
+    batch = consumer.consume(num_messages=INGEST_BATCH_SIZE, timeout=1.0)
+    if not batch:
+        return []
+
+    deadline = time.monotonic() + INGEST_LINGER_MS / 1000.0
+    while len(batch) < INGEST_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        batch.extend(consumer.consume(num_messages=INGEST_BATCH_SIZE - len(batch), timeout=remaining))
+    return batch
+
+
+def store_batch(messages):
+    """
+    Persists a batch idempotently.
+
+    New messages are embedded in one call and bulk-upserted under
+    deterministic ids, skipping chunks whose content is already stored. Edits
+    and deletes are then applied in topic order.
+
+    Returns (chunk count written, {channelId: newest createdAt epoch in the batch}).
+    """
+    chunks = []
+    changes = []
+    latest_by_channel = {}
+    for msg in messages:
+        event_type, message_obj = parse_message(msg)
+        if event_type == "send_message":
+            text = message_obj.get("text", "") or ""
+            logger.info("📩 New message: %s", text[:80])
+            key = message_key(message_obj)
+            meta = build_meta(message_obj, key)
+            channel_id, ts = meta["channelId"], meta["createdAtTs"]
+            if channel_id and ts and ts > latest_by_channel.get(channel_id, 0):
+                latest_by_channel[channel_id] = ts
+            chunks.extend(chunk_points(key, text, meta))
+        elif event_type in ("message_edited", "message_deleted") and message_obj.get("messageId"):
+            changes.append((event_type, message_obj))
+
+    written = upsert_chunks(chunks) if chunks else 0
+    if len(chunks) > written:
+        logger.info("♻️ Skipped %d chunk(s) already stored", len(chunks) - written)
+
+    for event_type, message_obj in changes:
+        if event_type == "message_edited":
+            written += apply_edit(message_obj)
+        else:
+            apply_delete(message_obj)
+            logger.info("🗑️ Removed points of message %s", message_obj.get("messageId"))
+
+    return written, latest_by_channel
+
+
+def rewind(consumer, messages):
+    """Seeks every partition in the batch back to its first offset so it is redelivered."""
+    first_offsets = {}
+    for msg in messages:
+        key = (msg.topic(), msg.partition())
+        first_offsets[key] = min(first_offsets.get(key, msg.offset()), msg.offset())
+    for (topic, partition), offset in first_offsets.items():
+        consumer.seek(TopicPartition(topic, partition, offset))
+
+
+def kafka_config() -> dict:
     kafka_broker = os.getenv("KAFKA_BROKER")
     kafka_username = os.getenv("KAFKA_USERNAME")
     kafka_password = os.getenv("KAFKA_PASSWORD")
@@ -38,10 +442,12 @@ def start_consumer():
     if not all([kafka_broker, kafka_username, kafka_password]):
         raise ValueError("Missing Kafka configuration (check env vars).")
 
-    conf = {
+    return {
         "bootstrap.servers": kafka_broker,
-        "group.id": "ai-service-consumer",
+        "group.id": INGEST_GROUP_ID,
         "auto.offset.reset": "earliest",
+        # Offsets are committed by hand once a batch is persisted in Qdrant.
+        "enable.auto.commit": False,
         "security.protocol": "SASL_SSL",
         "sasl.mechanisms": "SCRAM-SHA-256",
         "sasl.username": kafka_username,
@@ -52,59 +458,137 @@ def start_consumer():
         "reconnect.backoff.max.ms": 5000,
     }
 
-    logger.info("🧩 Connecting to Kafka broker: %s", kafka_broker)
+
+def next_offsets(messages):
+    """Offsets to commit for a processed batch: last offset + 1 per partition."""
+    last = {}
+    for msg in messages:
+        key = (msg.topic(), msg.partition())
+        last[key] = max(last.get(key, -1), msg.offset())
+    return [TopicPartition(topic, partition, offset + 1) for (topic, partition), offset in last.items()]
+
+
+def report_lag(consumer, worker_name: str):
+    """Logs per-partition lag for this worker's assignment and publishes it to Redis for GET /stats."""
+    assignment = consumer.assignment()
+    if not assignment:
+        return
+    lags = {}
+    for tp in consumer.position(assignment):
+        _, high = consumer.get_watermark_offsets(tp, timeout=5, cached=False)
+        # A partition with nothing consumed yet reports a negative position.
+        lags[f"{tp.topic}[{tp.partition}]"] = high - tp.offset if tp.offset >= 0 else high
+    logger.info("📊 Lag %s", ", ".join(f"{k}={v}" for k, v in sorted(lags.items())))
+
+    ttl = INGEST_LAG_REPORT_S * 4
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.hset(INGEST_LAG_KEY, mapping=lags)
+    pipe.expire(INGEST_LAG_KEY, ttl)
+    pipe.set(worker_key(worker_name), json.dumps(ingest_stats.snapshot()), ex=ttl)
+    pipe.zadd(INGEST_HEARTBEATS_KEY, {worker_name: now})
+    pipe.zremrangebyscore(INGEST_HEARTBEATS_KEY, "-inf", now - ttl)
+    pipe.expire(INGEST_HEARTBEATS_KEY, ttl)
+    pipe.execute()
+
+
+def worker_key(worker_name: str) -> str:
+    return f"ingest:workers:{worker_name}"
+
+
+def worker_snapshots() -> dict:
+    """Stats of the ingest workers that reported within the last few INGEST_LAG_REPORT_S."""
+    names = redis_client.zrangebyscore(INGEST_HEARTBEATS_KEY, time.time() - INGEST_LAG_REPORT_S * 4, "+inf")
+    if not names:
+        return {}
+    snapshots = redis_client.mget([worker_key(name) for name in names])
+    return {name: json.loads(snapshot) for name, snapshot in zip(names, snapshots) if snapshot}
+
+
+def start_consumer(stop_event=None, worker_name: str = "main"):
+    """
+    Runs a blocking Kafka consumer in the ai-service-consumer group until stop_event is set.
+
+    Partitions are assigned by the group coordinator. When some are revoked,
+    messages already pulled from them are dropped from the batch in hand so
+    the new owner reprocesses them from the last commit. Stopping finishes
+    and commits the current batch before leaving the group.
+    """
+    conf = kafka_config()
+    ensure_collection()
+    metrics.ensure_flusher()
+
+    revoked = set()
+
+    def on_assign(consumer, partitions):
+        revoked.difference_update((tp.topic, tp.partition) for tp in partitions)
+        logger.info("📥 [%s] Assigned %s", worker_name, [tp.partition for tp in partitions])
+
+    def on_revoke(consumer, partitions):
+        revoked.update((tp.topic, tp.partition) for tp in partitions)
+        logger.info("📤 [%s] Revoked %s", worker_name, [tp.partition for tp in partitions])
+
+    logger.info("🧩 Connecting to Kafka broker: %s", conf["bootstrap.servers"])
     consumer = Consumer(conf)
-    consumer.subscribe(["chat-messages"])
+    consumer.subscribe([INGEST_TOPIC], on_assign=on_assign, on_revoke=on_revoke)
 
-    logger.info("✅ Kafka consumer started and subscribed to 'chat-messages'.")
+    logger.info(
+        "✅ Kafka consumer %s started and subscribed to '%s' (batch=%d, linger=%dms).",
+        worker_name, INGEST_TOPIC, INGEST_BATCH_SIZE, INGEST_LINGER_MS,
+    )
 
+    last_lag_report = time.monotonic()
     try:
-        while True:
-            msg = consumer.poll(1.0)
-            if msg is None:
+        while not (stop_event and stop_event.is_set()):
+            if time.monotonic() - last_lag_report >= INGEST_LAG_REPORT_S:
+                last_lag_report = time.monotonic()
+                try:
+                    report_lag(consumer, worker_name)
+                except Exception as e:
+                    logger.warning("⚠️ Could not report consumer lag: %s", e)
+
+            batch = collect_batch(consumer)
+            if not batch:
                 continue
 
-            if msg.error():
-                logger.error("❌ Kafka Error: %s", msg.error())
+            messages = []
+            for msg in batch:
+                if msg.error():
+                    logger.error("❌ Kafka Error: %s", msg.error())
+                    continue
+                if (msg.topic(), msg.partition()) in revoked:
+                    continue
+                messages.append(msg)
+
+            if not messages:
                 continue
 
+            started = time.monotonic()
             try:
-                payload = json.loads(msg.value().decode("utf-8"))
-                message_obj = payload.get("payload", payload)
-
-                message_text = message_obj.get("text", "")
-                
-                logger.info("📩 New message: %s", message_text[:80])
-            except json.JSONDecodeError:
-                message_text = msg.value().decode("utf-8")
-                message_obj = {}
-
-            # Extract actual channelId, sender, createdAt from message_obj
-            channel_id = message_obj.get("channelId")
-            sender = message_obj.get("sender")
-            created_at = message_obj.get("createdAt")
-            parent_message = message_obj.get("parentMessage")
-
-
-            meta = {
-                "channelId": channel_id,
-                "sender": sender,
-                "createdAt": created_at,
-                "parentMessage": parent_message,
-            }
-            chunks = text_splitter.split_text(message_text)
-            docs = [Document(page_content=chunk, metadata=meta) for chunk in chunks]
+                chunk_count, latest_by_channel = store_batch(messages)
+            except Exception as e:
+                ingest_stats.record_failure()
+                logger.exception("❌ Failed to store batch of %d message(s) in Qdrant: %s", len(messages), e)
+                rewind(consumer, messages)
+                time.sleep(INGEST_RETRY_BACKOFF_S)
+                continue
+
+            try:
+                consumer.commit(offsets=next_offsets(messages), asynchronous=False)
+            except KafkaException as e:
+                # Usually a rebalance took the partition away; the new owner re-ingests idempotently.
+                logger.warning("⚠️ Offset commit failed: %s", e)
 
             try:
-                QdrantVectorStore.from_documents(
-                    documents=docs,
-                    embedding=embedding_model,
-                    url=QDRANT_URL,
-                    collection_name=QDRANT_COLLECTION,
-                )
-                logger.info("✅ Stored %d chunk(s) in Qdrant", len(chunks))
+                summary_cache.mark_channels_updated(latest_by_channel)
             except Exception as e:
-                logger.exception("❌ Failed to store document in Qdrant: %s", e)
+                logger.warning("⚠️ Could not mark cached summaries stale: %s", e)
+            elapsed = time.monotonic() - started
+            ingest_stats.record(len(messages), chunk_count, elapsed)
+            logger.info(
+                "✅ Stored %d chunk(s) from %d message(s) in Qdrant in %.3fs",
+                chunk_count, len(messages), elapsed,
+            )
 
     except KeyboardInterrupt:
         logger.info("🛑 Kafka consumer manually stopped.")
@@ -112,4 +596,58 @@ def start_consumer():
         logger.exception("Kafka exception: %s", e)
     finally:
         consumer.close()
-        logger.info("🔚 Kafka consumer closed.")
+        logger.info("🔚 Kafka consumer %s closed.", worker_name)
+
+
+def run_worker(index: int, stop_event):
+    """Entry point of one pool process."""
+    # The parent turns SIGTERM/SIGINT into stop_event; the child just finishes its batch.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    start_consumer(stop_event, worker_name=f"{socket.gethostname()}-{os.getpid()}-{index}")
+
+
+def run_pool(workers: int):
+    """Runs `workers` consumer processes in the group, restarting any that die, until SIGTERM."""
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+
+    def stop(signum, frame):
+        logger.info("🛑 Signal %d received, draining in-flight batches...", signum)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = {}
+
+    def spawn(index):
+        process = ctx.Process(target=run_worker, args=(index, stop_event), name=f"ingest-{index}")
+        process.start()
+        processes[index] = process
+
+    for index in range(workers):
+        spawn(index)
+    logger.info("🚀 Started %d ingest worker(s) in group '%s'", workers, INGEST_GROUP_ID)
+
+    while not stop_event.is_set():
+        wait_for_exit([process.sentinel for process in processes.values()], timeout=1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stop_event.is_set():
+                logger.warning("⚠️ Ingest worker %d exited with %s, restarting", index, process.exitcode)
+                spawn(index)
+
+    for process in processes.values():
+        process.join(timeout=INGEST_SHUTDOWN_TIMEOUT_S)
+        if process.is_alive():
+            logger.warning("⚠️ %s did not drain in time, terminating", process.name)
+            process.terminate()
+    logger.info("🔚 Ingest pool stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kafka -> Qdrant ingest for chat messages.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="consumer processes to run (useful up to the partition count of the topic)")
+    args = parser.parse_args()
+    run_pool(max(1, args.workers))
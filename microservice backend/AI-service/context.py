@@ -0,0 +1,257 @@
+import os
+import asyncio
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+import resources
+from mongo_utils import to_epoch, to_mongo
+
+logger = logging.getLogger(__name__)
+
+# Prompt context for questions: the retrieved chunks merged back into whole
+# messages, their thread parents and nearest neighbours pulled from Mongo in
+# one query, packed by priority into a token budget and listed newest first.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_NEIGHBOURS = int(os.getenv("CONTEXT_NEIGHBOURS", 1))
+CONTEXT_NEIGHBOUR_WINDOW_S = int(os.getenv("CONTEXT_NEIGHBOUR_WINDOW_S", 600))
+CONTEXT_EXPANSION_LIMIT = int(os.getenv("CONTEXT_EXPANSION_LIMIT", 200))
+# A tokenizer.json path (the image bundles DeepSeek-R1's, see Dockerfile) or a
+# Hugging Face hub id, downloaded when the tokenizer is first loaded.
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "/opt/tokenizer/tokenizer.json")
+# After a failed load, tokens are estimated and the load retried with doubling backoff.
+CONTEXT_TOKENIZER_RETRY_S = float(os.getenv("CONTEXT_TOKENIZER_RETRY_S", 5))
+CONTEXT_TOKENIZER_RETRY_MAX_S = float(os.getenv("CONTEXT_TOKENIZER_RETRY_MAX_S", 300))
+
+# Packing priority: retrieved hits, then thread parents, then neighbours.
+HIT, PARENT, NEIGHBOUR = 0, 1, 2
+_tokenizer_retry_at = 0.0
+_tokenizer_backoff = CONTEXT_TOKENIZER_RETRY_S
+
+
+@resources.resource("tokenizer")
+def _tokenizer():
+    from tokenizers import Tokenizer
+    if os.path.isfile(CONTEXT_TOKENIZER):
+        return Tokenizer.from_file(CONTEXT_TOKENIZER)
+    return Tokenizer.from_pretrained(CONTEXT_TOKENIZER)
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Token counts with the LLM's tokenizer, falling back to ~4 characters per token."""
+    global _tokenizer_retry_at, _tokenizer_backoff
+    if time.monotonic() >= _tokenizer_retry_at:
+        try:
+            tokenizer = resources.get("tokenizer")
+        except Exception as e:
+            _tokenizer_retry_at = time.monotonic() + _tokenizer_backoff
+            logger.warning("⚠️ Tokenizer unavailable, estimating tokens for %.0fs: %s", _tokenizer_backoff, e)
+            _tokenizer_backoff = min(_tokenizer_backoff * 2, CONTEXT_TOKENIZER_RETRY_MAX_S)
+        else:
+            _tokenizer_backoff = CONTEXT_TOKENIZER_RETRY_S
+            encodings = tokenizer.encode_batch(texts, add_special_tokens=False)
+            return [len(e.ids) for e in encodings]
+    return [len(text) // 4 + 1 for text in texts]
+
+
+def format_sender(meta) -> str:
+    # Compact payloads carry senderId/senderName; older points a nested sender object.
+    sender = meta.get("sender")
+    if isinstance(sender, dict):
+        sender_id, name = sender.get("_id"), sender.get("fullName")
+    else:
+        sender_id, name = meta.get("senderId", sender), meta.get("senderName")
+    if not sender_id and not name:
+        return "Unknown"
+    return f"{name or sender_id} (id: {sender_id})"
+
+
+def format_timestamp(meta) -> str:
+    ts = meta.get("createdAtTs")
+    if ts is not None:
+        return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+    ts = meta.get("createdAt", "N/A")
+    try:
+        date = ts.split("T")[0]
+        time = ts.split("T")[1][:5]
+        return f"{date} {time}"
+    except:
+        return ts
+
+
+def created_at_ts(meta) -> float:
+    ts = meta.get("createdAtTs")
+    if ts is not None:
+        return ts
+    return to_epoch(meta.get("createdAt")) or 0.0
+
+
+def join_overlapping(parts: List[str]) -> str:
+    """Joins consecutive splitter chunks, dropping the text each one repeats from the previous."""
+    text = parts[0]
+    for part in parts[1:]:
+        overlap = next((n for n in range(min(len(text), len(part)), 0, -1) if text.endswith(part[:n])), 0)
+        text += part[overlap:]
+    return text
+
+
+def merge_hits(docs) -> List[dict]:
+    """One entry per message, in retrieval rank order, with its retrieved chunks merged."""
+    by_message: Dict[str, dict] = {}
+    for rank, d in enumerate(docs):
+        meta = d.metadata
+        key = meta.get("messageId") or str(meta.get("_id"))
+        entry = by_message.get(key)
+        if entry is None:
+            entry = by_message[key] = {
+                "key": key, "meta": meta, "ts": created_at_ts(meta), "chunks": {},
+                "priority": (HIT, rank, 0),
+            }
+        entry["chunks"].setdefault(meta.get("chunkIndex", len(entry["chunks"])), d.page_content.strip())
+    for entry in by_message.values():
+        entry["text"] = join_overlapping([entry["chunks"][i] for i in sorted(entry["chunks"])])
+    return list(by_message.values())
+
+
+def _object_id(value) -> Optional[ObjectId]:
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+def expansion_query(hits: List[dict], channel_id: str) -> Optional[dict]:
+    """Single Mongo filter for the thread parents and the time neighbourhood of every hit."""
+    window = timedelta(seconds=CONTEXT_NEIGHBOUR_WINDOW_S)
+    clauses = []
+    parents = [oid for oid in (_object_id(h["meta"].get("parentMessageId")) for h in hits
+                               if h["meta"].get("parentMessageId")) if oid]
+    if parents:
+        clauses.append({"_id": {"$in": parents}})
+    if CONTEXT_NEIGHBOURS > 0:
+        for h in hits:
+            if not h["ts"]:
+                continue
+            at = to_mongo(datetime.fromtimestamp(h["ts"], tz=timezone.utc))
+            clauses.append({"createdAt": {"$gte": at - window, "$lte": at + window}})
+    if not clauses:
+        return None
+    return {
+        "channelId": channel_id,
+        "isAi": {"$ne": True},
+        "text": {"$nin": [None, ""]},
+        "$or": clauses,
+    }
+
+
+EXPANSION_PROJECTION = {"sender": 1, "text": 1, "createdAt": 1, "parentMessage": 1}
+
+
+def expand(hits: List[dict], found: List[dict], names: Dict[str, str]) -> List[dict]:
+    """Turns the expansion query's results into parent and neighbour entries around the hits."""
+    known = {h["key"] for h in hits}
+    by_id = {}
+    for doc in found:
+        key = str(doc["_id"])
+        if key in known:
+            continue
+        sender = str(doc.get("sender")) if doc.get("sender") else None
+        created = doc.get("createdAt")
+        ts = to_epoch(created) if isinstance(created, datetime) else 0.0
+        by_id[key] = {
+            "key": key,
+            "meta": {"senderId": sender, "senderName": names.get(sender), "createdAtTs": ts},
+            "ts": ts,
+            "text": doc["text"].strip(),
+            "priority": None,
+        }
+
+    def claim(key, priority):
+        entry = by_id.get(key)
+        if entry and (entry["priority"] is None or priority < entry["priority"]):
+            entry["priority"] = priority
+
+    ordered = sorted(by_id.values(), key=lambda e: e["ts"])
+    for h in hits:
+        rank = h["priority"][1]
+        parent = h["meta"].get("parentMessageId")
+        if parent:
+            claim(str(parent), (PARENT, rank, 0))
+        if not h["ts"]:
+            continue
+        before = [e for e in ordered if e["ts"] <= h["ts"]][-CONTEXT_NEIGHBOURS:] if CONTEXT_NEIGHBOURS else []
+        after = [e for e in ordered if e["ts"] > h["ts"]][:CONTEXT_NEIGHBOURS]
+        for e in before + after:
+            claim(e["key"], (NEIGHBOUR, rank, abs(e["ts"] - h["ts"])))
+    return [e for e in by_id.values() if e["priority"] is not None]
+
+
+def missing_sender_ids(found: List[dict], hits: List[dict]) -> List[ObjectId]:
+    named = {str(h["meta"].get("senderId")) for h in hits if h["meta"].get("senderName")}
+    return list({doc["sender"] for doc in found if doc.get("sender") and str(doc["sender"]) not in named})
+
+
+def sender_names(hits: List[dict], users: List[dict]) -> Dict[str, str]:
+    names = {str(h["meta"].get("senderId")): h["meta"]["senderName"] for h in hits if h["meta"].get("senderName")}
+    names.update({str(u["_id"]): u.get("fullName") for u in users if u.get("fullName")})
+    return names
+
+
+def pack(entries: List[dict], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Highest-priority entries that fit in `budget` tokens, listed newest first."""
+    lines = {id(e): f"[{format_timestamp(e['meta'])}] {format_sender(e['meta'])}: {e['text']}" for e in entries}
+    by_priority = sorted(entries, key=lambda e: e["priority"])
+    costs = count_tokens([lines[id(e)] for e in by_priority])
+
+    chosen, used = [], 0
+    for entry, cost in zip(by_priority, costs):
+        if used + cost > budget:
+            if chosen:
+                continue
+            # Even the best hit alone is over budget: keep a truncated head of it.
+            lines[id(entry)] = lines[id(entry)][:budget * 4]
+            cost = budget
+        chosen.append(entry)
+        used += cost
+    logger.debug("Context: %d/%d message(s), ~%d token(s)", len(chosen), len(entries), used)
+    chosen.sort(key=lambda e: e["ts"], reverse=True)
+    return "\n".join(lines[id(e)] for e in chosen)
+
+
+def build_context(docs, channel_id: str) -> str:
+    hits = merge_hits(docs)
+    if not hits:
+        return ""
+    query = expansion_query(hits, channel_id)
+    entries = hits
+    if query is not None:
+        messages_collection = resources.get("messages_collection")
+        found = list(messages_collection.find(query, EXPANSION_PROJECTION)
+                     .sort("createdAt", 1).limit(CONTEXT_EXPANSION_LIMIT))
+        missing = missing_sender_ids(found, hits)
+        users = list(messages_collection.database["users"].find({"_id": {"$in": missing}}, {"fullName": 1})) \
+            if missing else []
+        entries = hits + expand(hits, found, sender_names(hits, users))
+    return pack(entries)
+
+
+async def build_context_async(docs, channel_id: str) -> str:
+    hits = merge_hits(docs)
+    if not hits:
+        return ""
+    query = expansion_query(hits, channel_id)
+    entries = hits
+    if query is not None:
+        messages_collection = resources.get("async_messages_collection")
+        cursor = messages_collection.find(query, EXPANSION_PROJECTION).sort("createdAt", 1).limit(CONTEXT_EXPANSION_LIMIT)
+        found = await cursor.to_list(length=None)
+        missing = missing_sender_ids(found, hits)
+        users = await messages_collection.database["users"].find(
+            {"_id": {"$in": missing}}, {"fullName": 1},
+        ).to_list(length=None) if missing else []
+        entries = hits + expand(hits, found, sender_names(hits, users))
+    # Tokenizing is CPU work (and the tokenizer may still be loading); keep it off the event loop.
+    return await asyncio.to_thread(pack, entries)
@@ -0,0 +1,85 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import chat
+import context
+import retrieval
+import resources
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Batch digests: many (channel, period) items answered as one request. The
+# queries of focused items are embedded in one call and their retrievals run
+# concurrently; the LLM work is then split into at most DIGEST_LLM_PARALLELISM
+# parts that run as a Celery chord (see ai_task.generate_digest), and the
+# chord callback publishes one aggregated answer.
+
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", 50))
+DIGEST_LLM_PARALLELISM = int(os.getenv("DIGEST_LLM_PARALLELISM", 4))
+DIGEST_RETRIEVAL_CONCURRENCY = int(os.getenv("DIGEST_RETRIEVAL_CONCURRENCY", 8))
+
+PERIODS = ("today", "yesterday", "last_7_days", "last_30_days")
+
+
+def prepare(items: List[dict]) -> List[dict]:
+    """
+    Numbers the items and attaches the retrieved context of every focused
+    item (one with a query). Plain items are summarized from Mongo later.
+    """
+    items = [{**item, "index": index} for index, item in enumerate(items)]
+    focused = [item for item in items if item.get("query")]
+    if not focused:
+        return items
+
+    queries = list(dict.fromkeys(item["query"] for item in focused))
+    with metrics.span("embed"):
+        vectors = dict(zip(queries, resources.get("embeddings").embed_documents(queries)))
+
+    def fetch(item):
+        start, end = chat.get_time_range(item["period"])
+        docs = retrieval.search_channel(item["query"], vectors[item["query"]],
+                                        chat.build_search_filter(item["channelId"], start, end))
+        return context.build_context(docs, item["channelId"])
+
+    with metrics.span("retrieval"):
+        with ThreadPoolExecutor(max_workers=min(DIGEST_RETRIEVAL_CONCURRENCY, len(focused))) as pool:
+            for item, text in zip(focused, pool.map(fetch, focused)):
+                item["context"] = text
+    return items
+
+
+def split(items: List[dict], parts: int = DIGEST_LLM_PARALLELISM) -> List[List[dict]]:
+    """At most `parts` non-empty slices; each slice runs its LLM calls one after another."""
+    parts = max(1, min(parts, len(items)))
+    return [items[i::parts] for i in range(parts)]
+
+
+def run_item(item: dict, user_id: str) -> dict:
+    period = item["period"]
+    start, end = chat.get_time_range(period)
+    try:
+        if item.get("query"):
+            with metrics.span("llm"):
+                text = chat.complete_chat(chat.build_question_messages(item["query"], user_id, item["context"]))
+        else:
+            text = chat.summarize_period(item["channelId"], period, start, end)
+            if text is None:
+                text = f"No messages found for **{period.replace('_', ' ')}**."
+    except Exception as e:
+        logger.warning("⚠️ Digest item for %s failed: %s", item["channelId"], e)
+        text = chat.AI_UNAVAILABLE_REPLY
+    return {**{k: item.get(k) for k in ("index", "channelId", "title", "period", "query")}, "response": text}
+
+
+def render(results: List[dict]) -> str:
+    """The aggregated answer: one section per item, in request order."""
+    sections = []
+    for result in sorted(results, key=lambda r: r["index"]):
+        heading = result.get("title") or result["channelId"]
+        label = result["period"].replace("_", " ")
+        if result.get("query"):
+            label = f"{label}: {result['query']}"
+        sections.append(f"### {heading} ({label})\n\n{result['response']}")
+    return "\n\n".join(sections)
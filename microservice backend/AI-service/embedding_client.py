@@ -0,0 +1,56 @@
+import os
+from typing import List
+import httpx
+from langchain_core.embeddings import Embeddings
+
+# URL of embedding_server.py, e.g. http://ai-embedder:8004 or unix:///tmp/embedder.sock.
+# When unset, the model is loaded in-process (local development).
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+EMBEDDING_TIMEOUT_S = float(os.getenv("EMBEDDING_TIMEOUT_S", 30))
+
+
+class RemoteEmbeddings(Embeddings):
+    """LangChain Embeddings backed by the shared embedding service."""
+
+    def __init__(self, url: str, timeout: float = EMBEDDING_TIMEOUT_S):
+        self._url = url
+        self._timeout = timeout
+        self._client = self._make_client(httpx.Client, httpx.HTTPTransport)
+        self._async_client = None
+
+    def _make_client(self, client_cls, transport_cls):
+        if self._url.startswith("unix://"):
+            transport = transport_cls(uds=self._url[len("unix://"):])
+            return client_cls(transport=transport, base_url="http://embedder", timeout=self._timeout)
+        return client_cls(base_url=self._url, timeout=self._timeout)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        response = self._client.post("/embed", json={"texts": texts})
+        response.raise_for_status()
+        return response.json()["vectors"]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self._async_client is None:
+            self._async_client = self._make_client(httpx.AsyncClient, httpx.AsyncHTTPTransport)
+        response = await self._async_client.post("/embed", json={"texts": texts})
+        response.raise_for_status()
+        return response.json()["vectors"]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def get_embeddings() -> Embeddings:
+    if EMBEDDING_SERVICE_URL:
+        return RemoteEmbeddings(EMBEDDING_SERVICE_URL)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+# One embedding engine per host. API workers, Celery children and the Kafka
+# consumer call it over HTTP (or a unix socket) instead of each loading MiniLM.
+#
+#   uvicorn embedding_server:app --host 0.0.0.0 --port 8004
+#   uvicorn embedding_server:app --uds /tmp/embedder.sock
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 128))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5))
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", os.cpu_count() or 1))
+# "torch" (default) or "onnx"; ONNX needs `pip install sentence-transformers[onnx]`.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# With the ONNX backend, pick a quantized export, e.g. onnx/model_qint8_avx512.onnx
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE")
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+def load_model():
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(EMBEDDING_TORCH_THREADS)
+    if EMBEDDING_BACKEND == "onnx":
+        model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+        model = SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs=model_kwargs)
+    else:
+        model = SentenceTransformer(EMBEDDING_MODEL)
+    logger.info(
+        "✅ Loaded %s (backend=%s, torch threads=%d)", EMBEDDING_MODEL, EMBEDDING_BACKEND, EMBEDDING_TORCH_THREADS,
+    )
+    return model
+
+
+class DynamicBatcher:
+    """
+    Coalesces concurrent embed requests into one encode call.
+
+    A batch closes when it holds EMBEDDING_MAX_BATCH texts or EMBEDDING_MAX_WAIT_MS
+    after its first request arrived. Encoding runs on a single thread so torch
+    keeps all of its intra-op threads to itself.
+    """
+
+    def __init__(self, model, max_batch: int, max_wait_ms: float):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        # Same preprocessing as HuggingFaceEmbeddings, so vectors match what is already stored.
+        texts = [t.replace("\n", " ") for t in texts]
+        return self.model.encode(texts, batch_size=self.max_batch, show_progress_bar=False).tolist()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            count = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            started = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.encode, texts)
+            except Exception as e:
+                logger.exception("❌ Embedding batch failed: %s", e)
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            self.encode_seconds += time.perf_counter() - started
+
+            offset = 0
+            for item_texts, future in pending:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def stats(self) -> dict:
+        return {
+            "model": EMBEDDING_MODEL,
+            "backend": EMBEDDING_BACKEND,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "texts_per_sec": round(self.texts / self.encode_seconds, 2) if self.encode_seconds else 0.0,
+            "queued": self.queue.qsize(),
+        }
+
+
+batcher = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global batcher
+    batcher = DynamicBatcher(load_model(), EMBEDDING_MAX_BATCH, EMBEDDING_MAX_WAIT_MS)
+    task = asyncio.create_task(batcher.run())
+    try:
+        yield
+    finally:
+        task.cancel()
+        batcher.executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+@app.post("/embed")
+async def embed(req: EmbedRequest):
+    return {"vectors": await batcher.embed(req.texts)}
+
+
+@app.get("/health")
+async def health():
+    return batcher.stats()
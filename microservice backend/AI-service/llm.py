@@ -0,0 +1,429 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+import httpx
+import openai
+from redis_client import redis_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Provider layer for chat completions. Every call gets an overall deadline,
+# retryable failures (429, 5xx, timeouts, dropped connections) are retried
+# with jittered backoff before moving down the fallback model list, and a
+# slow first token can be hedged with a duplicate request. All calls share
+# one HTTP/2 connection pool per process (see resources "openai").
+
+LLM_MODEL = os.getenv("LLM_MODEL", "tngtech/deepseek-r1t2-chimera:free")
+# Ordered fallback chain; the first entry is the primary model.
+LLM_MODELS = [m.strip() for m in os.getenv("LLM_MODELS", LLM_MODEL).split(",") if m.strip()]
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", 60))
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT_S", 5))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 64))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+# Hedging: fixed delay in ms, or with LLM_HEDGING=true and no fixed delay the
+# model's observed p95 time to first token.
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_AFTER_MS = int(os.getenv("LLM_HEDGE_AFTER_MS", 0))
+# Ask for a usage block at the end of streamed answers (OpenAI stream_options).
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+HEDGE_MIN_SAMPLES = 20
+STATS_WINDOW = 200
+LLM_STATS_KEY = "llm:stats"
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class LLMUnavailable(Exception):
+    """Every model in the chain failed or the deadline passed."""
+
+
+class ModelStats:
+    """Rolling latency window and counters for one model in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.first_token = deque(maxlen=STATS_WINDOW)
+        self.total = deque(maxlen=STATS_WINDOW)
+
+    def record(self, first_token_s: float, total_s: float):
+        with self.lock:
+            self.first_token.append(first_token_s)
+            self.total.append(total_s)
+
+    def p95_first_token(self) -> Optional[float]:
+        with self.lock:
+            if len(self.first_token) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.first_token)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            first, total = sorted(self.first_token), sorted(self.total)
+
+        def pct(values, p):
+            return round(values[max(0, int(len(values) * p) - 1)] * 1000, 1) if values else None
+
+        return {
+            "samples": len(total),
+            "ttft_p50_ms": pct(first, 0.5), "ttft_p95_ms": pct(first, 0.95),
+            "total_p50_ms": pct(total, 0.5), "total_p95_ms": pct(total, 0.95),
+        }
+
+
+_stats = {}
+
+
+def model_stats(model: str) -> ModelStats:
+    if model not in _stats:
+        _stats[model] = ModelStats()
+    return _stats[model]
+
+
+def count(model: str, field: str):
+    # Aggregated in process and flushed to Redis by the metrics thread, never on the request path.
+    metrics.inc("llm_events_total", model=model, event=field)
+
+
+def publish_latencies():
+    """Reports this process's latency percentiles per model; runs on the metrics flusher thread."""
+    for model, model_stat in list(_stats.items()):
+        snapshot = model_stat.snapshot()
+        redis_client.hset(LLM_STATS_KEY, mapping={f"{model}:{k}": str(v) for k, v in snapshot.items() if v is not None})
+
+
+metrics.add_flush_hook(publish_latencies)
+
+
+def stats() -> dict:
+    """Per-model counters and latency percentiles (as last reported by any worker)."""
+    result = {}
+    for field, value in redis_client.hgetall(LLM_STATS_KEY).items():
+        model, _, name = field.rpartition(":")
+        result.setdefault(model, {})[name] = float(value) if "." in value else int(value)
+    for labels, value in metrics.counter_values("llm_events_total"):
+        result.setdefault(labels.get("model"), {})[labels.get("event")] = int(value)
+    return result
+
+
+def http_client() -> httpx.Client:
+    return httpx.Client(
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                            keepalive_expiry=60),
+        timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S),
+    )
+
+
+def async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                            keepalive_expiry=60),
+        timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S),
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):  # includes timeouts
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def backoff(attempt: int, error: Exception) -> float:
+    retry_after = None
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), 10.0)
+    except ValueError:
+        pass
+    return min(0.5 * 2 ** attempt, 8.0) * random.uniform(0.5, 1.0)
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    if LLM_HEDGE_AFTER_MS > 0:
+        return LLM_HEDGE_AFTER_MS / 1000.0
+    if LLM_HEDGING:
+        return model_stats(model).p95_first_token()
+    return None
+
+
+def stream_options() -> dict:
+    return {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+
+
+def record_usage(model: str, usage):
+    """Token counts of one answer, into llm_tokens_total, per-request histograms and the request's trace."""
+    if usage is None:
+        return
+    prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    # Prompt tokens the provider served from its prefix cache, where it reports them.
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    metrics.inc("llm_tokens_total", prompt, model=model, kind="prompt")
+    metrics.inc("llm_tokens_total", completion, model=model, kind="completion")
+    metrics.inc("llm_tokens_total", cached, model=model, kind="cached")
+    metrics.observe("llm_prompt_tokens", prompt, buckets=metrics.TOKEN_BUCKETS, model=model)
+    metrics.observe("llm_completion_tokens", completion, buckets=metrics.TOKEN_BUCKETS, model=model)
+    metrics.annotate(model=model, prompt_tokens=prompt, completion_tokens=completion, cached_tokens=cached)
+
+
+def record_latency(model: str, first_token_s: float, total_s: float):
+    model_stats(model).record(first_token_s, total_s)
+    metrics.observe("llm_first_token_seconds", first_token_s, model=model)
+    metrics.observe("llm_request_seconds", total_s, model=model)
+
+
+class _Attempt(threading.Thread):
+    """One request in its own thread, reporting (attempt, kind, value) events to a shared queue."""
+
+    def __init__(self, client, model, messages, stream, timeout, events):
+        super().__init__(daemon=True, name=f"llm-{model}")
+        self.client, self.model, self.messages = client, model, messages
+        self.stream, self.timeout, self.events = stream, timeout, events
+        self.cancelled = threading.Event()
+
+    def run(self):
+        try:
+            if not self.stream:
+                response = self.client.chat.completions.create(
+                    model=self.model, messages=self.messages, timeout=self.timeout,
+                )
+                self.events.put((self, "delta", response.choices[0].message.content or ""))
+                self.events.put((self, "usage", response.usage))
+                self.events.put((self, "done", None))
+                return
+            stream = self.client.chat.completions.create(
+                model=self.model, messages=self.messages, stream=True, timeout=self.timeout,
+                **stream_options(),
+            )
+            with stream:
+                for event in stream:
+                    if self.cancelled.is_set():
+                        return
+                    if event.choices and event.choices[0].delta.content:
+                        self.events.put((self, "delta", event.choices[0].delta.content))
+                    if getattr(event, "usage", None):
+                        self.events.put((self, "usage", event.usage))
+            self.events.put((self, "done", None))
+        except Exception as e:
+            self.events.put((self, "error", e))
+
+
+def _call_once(client, model: str, messages, on_delta, deadline: float, hedge_after: Optional[float]) -> str:
+    """One logical request to `model`, hedged once if the first token is slower than hedge_after."""
+    events = queue.Queue()
+    stream = on_delta is not None
+    started = time.monotonic()
+    attempts = [_Attempt(client, model, messages, stream, deadline - started, events)]
+    attempts[0].start()
+
+    winner, parts, first_token_at, error = None, [], None, None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for a in attempts:
+                a.cancelled.set()
+            raise openai.APITimeoutError(request=httpx.Request("POST", "chat/completions"))
+        wait = remaining
+        if winner is None and hedge_after is not None and len(attempts) == 1:
+            wait = min(wait, max(0.0, started + hedge_after - time.monotonic()))
+        try:
+            attempt, kind, value = events.get(timeout=wait)
+        except queue.Empty:
+            if winner is None and hedge_after is not None and len(attempts) == 1 and time.monotonic() < deadline:
+                logger.info("🪁 Hedging %s after %.0fms without a first token", model, hedge_after * 1000)
+                count(model, "hedges")
+                attempts.append(_Attempt(client, model, messages, stream, deadline - time.monotonic(), events))
+                attempts[-1].start()
+            continue
+
+        if winner is not None and attempt is not winner:
+            continue
+        if kind == "usage":
+            record_usage(model, value)
+            continue
+        if kind == "error":
+            error = value
+            if winner is not None or all(not a.is_alive() or a is attempt for a in attempts):
+                raise error
+            continue
+        if winner is None:
+            winner = attempt
+            first_token_at = time.monotonic()
+            for a in attempts:
+                if a is not winner:
+                    a.cancelled.set()
+            if len(attempts) > 1 and winner is attempts[-1]:
+                count(model, "hedge_wins")
+        if kind == "done":
+            record_latency(model, first_token_at - started, time.monotonic() - started)
+            return "".join(parts).strip()
+        parts.append(value)
+        if on_delta is not None and value:
+            on_delta(value)
+
+
+def complete(client, messages, on_delta: Optional[Callable[[str], None]] = None,
+             models: Optional[List[str]] = None, timeout: float = LLM_TIMEOUT_S) -> str:
+    """
+    Chat completion with retries and fallback models, all within `timeout` seconds.
+
+    With on_delta the answer is streamed; once a delta has been delivered the
+    call can no longer be retried and a failure is raised as is.
+    """
+    deadline = time.monotonic() + timeout
+    last_error = None
+    for model in models or LLM_MODELS:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            delivered = []
+
+            def tracking_delta(delta):
+                delivered.append(delta)
+                on_delta(delta)
+
+            try:
+                count(model, "calls")
+                answer = _call_once(client, model, messages, tracking_delta if on_delta else None,
+                                    deadline, hedge_delay(model))
+                return answer
+            except Exception as e:
+                last_error = e
+                count(model, "errors")
+                logger.warning("⚠️ %s failed (attempt %d): %s", model, attempt + 1, e)
+                if delivered:
+                    raise
+                if not is_retryable(e):
+                    break
+                pause = backoff(attempt, e)
+                if time.monotonic() + pause >= deadline:
+                    raise LLMUnavailable(f"deadline exceeded after {model}: {e}") from e
+                if attempt < LLM_MAX_RETRIES:
+                    time.sleep(pause)
+        count(model, "fallbacks")
+    raise LLMUnavailable(f"all models failed: {last_error}") from last_error
+
+
+# --- asyncio variant (AI_EXECUTION_MODE=async) ---
+
+async def _attempt_async(client, model, messages, stream, timeout, events: asyncio.Queue, tag):
+    try:
+        if not stream:
+            response = await client.chat.completions.create(model=model, messages=messages, timeout=timeout)
+            await events.put((tag, "delta", response.choices[0].message.content or ""))
+            await events.put((tag, "usage", response.usage))
+        else:
+            response = await client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                            timeout=timeout, **stream_options())
+            async with response:
+                async for event in response:
+                    if event.choices and event.choices[0].delta.content:
+                        await events.put((tag, "delta", event.choices[0].delta.content))
+                    if getattr(event, "usage", None):
+                        await events.put((tag, "usage", event.usage))
+        await events.put((tag, "done", None))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await events.put((tag, "error", e))
+
+
+async def _call_once_async(client, model: str, messages, on_delta, deadline: float,
+                           hedge_after: Optional[float]) -> str:
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stream = on_delta is not None
+    started = loop.time()
+    tasks = {0: asyncio.create_task(_attempt_async(client, model, messages, stream, deadline - started, events, 0))}
+    winner, parts, first_token_at = None, [], None
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise openai.APITimeoutError(request=httpx.Request("POST", "chat/completions"))
+            wait = remaining
+            if winner is None and hedge_after is not None and len(tasks) == 1:
+                wait = min(wait, max(0.0, started + hedge_after - loop.time()))
+            try:
+                tag, kind, value = await asyncio.wait_for(events.get(), timeout=wait)
+            except asyncio.TimeoutError:
+                if winner is None and hedge_after is not None and len(tasks) == 1:
+                    count(model, "hedges")
+                    tasks[1] = asyncio.create_task(
+                        _attempt_async(client, model, messages, stream, deadline - loop.time(), events, 1),
+                    )
+                continue
+
+            if winner is not None and tag != winner:
+                continue
+            if kind == "usage":
+                record_usage(model, value)
+                continue
+            if kind == "error":
+                if winner is not None or all(t.done() or i == tag for i, t in tasks.items()):
+                    raise value
+                continue
+            if winner is None:
+                winner, first_token_at = tag, loop.time()
+                for i, t in tasks.items():
+                    if i != winner:
+                        t.cancel()
+                if winner == 1:
+                    count(model, "hedge_wins")
+            if kind == "done":
+                record_latency(model, first_token_at - started, loop.time() - started)
+                return "".join(parts).strip()
+            parts.append(value)
+            if on_delta is not None and value:
+                await on_delta(value)
+    finally:
+        for t in tasks.values():
+            t.cancel()
+
+
+async def complete_async(client, messages, on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                         models: Optional[List[str]] = None, timeout: float = LLM_TIMEOUT_S) -> str:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    last_error = None
+    for model in models or LLM_MODELS:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            delivered = []
+
+            async def tracking_delta(delta):
+                delivered.append(delta)
+                await on_delta(delta)
+
+            try:
+                count(model, "calls")
+                answer = await _call_once_async(client, model, messages, tracking_delta if on_delta else None,
+                                                deadline, hedge_delay(model))
+                return answer
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                count(model, "errors")
+                logger.warning("⚠️ %s failed (attempt %d): %s", model, attempt + 1, e)
+                if delivered:
+                    raise
+                if not is_retryable(e):
+                    break
+                pause = backoff(attempt, e)
+                if loop.time() + pause >= deadline:
+                    raise LLMUnavailable(f"deadline exceeded after {model}: {e}") from e
+                if attempt < LLM_MAX_RETRIES:
+                    await asyncio.sleep(pause)
+        count(model, "fallbacks")
+    raise LLMUnavailable(f"all models failed: {last_error}") from last_error
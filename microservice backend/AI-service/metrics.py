@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Latency histograms and counters for the AI pipeline. Observations are
+# aggregated in process and flushed to Redis hashes every METRICS_FLUSH_S by
+# a background thread, so the API server can render one Prometheus view of
+# every worker process on GET /metrics.
+#
+# Per-request spans are also kept on a context-local trace and logged as one
+# JSON line when the request finishes.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", 5))
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 3072, 4096, 6144, 8192, 16384, 32768)
+
+KEY_PREFIX = "metrics"
+NAMES_KEY = f"{KEY_PREFIX}:names"
+BUCKETS_KEY = f"{KEY_PREFIX}:buckets"
+LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, str], list] = {}
+_buckets: Dict[str, tuple] = {}
+_counters: Dict[Tuple[str, str], float] = {}
+_flusher = None
+_flush_hooks: List[Callable[[], None]] = []
+_pid = None
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def label_string(labels: dict) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()) if v is not None)
+
+
+def observe(name: str, value: float, buckets: tuple = TIME_BUCKETS, **labels):
+    """Adds one observation to histogram `name`."""
+    if not METRICS_ENABLED:
+        return
+    ensure_flusher()
+    key = (name, label_string(labels))
+    with _lock:
+        _buckets.setdefault(name, buckets)
+        counts = _histograms.get(key)
+        if counts is None:
+            counts = _histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds `value` to counter `name`."""
+    if not METRICS_ENABLED:
+        return
+    ensure_flusher()
+    key = (name, label_string(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class span:
+    """Times a pipeline stage into ai_stage_seconds{stage=...} and the current trace."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        observe("ai_stage_seconds", elapsed, stage=self.stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace["spans"].append((self.stage, round(elapsed * 1000, 2)))
+        return False
+
+
+def start_trace(trace_id: str, **fields):
+    _trace.set({"trace_id": trace_id, "started": time.perf_counter(), "spans": [], **fields})
+
+
+def annotate(**fields):
+    trace = _trace.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+def finish_trace() -> Optional[dict]:
+    """Logs the current request's spans as one JSON line and returns them."""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+    trace["total_ms"] = round((time.perf_counter() - trace.pop("started")) * 1000, 2)
+    logger.info("⏱️ %s", json.dumps(trace, default=str))
+    return trace
+
+
+def ensure_flusher():
+    # Each (forked) process flushes its own aggregates.
+    global _flusher, _pid
+    if _flusher is not None and _pid == os.getpid():
+        return
+    with _lock:
+        if _flusher is not None and _pid == os.getpid():
+            return
+        _histograms.clear()
+        _counters.clear()
+        _pid = os.getpid()
+        _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+        _flusher.start()
+
+
+def add_flush_hook(hook: Callable[[], None]):
+    """Runs `hook` on the flusher thread after every flush, for other per-process reporting."""
+    if hook not in _flush_hooks:
+        _flush_hooks.append(hook)
+
+
+def _flush_loop():
+    import profiler
+    while True:
+        time.sleep(METRICS_FLUSH_S)
+        try:
+            flush()
+            profiler.poll()
+            for hook in list(_flush_hooks):
+                hook()
+        except Exception as e:
+            logger.warning("⚠️ Metrics flush failed: %s", e)
+
+
+def flush():
+    with _lock:
+        histograms, counters, buckets = dict(_histograms), dict(_counters), dict(_buckets)
+        _histograms.clear()
+        _counters.clear()
+    if not histograms and not counters:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for name, bounds in buckets.items():
+        pipe.hsetnx(BUCKETS_KEY, name, json.dumps(bounds))
+    for (name, labels), counts in histograms.items():
+        key = f"{KEY_PREFIX}:hist:{name}"
+        pipe.sadd(NAMES_KEY, f"hist:{name}")
+        for index, count in enumerate(counts[:-1]):
+            if count:
+                pipe.hincrby(key, f"{labels}|{index}", count)
+        pipe.hincrbyfloat(key, f"{labels}|sum", counts[-1])
+    for (name, labels), value in counters.items():
+        pipe.sadd(NAMES_KEY, f"counter:{name}")
+        pipe.hincrbyfloat(f"{KEY_PREFIX}:counter:{name}", labels, value)
+    pipe.execute()
+
+
+def _flush_at_exit():
+    if _pid != os.getpid():
+        return
+    try:
+        flush()
+    except Exception as e:
+        logger.warning("⚠️ Final metrics flush failed: %s", e)
+
+
+atexit.register(_flush_at_exit)
+
+
+def counter_values(name: str) -> List[Tuple[Dict[str, str], float]]:
+    """Flushed totals of counter `name` across every process, as (labels, value) pairs."""
+    data = redis_client.hgetall(f"{KEY_PREFIX}:counter:{name}")
+    return [(dict(LABEL_RE.findall(labels)), float(value)) for labels, value in data.items()]
+
+
+def _series(name: str, labels: str, extra: str = "") -> str:
+    inner = ",".join(part for part in (labels, extra) if part)
+    return f"{name}{{{inner}}}" if inner else name
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(gauges: Optional[List[Tuple[str, str, Dict[str, float]]]] = None) -> str:
+    """Prometheus text exposition of every flushed histogram and counter, plus scrape-time gauges."""
+    lines = []
+    bucket_bounds = {name: json.loads(raw) for name, raw in redis_client.hgetall(BUCKETS_KEY).items()}
+    for entry in sorted(redis_client.smembers(NAMES_KEY)):
+        kind, _, name = entry.partition(":")
+        data = redis_client.hgetall(f"{KEY_PREFIX}:{kind}:{name}")
+        if kind == "counter":
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{_series(name, labels)} {_number(float(v))}" for labels, v in sorted(data.items()))
+            continue
+
+        bounds = bucket_bounds.get(name, TIME_BUCKETS)
+        per_labels = {}
+        for field, value in data.items():
+            labels, _, slot = field.rpartition("|")
+            per_labels.setdefault(labels, {})[slot] = value
+        lines.append(f"# TYPE {name} histogram")
+        for labels, slots in sorted(per_labels.items()):
+            cumulative = 0
+            for index, bound in enumerate(list(bounds) + ["+Inf"]):
+                cumulative += int(slots.get(str(index), 0))
+                le = 'le="%s"' % bound
+                lines.append(f"{_series(name + '_bucket', labels, le)} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {_number(float(slots.get('sum', 0)))}")
+            lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+
+    for name, help_text, values in gauges or []:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{_series(name, labels)} {_number(v)}" for labels, v in sorted(values.items()))
+    return "\n".join(lines) + "\n"
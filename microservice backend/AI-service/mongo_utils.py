@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+# Helpers for values read from the messages and users collections.
+
+
+def as_utc(value: datetime) -> datetime:
+    """pymongo hands back naive datetimes that are already UTC; makes them aware."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_mongo(value: datetime) -> datetime:
+    """`value` the way pymongo stores and returns it: naive UTC."""
+    return as_utc(value).replace(tzinfo=None)
+
+
+def to_epoch(value) -> Optional[float]:
+    """Epoch seconds of a Mongo datetime or an ISO-8601 string (e.g. a Kafka createdAt); None if unparseable."""
+    if isinstance(value, datetime):
+        return as_utc(value).timestamp()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def resolve_names(users, docs: Iterable[dict], names: dict) -> dict:
+    """Adds the fullName of every sender in `docs` not yet in `names`, in one query per call."""
+    missing = {d.get("sender") for d in docs if d.get("sender") is not None} - names.keys()
+    if missing:
+        for user in users.find({"_id": {"$in": list(missing)}}, {"fullName": 1}):
+            names[user["_id"]] = user.get("fullName")
+    return names
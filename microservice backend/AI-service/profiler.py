@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from collections import Counter
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Low-overhead sampling profiler that can be switched on at runtime. A run
+# is requested through Redis; every process that records metrics picks it up
+# on its next metrics flush and samples the stacks of all its threads every
+# PROFILER_SAMPLE_MS until the run ends. The collapsed stacks (flamegraph.pl /
+# speedscope format) of all processes are merged in one Redis hash.
+
+PROFILER_ALLOWED = os.getenv("PROFILER_ALLOWED", "false").lower() == "true"
+PROFILER_SAMPLE_MS = int(os.getenv("PROFILER_SAMPLE_MS", 10))
+PROFILER_MAX_SECONDS = 300
+PROFILER_REQUEST_KEY = "profiler:request"
+RESULT_TTL_S = 3600
+
+_handled = set()
+
+
+def results_key(run_id: str) -> str:
+    return f"profiler:stacks:{run_id}"
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample(run_id: str, until: float):
+    """Samples every thread of this process until `until` (epoch seconds) and stores the counts."""
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts = Counter()
+    interval = PROFILER_SAMPLE_MS / 1000.0
+    while time.time() < until:
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                counts[f"{names.get(ident, ident)};{_stack(frame)}"] += 1
+        time.sleep(interval)
+
+    pipe = redis_client.pipeline(transaction=False)
+    for stack, count in counts.items():
+        pipe.hincrby(results_key(run_id), stack, count)
+    pipe.hincrby(results_key(run_id), f"__processes__;{socket.gethostname()}-{os.getpid()}", 1)
+    pipe.expire(results_key(run_id), RESULT_TTL_S)
+    pipe.execute()
+    logger.info("🔬 Profile %s: %d sample(s) from pid %d", run_id, sum(counts.values()), os.getpid())
+
+
+def start(run_id: str, until: float):
+    if (run_id, os.getpid()) in _handled:
+        return
+    _handled.add((run_id, os.getpid()))
+    threading.Thread(target=sample, args=(run_id, until), name="profiler", daemon=True).start()
+
+
+def request(seconds: int) -> str:
+    """Asks every process (this one included) to profile for `seconds`; returns the run id."""
+    seconds = max(1, min(int(seconds), PROFILER_MAX_SECONDS))
+    run_id = uuid.uuid4().hex[:12]
+    until = time.time() + seconds
+    redis_client.set(PROFILER_REQUEST_KEY, json.dumps({"id": run_id, "until": until}), ex=seconds)
+    start(run_id, until)
+    return run_id
+
+
+def poll():
+    """Called from the metrics flush loop: joins a profiling run that is in progress."""
+    raw = redis_client.get(PROFILER_REQUEST_KEY)
+    if not raw:
+        return
+    run = json.loads(raw)
+    if run["until"] > time.time():
+        start(run["id"], run["until"])
+
+
+def collapsed(run_id: str) -> str:
+    stacks = redis_client.hgetall(results_key(run_id))
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda kv: -int(kv[1])))
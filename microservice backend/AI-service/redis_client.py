@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio as aioredis
 import os
 from dotenv import load_dotenv
 
@@ -15,5 +16,23 @@ redis_client = redis.Redis(
     decode_responses=True  
 )
 
+# For binary values (e.g. packed float32 vectors in semantic_cache.py).
+redis_bytes_client = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+)
+
+# Used from the FastAPI event loop (WebSocket fan-out); never block on redis_client there.
+async_redis_client = aioredis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=True
+)
+
 def get_pubsub():
     return redis_client.pubsub(ignore_subscribe_messages=True)
+
+def get_async_pubsub():
+    return async_redis_client.pubsub(ignore_subscribe_messages=True)
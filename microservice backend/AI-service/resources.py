@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Heavy clients (embedding model, Qdrant, OpenAI, Mongo) are created on first
+# use and owned by the process that created them. A forked child (Celery
+# prefork) never reuses its parent's instances, which matters for pymongo.
+
+PROCESS_STARTED_AT = time.monotonic()
+AI_WARMUP = os.getenv("AI_WARMUP", "false").lower() == "true"
+
+_factories = {}
+_instances = {}
+_init_seconds = {}
+_pid = os.getpid()
+_lock = threading.RLock()
+_ready_at = None
+
+
+def resource(name):
+    """Decorator registering a zero-argument factory under `name`."""
+    def wrap(factory):
+        _factories[name] = factory
+        return factory
+    return wrap
+
+
+def get(name):
+    """Returns this process's instance of `name`, creating it on first use."""
+    if os.getpid() != _pid:
+        reset()
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            started = time.monotonic()
+            _instances[name] = _factories[name]()
+            _init_seconds[name] = time.monotonic() - started
+            logger.info("🔌 Initialized %s in %.2fs", name, _init_seconds[name])
+        return _instances[name]
+
+
+def reset():
+    """Forgets every instance (without closing it) so this process builds its own."""
+    global _pid
+    with _lock:
+        _instances.clear()
+        _init_seconds.clear()
+        _pid = os.getpid()
+
+
+def warm_up(names=None, background=True):
+    """Initializes the given resources (all by default), optionally in a daemon thread."""
+    def run():
+        global _ready_at
+        for name in list(_factories) if names is None else names:
+            try:
+                get(name)
+            except Exception as e:
+                # The rest still warm up; a failed one is retried on first use.
+                logger.exception("❌ Warm-up of %s failed: %s", name, e)
+        _ready_at = time.monotonic()
+        logger.info("✅ Warm-up finished %.2fs after process start", _ready_at - PROCESS_STARTED_AT)
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name="resource-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness() -> dict:
+    return {
+        "warm": _ready_at is not None,
+        "warm_after_seconds": round(_ready_at - PROCESS_STARTED_AT, 3) if _ready_at else None,
+        "resources": {
+            name: {"ready": name in _instances, "init_seconds": round(_init_seconds.get(name, 0.0), 3)}
+            for name in _factories
+        },
+    }
+
+
+@resource("embeddings")
+def _embeddings():
+    from embedding_client import get_embeddings
+    return get_embeddings()
+
+
+@resource("qdrant")
+def _qdrant():
+    from qdrant_client import QdrantClient
+    return QdrantClient(url=os.getenv("QDRANT_URL"))
+
+
+@resource("openai")
+def _openai():
+    from openai import OpenAI
+    import llm
+    # Retries, deadlines and fallbacks are handled by llm.complete.
+    return OpenAI(
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=llm.http_client(),
+        max_retries=0,
+    )
+
+
+@resource("mongo")
+def _mongo():
+    from pymongo import MongoClient
+    return MongoClient(os.getenv("MONGO_URI"))
+
+
+@resource("messages_collection")
+def _messages_collection():
+    return get("mongo")["streamify_db"]["messages"]
+
+
+# Async clients for the asyncio execution mode; each binds to the loop it is first used on.
+
+@resource("async_qdrant")
+def _async_qdrant():
+    from qdrant_client import AsyncQdrantClient
+    return AsyncQdrantClient(url=os.getenv("QDRANT_URL"))
+
+
+@resource("async_openai")
+def _async_openai():
+    from openai import AsyncOpenAI
+    import llm
+    return AsyncOpenAI(
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=llm.async_http_client(),
+        max_retries=0,
+    )
+
+
+@resource("async_messages_collection")
+def _async_messages_collection():
+    from pymongo import AsyncMongoClient
+    return AsyncMongoClient(os.getenv("MONGO_URI"))["streamify_db"]["messages"]
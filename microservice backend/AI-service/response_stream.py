@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import asyncio
+from typing import List, Optional, Tuple
+from redis_client import redis_client, async_redis_client
+
+# Durable delivery of AI answers. Every chunk/done frame is appended to a
+# capped Redis Stream per (channel, user) and then announced on pub/sub with
+# its stream id, so a WebSocket that was reconnecting can resume from the
+# last id it saw instead of the user asking again. The final frame of each
+# task is also kept under the task id for GET /result/{task_id}.
+
+AI_RESPONSE_STREAM_MAXLEN = int(os.getenv("AI_RESPONSE_STREAM_MAXLEN", 500))
+AI_RESPONSE_STREAM_TTL_S = int(os.getenv("AI_RESPONSE_STREAM_TTL_S", 86400))
+AI_RESULT_TTL_S = int(os.getenv("AI_RESULT_TTL_S", 3600))
+# When enabled, the answer is published as sequence-numbered "chunk" frames while
+# the LLM generates it, followed by a final "done" frame carrying the full text.
+AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"
+# Deltas are coalesced so a fast model doesn't turn every token into a Redis publish.
+AI_STREAM_FLUSH_MS = int(os.getenv("AI_STREAM_FLUSH_MS", 50))
+
+# KEYS[1] the (channel, user) stream, KEYS[2] (final frames only) the task's
+# result stream. ARGV: maxlen, frame JSON, stream TTL, result TTL, pub/sub
+# channel. The published copy carries the stream id.
+APPEND_FRAME_LUA = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'frame', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if KEYS[2] then
+  redis.call('XADD', KEYS[2], 'MAXLEN', '1', '*', 'frame', ARGV[2])
+  redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+redis.call('PUBLISH', ARGV[5], '{"id":"' .. id .. '",' .. string.sub(ARGV[2], 2))
+return id
+"""
+
+_append = redis_client.register_script(APPEND_FRAME_LUA)
+_append_async = async_redis_client.register_script(APPEND_FRAME_LUA)
+
+
+def stream_key(channel_id: str, user_id: str) -> str:
+    return f"ai_stream:{channel_id}:{user_id}"
+
+
+def result_key(task_id: str) -> str:
+    return f"ai_result:{task_id}"
+
+
+def pubsub_channel(channel_id: str, user_id: str) -> str:
+    return f"ai_response_{channel_id}_{user_id}"
+
+
+def parse_id(stream_id: str) -> Tuple[int, int]:
+    """Stream ids ("ms-seq") as a tuple that orders like Redis does."""
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _call_args(channel_id: str, user_id: str, frame: dict):
+    keys = [stream_key(channel_id, user_id)]
+    if frame.get("type") == "done":
+        keys.append(result_key(frame["task_id"]))
+    args = [AI_RESPONSE_STREAM_MAXLEN, json.dumps(frame), AI_RESPONSE_STREAM_TTL_S, AI_RESULT_TTL_S,
+            pubsub_channel(channel_id, user_id)]
+    return keys, args
+
+
+def append(channel_id: str, user_id: str, frame: dict) -> str:
+    """Stores and announces one frame; returns its stream id."""
+    keys, args = _call_args(channel_id, user_id, frame)
+    return _append(keys=keys, args=args)
+
+
+async def append_async(channel_id: str, user_id: str, frame: dict) -> str:
+    keys, args = _call_args(channel_id, user_id, frame)
+    return await _append_async(keys=keys, args=args)
+
+
+class ChunkPublisher:
+    """Buffers LLM deltas and publishes them as ordered chunk frames on the (channel, user) response stream."""
+
+    def __init__(self, channel_id, user_id, base):
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.base = base
+        self.seq = 0
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def buffered(self, delta: str) -> Optional[str]:
+        """Adds a delta; returns the coalesced chunk once AI_STREAM_FLUSH_MS has passed."""
+        self.buffer.append(delta)
+        if (time.monotonic() - self.last_flush) * 1000 >= AI_STREAM_FLUSH_MS:
+            return self.drain()
+        return None
+
+    def drain(self) -> Optional[str]:
+        if not self.buffer:
+            return None
+        delta, self.buffer = "".join(self.buffer), []
+        self.last_flush = time.monotonic()
+        return delta
+
+    def frame(self, frame_type, **fields) -> dict:
+        frame = {**self.base, "type": frame_type, "seq": self.seq, **fields}
+        self.seq += 1
+        return frame
+
+    def __call__(self, delta: str):
+        chunk = self.buffered(delta)
+        if chunk:
+            self.publish("chunk", delta=chunk)
+
+    def flush(self):
+        chunk = self.drain()
+        if chunk:
+            self.publish("chunk", delta=chunk)
+
+    def publish(self, frame_type, **fields):
+        append(self.channel_id, self.user_id, self.frame(frame_type, **fields))
+
+
+class AsyncChunkPublisher(ChunkPublisher):
+    """ChunkPublisher for the event loop: the same frames, appended with append_async."""
+
+    def __init__(self, channel_id, user_id, base):
+        super().__init__(channel_id, user_id, base)
+        self.lock = asyncio.Lock()
+
+    async def __call__(self, delta: str):
+        chunk = self.buffered(delta)
+        if chunk:
+            await self.publish("chunk", delta=chunk)
+
+    async def flush(self):
+        chunk = self.drain()
+        if chunk:
+            await self.publish("chunk", delta=chunk)
+
+    async def publish(self, frame_type, **fields):
+        # The lock keeps seq order equal to publish order.
+        async with self.lock:
+            await append_async(self.channel_id, self.user_id, self.frame(frame_type, **fields))
+
+
+async def replay(channel_id: str, user_id: str, after_id: str) -> List[dict]:
+    """Frames stored after `after_id`, oldest first, each with its "id"."""
+    entries = await async_redis_client.xrange(stream_key(channel_id, user_id), min=f"({after_id}")
+    return [{"id": entry_id, **json.loads(fields["frame"])} for entry_id, fields in entries]
+
+
+async def wait_result(task_id: str, timeout_s: float) -> Optional[dict]:
+    """The task's final frame, waiting up to timeout_s for it to be written."""
+    # XREAD from 0 returns at once if the result exists, else blocks until it is added.
+    found = await async_redis_client.xread({result_key(task_id): "0"}, count=1,
+                                           block=max(1, int(timeout_s * 1000)))
+    if not found:
+        return None
+    _, entries = found[0]
+    return json.loads(entries[0][1]["frame"])
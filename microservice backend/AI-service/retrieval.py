@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import logging
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List
+from langchain_core.documents import Document
+from qdrant_client import models
+import resources
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Hybrid retrieval: a dense MiniLM search and a BM25 search over sparse
+# vectors run as two prefetches of one Qdrant query and are fused with
+# reciprocal rank fusion. An optional cross-encoder then reorders the fused
+# candidates within a latency budget.
+
+SPARSE_VECTOR = "bm25"
+# BM25 term-frequency saturation; IDF is applied by Qdrant (Modifier.IDF).
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_AVG_DOC_TOKENS = float(os.getenv("BM25_AVG_DOC_TOKENS", 16))
+
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 8))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", 30))
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", 5))
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", 150))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", 2))
+
+# Names, ticket ids and numbers are kept whole ("JIRA-1234" -> "jira-1234", "jira", "1234").
+TOKEN_RE = re.compile(r"[\w][\w\-\.]*[\w]|\w", re.UNICODE)
+SPARSE_CHECK_TTL_S = 300
+
+_sparse_collections = {}
+_rerank_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+# One slot per rerank thread, held until the job really ends (even past its
+# budget), so requests skip reranking instead of queueing behind stale jobs.
+_rerank_slots = threading.BoundedSemaphore(RERANK_WORKERS)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if "-" in token or "." in token:
+            tokens.extend(part for part in re.split(r"[\-\.]", token) if part)
+    return tokens
+
+
+def token_index(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+
+def sparse_document(text: str) -> models.SparseVector:
+    """BM25 document side: saturated term frequencies, length-normalized."""
+    counts = Counter(tokenize(text))
+    length = sum(counts.values())
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / BM25_AVG_DOC_TOKENS)
+    weights = {}
+    for token, tf in counts.items():
+        index = token_index(token)
+        weights[index] = weights.get(index, 0.0) + tf * (BM25_K1 + 1) / (tf + norm)
+    return models.SparseVector(indices=list(weights), values=list(weights.values()))
+
+
+def sparse_query(text: str) -> models.SparseVector:
+    """BM25 query side: every distinct term weighs 1 and Qdrant multiplies in its IDF."""
+    indices = sorted({token_index(token) for token in tokenize(text)})
+    return models.SparseVector(indices=indices, values=[1.0] * len(indices))
+
+
+def sparse_vectors_config() -> dict:
+    return {SPARSE_VECTOR: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+
+def _cached_sparse(collection_name: str):
+    entry = _sparse_collections.get(collection_name)
+    if entry and time.monotonic() - entry[1] < SPARSE_CHECK_TTL_S:
+        return entry[0]
+    return None
+
+
+def _remember_sparse(collection_name: str, info) -> bool:
+    enabled = SPARSE_VECTOR in (info.config.params.sparse_vectors or {})
+    _sparse_collections[collection_name] = (enabled, time.monotonic())
+    return enabled
+
+
+def has_sparse(collection_name: str) -> bool:
+    """Whether the collection stores BM25 vectors (collections created before hybrid search need a backfill)."""
+    cached = _cached_sparse(collection_name)
+    if cached is not None:
+        return cached
+    return _remember_sparse(collection_name, resources.get("qdrant").get_collection(collection_name))
+
+
+async def has_sparse_async(collection_name: str) -> bool:
+    cached = _cached_sparse(collection_name)
+    if cached is not None:
+        return cached
+    return _remember_sparse(collection_name, await resources.get("async_qdrant").get_collection(collection_name))
+
+
+def build_query(query: str, query_embedding: List[float], search_filter: models.Filter, hybrid: bool) -> dict:
+    """query_points arguments: dense-only, or dense + BM25 prefetches fused with RRF."""
+    limit = RETRIEVAL_CANDIDATES if RERANK_ENABLED else RETRIEVAL_K
+    if not hybrid:
+        return {"query": query_embedding, "query_filter": search_filter, "limit": limit}
+    return {
+        "prefetch": [
+            models.Prefetch(query=query_embedding, filter=search_filter, limit=RETRIEVAL_CANDIDATES),
+            models.Prefetch(query=sparse_query(query), using=SPARSE_VECTOR, filter=search_filter,
+                            limit=RETRIEVAL_CANDIDATES),
+        ],
+        "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        "limit": limit,
+    }
+
+
+def to_documents(points) -> List[Document]:
+    # Same shape as the LangChain vector store returns, so context building and the cache work unchanged.
+    return [
+        Document(
+            page_content=point.payload.get("page_content", ""),
+            metadata={**(point.payload.get("metadata") or {}), "_id": point.id},
+        )
+        for point in points
+    ]
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL, device="cpu")
+
+
+if RERANK_ENABLED:
+    resources.resource("reranker")(_load_reranker)
+
+
+def _score(query: str, docs: List[Document]):
+    return resources.get("reranker").predict([(query, d.page_content) for d in docs])
+
+
+def _order(docs: List[Document], scores) -> List[Document]:
+    ranked = sorted(zip(scores, range(len(docs))), key=lambda pair: -pair[0])
+    return [docs[i] for _, i in ranked[:RERANK_TOP_K]]
+
+
+def _submit_rerank(query: str, docs: List[Document]):
+    """Starts scoring on a free rerank thread; None when every thread is busy."""
+    if not _rerank_slots.acquire(blocking=False):
+        metrics.inc("rerank_skipped_total")
+        return None
+    future = _rerank_executor.submit(_score, query, docs)
+    future.add_done_callback(lambda _: _rerank_slots.release())
+    return future
+
+
+def _over_budget(future, docs: List[Document]) -> List[Document]:
+    # Drops the job if it hasn't started; a running one finishes and frees its slot.
+    future.cancel()
+    logger.warning("⏱️ Rerank over budget (%dms), keeping fused order", RERANK_BUDGET_MS)
+    metrics.inc("rerank_over_budget_total")
+    return docs[:RETRIEVAL_K]
+
+
+def rerank(query: str, docs: List[Document]) -> List[Document]:
+    """Cross-encoder reorder of the candidates; past the budget or with the pool busy the fused order is kept."""
+    if not RERANK_ENABLED or len(docs) <= 1:
+        return docs[:RETRIEVAL_K]
+    future = _submit_rerank(query, docs)
+    if future is None:
+        return docs[:RETRIEVAL_K]
+    try:
+        with metrics.span("rerank"):
+            return _order(docs, future.result(timeout=RERANK_BUDGET_MS / 1000.0))
+    except FutureTimeout:
+        return _over_budget(future, docs)
+
+
+async def rerank_async(query: str, docs: List[Document]) -> List[Document]:
+    if not RERANK_ENABLED or len(docs) <= 1:
+        return docs[:RETRIEVAL_K]
+    future = _submit_rerank(query, docs)
+    if future is None:
+        return docs[:RETRIEVAL_K]
+    try:
+        with metrics.span("rerank"):
+            scores = await asyncio.wait_for(asyncio.wrap_future(future), timeout=RERANK_BUDGET_MS / 1000.0)
+    except asyncio.TimeoutError:
+        return _over_budget(future, docs)
+    return _order(docs, scores)
+
+
+def search_channel(query: str, query_embedding: List[float], search_filter: models.Filter) -> List[Document]:
+    collection = os.getenv("QDRANT_COLLECTION")
+    hybrid = HYBRID_SEARCH and has_sparse(collection)
+    response = resources.get("qdrant").query_points(
+        collection_name=collection, with_payload=True,
+        **build_query(query, query_embedding, search_filter, hybrid),
+    )
+    return rerank(query, to_documents(response.points))
+
+
+async def search_channel_async(query: str, query_embedding: List[float],
+                               search_filter: models.Filter) -> List[Document]:
+    collection = os.getenv("QDRANT_COLLECTION")
+    hybrid = HYBRID_SEARCH and await has_sparse_async(collection)
+    response = await resources.get("async_qdrant").query_points(
+        collection_name=collection, with_payload=True,
+        **build_query(query, query_embedding, search_filter, hybrid),
+    )
+    return await rerank_async(query, to_documents(response.points))
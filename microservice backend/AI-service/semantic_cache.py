@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import hashlib
+from typing import List, Optional
+import numpy as np
+from redis_client import redis_client, redis_bytes_client
+
+# Near-duplicate questions in a channel reuse an earlier answer when the
+# retrieved context is the same set of points. Answers are phrased relative to
+# the asker ("You mentioned..."), so entries are scoped to (channel, user).
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_TTL_S = int(os.getenv("SEMANTIC_CACHE_TTL_S", 6 * 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 200))
+
+KEY_PREFIX = "semantic_cache"
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+# Entries are keyed by context fingerprint, so a lookup only reads questions
+# asked over the same points: one list of packed float32 vectors, and a
+# parallel list of the answers, read only for the best match.
+
+
+def entries_key(channel_id: str, user_id: str, fingerprint: str) -> str:
+    return f"{KEY_PREFIX}:{channel_id}:{user_id}:{fingerprint}"
+
+
+def answers_key(channel_id: str, user_id: str, fingerprint: str) -> str:
+    return f"{entries_key(channel_id, user_id, fingerprint)}:answers"
+
+
+def context_fingerprint(docs) -> str:
+    """Stable id for the set of retrieved points, independent of their order."""
+    ids = sorted(str(d.metadata.get("_id")) for d in docs)
+    return hashlib.sha1("|".join(ids).encode("utf-8")).hexdigest()
+
+
+def lookup(channel_id: str, user_id: str, embedding: List[float], fingerprint: str) -> Optional[str]:
+    """Returns a cached answer for a similar earlier question with the same context, else None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+
+    vectors = redis_bytes_client.lrange(entries_key(channel_id, user_id, fingerprint), 0, -1)
+    if vectors:
+        query = np.asarray(embedding, dtype=np.float32)
+        matrix = np.frombuffer(b"".join(vectors), dtype=np.float32).reshape(len(vectors), -1)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+            raw = redis_bytes_client.lindex(answers_key(channel_id, user_id, fingerprint), best)
+            entry = json.loads(raw) if raw else None
+            if entry and time.time() - entry["ts"] <= SEMANTIC_CACHE_TTL_S:
+                redis_client.hincrby(STATS_KEY, "hits", 1)
+                return entry["answer"]
+
+    redis_client.hincrby(STATS_KEY, "misses", 1)
+    return None
+
+
+def store(channel_id: str, user_id: str, query: str, embedding: List[float], fingerprint: str, answer: str):
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    vectors_key = entries_key(channel_id, user_id, fingerprint)
+    answers = answers_key(channel_id, user_id, fingerprint)
+    entry = json.dumps({"query": query, "answer": answer, "ts": time.time()})
+    # MULTI keeps the two lists index-aligned under concurrent stores.
+    pipe = redis_bytes_client.pipeline()
+    pipe.lpush(vectors_key, np.asarray(embedding, dtype=np.float32).tobytes())
+    pipe.lpush(answers, entry)
+    for key in (vectors_key, answers):
+        pipe.ltrim(key, 0, SEMANTIC_CACHE_MAX_ENTRIES - 1)
+        pipe.expire(key, SEMANTIC_CACHE_TTL_S)
+    pipe.execute()
+
+
+def stats() -> dict:
+    counters = redis_client.hgetall(STATS_KEY)
+    hits, misses = int(counters.get("hits", 0)), int(counters.get("misses", 0))
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else 0.0}
@@ -1,26 +1,57 @@
 import asyncio
+import os
+import time
+import uuid
+import threading
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, HTTPException, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import List, Optional
 import logging
 from fastapi.middleware.cors import CORSMiddleware 
-from consumer import start_consumer
+from consumer import start_consumer, ingest_stats, worker_snapshots, INGEST_LAG_KEY
 from pydantic import BaseModel
-from ai_task import generate_ai_response
-from ai_ws import ai_websocket  
+from ai_task import generate_ai_response, generate_digest
+from async_worker import AI_EXECUTION_MODE, AI_JOBS_KEY, enqueue
+from ai_ws import ai_websocket, stop_listener, connected_sockets
+import semantic_cache
+import llm
+import admission
+import metrics
+import profiler
+import response_stream
+import digest
+from redis_client import redis_client
+import resources
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
+INGEST_IN_PROCESS = os.getenv("INGEST_IN_PROCESS", "false").lower() == "true"
+AI_RESULT_MAX_WAIT_S = int(os.getenv("AI_RESULT_MAX_WAIT_S", 30))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    task = asyncio.create_task(asyncio.to_thread(start_consumer))
-    logger.info("🚀 Kafka consumer started in background thread")
+    if resources.AI_WARMUP:
+        # The API itself only talks to Redis; the heavy clients are needed here only for in-process ingest.
+        resources.warm_up(["embeddings", "qdrant"] if INGEST_IN_PROCESS else [])
+    logger.info("⏱️ Server ready %.2fs after process start", time.monotonic() - resources.PROCESS_STARTED_AT)
+    # Ingest normally runs as its own process group (python consumer.py --workers N);
+    # INGEST_IN_PROCESS=true keeps the old single-thread consumer inside the API.
+    consumer_stop = threading.Event()
+    task = None
+    if INGEST_IN_PROCESS:
+        task = asyncio.create_task(asyncio.to_thread(start_consumer, consumer_stop))
+        logger.info("🚀 Kafka consumer started in background thread")
 
     try:
         yield  # Let FastAPI run
     finally:
-        task.cancel()
-        logger.info("🛑 Kafka consumer stopped")
+        if task:
+            consumer_stop.set()
+            await task
+            logger.info("🛑 Kafka consumer stopped")
+        await stop_listener()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -30,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # @app.get("/")
@@ -44,17 +76,146 @@ class AIRequest(BaseModel):
 
 @app.post("/")
 async def ai_endpoint(req: AIRequest):
+    # A repeat of a question this user already has in flight joins that task.
+    existing = await admission.inflight_task(req.channelId, req.userId, req.query)
+    if existing:
+        metrics.inc("ai_requests_total", outcome="coalesced")
+        return {"task_id": existing, "status": "processing", "coalesced": True}
+
+    try:
+        await admission.check_backlog(AI_JOBS_KEY if AI_EXECUTION_MODE == "async" else admission.CELERY_QUEUE)
+        await admission.take_token(req.channelId, req.userId)
+    except admission.Rejected as e:
+        metrics.inc("ai_requests_total", outcome="rejected")
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+    task_id = str(uuid.uuid4())
+    existing = await admission.claim(req.channelId, req.userId, req.query, task_id)
+    if existing:
+        metrics.inc("ai_requests_total", outcome="coalesced")
+        return {"task_id": existing, "status": "processing", "coalesced": True}
+
     try:
+        metrics.inc("ai_requests_total", outcome="accepted")
+        if AI_EXECUTION_MODE == "async":
+            # Picked up by async_worker.py; replies arrive on the same WebSocket channel.
+            await enqueue(req.query, req.userId, req.channelId, task_id=task_id)
+            return {"task_id": task_id, "status": "processing"}
+
         # Send task to Celery (async)
-        task = generate_ai_response.delay(req.query, req.userId, req.channelId)
-        return {"task_id": task.id, "status": "processing"}
+        generate_ai_response.apply_async((req.query, req.userId, req.channelId),
+                                         {"enqueued_at": time.time()}, task_id=task_id)
+        return {"task_id": task_id, "status": "processing"}
     except Exception as e:
         import traceback
         print("AI Endpoint Error:", traceback.format_exc())
+        await admission.release_async(req.channelId, req.userId, req.query, task_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class DigestItem(BaseModel):
+    channelId: str
+    period: str = "yesterday"
+    query: Optional[str] = None  # focuses the item on a question instead of a full summary
+    title: Optional[str] = None  # section heading, e.g. the channel name
+
+
+class DigestRequest(BaseModel):
+    userId: str
+    channelId: str  # the channel whose AI socket receives the aggregated answer
+    items: List[DigestItem]
+
+
+@app.post("/digest")
+async def digest_endpoint(req: DigestRequest):
+    """Summarizes many (channel, period) items as one task; one combined answer arrives on the WebSocket."""
+    if not req.items or len(req.items) > digest.DIGEST_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"send between 1 and {digest.DIGEST_MAX_ITEMS} items")
+    invalid = sorted({item.period for item in req.items} - set(digest.PERIODS))
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"unknown period(s): {', '.join(invalid)}")
+
+    try:
+        await admission.check_backlog(admission.CELERY_QUEUE)
+        await admission.take_token(req.channelId, req.userId)
+    except admission.Rejected as e:
+        metrics.inc("ai_requests_total", outcome="rejected")
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+    task_id = str(uuid.uuid4())
+    metrics.inc("ai_requests_total", outcome="accepted")
+    # Digests always run on the Celery workers: the chord is what bounds their LLM parallelism.
+    items = [item.model_dump() for item in req.items]
+    generate_digest.apply_async((items, req.userId, req.channelId), {"enqueued_at": time.time()}, task_id=task_id)
+    return {"task_id": task_id, "status": "processing", "items": len(items)}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", **resources.readiness()}
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "ingest": ingest_stats.snapshot() if INGEST_IN_PROCESS else None,
+        "ingest_workers": worker_snapshots(),
+        "ingest_lag": {partition: int(lag) for partition, lag in redis_client.hgetall(INGEST_LAG_KEY).items()},
+        "ai_sockets": connected_sockets(),
+        "semantic_cache": semantic_cache.stats(),
+        "llm": llm.stats(),
+    }
+
+
+@app.get("/result/{task_id}")
+async def get_result(task_id: str, timeout: float = Query(25, ge=0, le=AI_RESULT_MAX_WAIT_S)):
+    """Long-poll for a task's final answer, for clients without the WebSocket."""
+    frame = await response_stream.wait_result(task_id, timeout)
+    if frame is None:
+        # Still running (or unknown / expired); poll again.
+        return JSONResponse({"task_id": task_id, "status": "processing"}, status_code=202)
+    return {"task_id": task_id, "status": "done", "response": frame.get("response")}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Histograms and counters come from every process via Redis; gauges are read at scrape time.
+    # LLM calls/errors/fallbacks/hedges are the llm_events_total counter.
+    cache = semantic_cache.stats()
+    gauges = [
+        ("ai_queue_depth", "Jobs waiting for an AI worker.", {
+            'queue="celery"': redis_client.llen(admission.CELERY_QUEUE),
+            'queue="async"': redis_client.llen(AI_JOBS_KEY),
+        }),
+        ("ingest_consumer_lag", "Kafka messages behind the high watermark, per partition.", {
+            f'partition="{partition}"': int(lag) for partition, lag in redis_client.hgetall(INGEST_LAG_KEY).items()
+        }),
+        ("ai_websocket_connections", "AI sockets open on this API process.", {"": connected_sockets()}),
+        ("semantic_cache_lookups", "Semantic cache lookups since the stats were reset.", {
+            'result="hit"': cache["hits"], 'result="miss"': cache["misses"],
+        }),
+    ]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/debug/profile")
+def start_profile(seconds: int = 30):
+    """Samples every AI process for `seconds`; fetch the collapsed stacks afterwards."""
+    if not profiler.PROFILER_ALLOWED:
+        raise HTTPException(status_code=404)
+    run_id = profiler.request(seconds)
+    return {"profile_id": run_id, "result": f"/debug/profile/{run_id}"}
+
+
+@app.get("/debug/profile/{run_id}", response_class=PlainTextResponse)
+def get_profile(run_id: str):
+    if not profiler.PROFILER_ALLOWED:
+        raise HTTPException(status_code=404)
+    return profiler.collapsed(run_id)
+
+
 @app.websocket("/ws/{channel_id}")
-async def ai_ws(channel_id: str, websocket: WebSocket, authId: str = Query(...)):
+async def ai_ws(channel_id: str, websocket: WebSocket, authId: str = Query(...), lastId: Optional[str] = None):
     print(f"WebSocket connection request for channel {channel_id} with authId {authId}")
-    await ai_websocket(websocket, channel_id, authId)
\ No newline at end of file
+    # lastId: stream id of the last frame the client received, to resume after a reconnect.
+    await ai_websocket(websocket, channel_id, authId, lastId)
\ No newline at end of file
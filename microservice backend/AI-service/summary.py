@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, NamedTuple, Optional
+from pymongo import ASCENDING
+from context import count_tokens
+from mongo_utils import resolve_names, to_epoch
+from prompt import SUMMARY_GENERATION_PROMPT, SUMMARY_MAP_PROMPT, SUMMARY_REDUCE_PROMPT, SUMMARY_UPDATE_PROMPT
+
+# Upper bound of chat-log tokens packed into one LLM call (map or reduce input).
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", 6000))
+# How many map calls run against the LLM provider at once.
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", 4))
+SUMMARY_CURSOR_BATCH = int(os.getenv("SUMMARY_CURSOR_BATCH", 1000))
+
+_index_ready = set()
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class WindowSummary(NamedTuple):
+    text: str
+    last_message_at: float  # epoch seconds of the newest message the summary covers
+
+
+def ensure_window_index(messages_collection):
+    """Makes sure the (channelId, createdAt) index the window cursor relies on exists."""
+    key = messages_collection.full_name
+    if key in _index_ready:
+        return
+    messages_collection.create_index([("channelId", ASCENDING), ("createdAt", ASCENDING)])
+    _index_ready.add(key)
+
+
+def iter_window_lines(messages_collection, channel_id: str, start: datetime, end: datetime,
+                      watermark: dict, exclusive_start: bool = False) -> Iterator[str]:
+    """
+    Streams the channel's messages in [start, end] as formatted chat lines, oldest first.
+
+    watermark["last"] is advanced to the epoch of each message yielded.
+    """
+    ensure_window_index(messages_collection)
+    users = messages_collection.database["users"]
+    names = {}
+
+    cursor = messages_collection.find(
+        {
+            "channelId": channel_id,
+            "createdAt": {"$gt" if exclusive_start else "$gte": start, "$lte": end},
+            "isAi": {"$ne": True},
+            "text": {"$nin": [None, ""]},
+        },
+        {"sender": 1, "text": 1, "createdAt": 1},
+    ).sort("createdAt", ASCENDING).batch_size(SUMMARY_CURSOR_BATCH)
+
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= SUMMARY_CURSOR_BATCH:
+            yield from _format_batch(batch, users, names, watermark)
+            batch = []
+    if batch:
+        yield from _format_batch(batch, users, names, watermark)
+
+
+def _format_batch(docs, users, names, watermark) -> Iterator[str]:
+    resolve_names(users, docs, names)
+    for d in docs:
+        sender = d.get("sender")
+        name = names.get(sender) or (str(sender) if sender else "Unknown")
+        timestamp = d["createdAt"].strftime("%Y-%m-%d %H:%M")
+        watermark["last"] = to_epoch(d["createdAt"])
+        yield f"[{timestamp}] {name}: {d['text'].strip()}"
+
+
+def pack_chunks(lines, budget: int) -> Iterator[str]:
+    """Groups lines into chunks of at most `budget` tokens, counted a cursor batch at a time."""
+    chunk, used = [], 0
+    lines = iter(lines)
+    while batch := list(islice(lines, SUMMARY_CURSOR_BATCH)):
+        for line, cost in zip(batch, count_tokens(batch)):
+            if chunk and used + cost > budget:
+                yield "\n".join(chunk)
+                chunk, used = [], 0
+            chunk.append(line)
+            used += cost
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def summarize_lines(lines, complete: Callable) -> Optional[str]:
+    """Map-reduce summary of already formatted chat lines; None when there are none."""
+    chunks = list(pack_chunks(lines, SUMMARY_CHUNK_TOKENS))
+    if not chunks:
+        return None
+    if len(chunks) == 1:
+        return _summarize(chunks[0], complete, None)
+    with ThreadPoolExecutor(max_workers=SUMMARY_MAP_CONCURRENCY) as pool:
+        partials = list(pool.map(lambda chunk: _map(chunk, complete), chunks))
+        return _reduce(partials, complete, None, pool)
+
+
+def summarize_window(messages_collection, channel_id: str, start: datetime, end: datetime,
+                     complete: Callable, on_delta: Optional[Callable[[str], None]] = None,
+                     previous: Optional[WindowSummary] = None) -> Optional[WindowSummary]:
+    """
+    Map-reduce summary of every message in the window.
+
+    Small windows are summarized in one call. Larger ones are split into
+    token-budgeted chunks that are summarized in parallel, and the partial
+    summaries are merged (recursively if they don't fit one call). Only the
+    final call streams through on_delta.
+
+    With `previous`, only messages newer than its high-water mark are read
+    and folded into the earlier summary. Returns None when there is nothing
+    to summarize (or, incrementally, `previous` unchanged).
+    """
+    watermark = {"last": previous.last_message_at if previous else None}
+    if previous:
+        # Mongo dates have millisecond precision; rebuild the mark exactly so $gt excludes it.
+        since = EPOCH + timedelta(milliseconds=round(previous.last_message_at * 1000))
+        lines = iter_window_lines(messages_collection, channel_id, since, end, watermark, exclusive_start=True)
+    else:
+        lines = iter_window_lines(messages_collection, channel_id, start, end, watermark)
+    chunks = pack_chunks(lines, SUMMARY_CHUNK_TOKENS)
+
+    first = next(chunks, None)
+    if first is None:
+        return previous
+    second = next(chunks, None)
+    if second is None:
+        if previous:
+            text = _update(previous.text, first, complete, on_delta)
+        else:
+            text = _summarize(first, complete, on_delta)
+        return WindowSummary(text, watermark["last"])
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_MAP_CONCURRENCY) as pool:
+        futures = [pool.submit(_map, first, complete), pool.submit(_map, second, complete)]
+        for chunk in chunks:
+            futures.append(pool.submit(_map, chunk, complete))
+        partials = [f.result() for f in futures]
+        if previous:
+            partials.insert(0, previous.text)
+
+        return WindowSummary(_reduce(partials, complete, on_delta, pool), watermark["last"])
+
+
+def _summarize(chat: str, complete, on_delta) -> str:
+    return complete(
+        [
+            {"role": "system", "content": SUMMARY_GENERATION_PROMPT},
+            {"role": "user", "content": f"Chat:\n{chat}\n\nSummary:"},
+        ],
+        on_delta,
+    )
+
+
+def _update(summary: str, chat: str, complete, on_delta) -> str:
+    return complete(
+        [
+            {"role": "system", "content": SUMMARY_UPDATE_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{summary}\n\nNew messages:\n{chat}\n\nUpdated summary:"},
+        ],
+        on_delta,
+    )
+
+
+def _map(chat: str, complete) -> str:
+    return complete([
+        {"role": "system", "content": SUMMARY_MAP_PROMPT},
+        {"role": "user", "content": f"Chat slice:\n{chat}"},
+    ])
+
+
+def _merge(partials: str, complete, on_delta=None) -> str:
+    return complete(
+        [
+            {"role": "system", "content": SUMMARY_REDUCE_PROMPT},
+            {"role": "user", "content": f"Partial summaries (oldest first):\n{partials}"},
+        ],
+        on_delta,
+    )
+
+
+def _reduce(partials: List[str], complete, on_delta, pool) -> str:
+    groups = list(pack_chunks(partials, SUMMARY_CHUNK_TOKENS))
+    # A single group, or partials too large to pair up, are merged in one final call.
+    if len(groups) == 1 or len(groups) == len(partials):
+        return _merge("\n\n".join(partials), complete, on_delta)
+    merged = list(pool.map(lambda group: _merge(group, complete), groups))
+    return _reduce(merged, complete, on_delta, pool)
@@ -0,0 +1,95 @@
+import os
+import time
+from datetime import datetime
+from typing import Optional
+from redis_client import redis_client
+
+# Rolling summaries per (channel, period bucket). Each entry stores the summary
+# and the timestamp of the newest message it covers (its high-water mark).
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_TTL_S = int(os.getenv("SUMMARY_CACHE_TTL_S", 24 * 3600))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", 10000))
+# Rolling windows ("yesterday" = last 24h) share an entry while their start falls in the same bucket.
+SUMMARY_CACHE_BUCKET_S = int(os.getenv("SUMMARY_CACHE_BUCKET_S", 3600))
+
+KEY_PREFIX = "summary_cache"
+LRU_KEY = f"{KEY_PREFIX}:lru"
+
+# Keeps the newest message timestamp seen per channel, ignoring out-of-order writes.
+_bump_latest = redis_client.register_script("""
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return 0
+""")
+
+
+def entry_key(channel_id: str, period: str, start: datetime) -> str:
+    bucket = int(start.timestamp() // SUMMARY_CACHE_BUCKET_S)
+    return f"{KEY_PREFIX}:{channel_id}:{period}:{bucket}"
+
+
+def latest_key(channel_id: str) -> str:
+    return f"{KEY_PREFIX}:latest:{channel_id}"
+
+
+def get(channel_id: str, period: str, start: datetime) -> Optional[dict]:
+    """
+    Returns {"summary", "hwm", "stale"} for the bucket, or None on a miss.
+
+    An entry is stale when the consumer has seen a message for the channel
+    newer than the entry's high-water mark.
+    """
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    key = entry_key(channel_id, period, start)
+    pipe = redis_client.pipeline()
+    pipe.hgetall(key)
+    pipe.get(latest_key(channel_id))
+    entry, latest = pipe.execute()
+    if not entry:
+        return None
+
+    redis_client.zadd(LRU_KEY, {key: time.time()})
+    hwm = float(entry.get("hwm", 0))
+    return {
+        "summary": entry.get("summary", ""),
+        "hwm": hwm,
+        "stale": latest is not None and float(latest) > hwm,
+    }
+
+
+def put(channel_id: str, period: str, start: datetime, summary: str, hwm: float):
+    if not SUMMARY_CACHE_ENABLED:
+        return
+    key = entry_key(channel_id, period, start)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={"summary": summary, "hwm": hwm, "updatedAt": time.time()})
+    pipe.expire(key, SUMMARY_CACHE_TTL_S)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    pipe.execute()
+    _evict()
+
+
+def _evict():
+    """Drops the least recently used entries once the cache is over its size cap."""
+    overflow = redis_client.zcard(LRU_KEY) - SUMMARY_CACHE_MAX_ENTRIES
+    if overflow <= 0:
+        return
+    victims = redis_client.zrange(LRU_KEY, 0, overflow - 1)
+    if victims:
+        pipe = redis_client.pipeline()
+        pipe.delete(*victims)
+        pipe.zrem(LRU_KEY, *victims)
+        pipe.execute()
+
+
+def mark_channels_updated(latest_by_channel: dict):
+    """Called by the consumer: {channel_id: newest createdAt epoch} marks cached summaries stale."""
+    if not SUMMARY_CACHE_ENABLED or not latest_by_channel:
+        return
+    pipe = redis_client.pipeline()
+    for channel_id, ts in latest_by_channel.items():
+        _bump_latest(keys=[latest_key(channel_id)], args=[ts, SUMMARY_CACHE_TTL_S], client=pipe)
+    pipe.execute()
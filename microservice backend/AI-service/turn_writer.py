@@ -0,0 +1,136 @@
+import os
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+import resources
+import metrics
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Write-behind for AI conversation turns. submit() only enqueues; a background
+# thread groups the turns of every task in this process into one insert_many
+# per TURN_WRITE_FLUSH_MS window, so the answer is published without waiting
+# for Mongo. insert_many assigns the _ids client-side on the first attempt,
+# so a retry after a lost acknowledgement can't store a turn twice.
+
+TURN_WRITE_BATCH = int(os.getenv("TURN_WRITE_BATCH", 200))
+TURN_WRITE_FLUSH_MS = int(os.getenv("TURN_WRITE_FLUSH_MS", 200))
+TURN_WRITE_MAX_RETRIES = int(os.getenv("TURN_WRITE_MAX_RETRIES", 5))
+TURN_WRITE_SHUTDOWN_TIMEOUT_S = int(os.getenv("TURN_WRITE_SHUTDOWN_TIMEOUT_S", 10))
+# Batches that still fail after every retry are parked here and replayed on the next start.
+TURN_WRITE_SPILL_KEY = "turn_writes:spill"
+DUPLICATE_KEY = 11000
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class TurnWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, docs):
+        """Queues documents for the next batched insert; never blocks on Mongo."""
+        self._ensure_thread()
+        for doc in docs:
+            self._queue.put(doc)
+
+    def flush(self, timeout: float = TURN_WRITE_SHUTDOWN_TIMEOUT_S) -> bool:
+        """Writes everything queued so far; returns False if that took longer than timeout."""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def _ensure_thread(self):
+        # A forked Celery child must run its own writer thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="turn-writer", daemon=True)
+            self._thread.start()
+            replay_spilled()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, markers = [], []
+            deadline = time.monotonic() + TURN_WRITE_FLUSH_MS / 1000.0
+            while True:
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= TURN_WRITE_BATCH or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                write(batch)
+            for marker in markers:
+                marker.done.set()
+
+
+def write(docs):
+    """insert_many with jittered retries; documents already stored by an earlier attempt are skipped."""
+    messages_collection = resources.get("messages_collection")
+    metrics.observe("mongo_turn_write_batch", len(docs), buckets=metrics.SIZE_BUCKETS)
+    for attempt in range(TURN_WRITE_MAX_RETRIES):
+        started = time.perf_counter()
+        try:
+            messages_collection.insert_many(docs, ordered=False)
+            metrics.observe("mongo_turn_write_seconds", time.perf_counter() - started)
+            logger.info("💾 Stored %d conversation doc(s)", len(docs))
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if errors and all(err.get("code") == DUPLICATE_KEY for err in errors):
+                return
+            logger.warning("⚠️ Turn insert failed (attempt %d): %s", attempt + 1, errors[:1])
+        except PyMongoError as e:
+            logger.warning("⚠️ Turn insert failed (attempt %d): %s", attempt + 1, e)
+        time.sleep(min(0.2 * 2 ** attempt, 5.0) * random.uniform(0.5, 1.0))
+
+    logger.error("❌ Giving up on %d conversation doc(s), parking them in Redis", len(docs))
+    try:
+        redis_client.rpush(TURN_WRITE_SPILL_KEY, *(json_util.dumps(doc) for doc in docs))
+    except Exception as e:
+        logger.exception("❌ Could not park conversation docs, they are lost: %s", e)
+
+
+def replay_spilled():
+    """Re-inserts turns parked by an earlier process (runs once when the writer thread starts)."""
+    while True:
+        try:
+            raw = redis_client.lpop(TURN_WRITE_SPILL_KEY, TURN_WRITE_BATCH)
+        except Exception as e:
+            logger.warning("⚠️ Could not read parked conversation docs: %s", e)
+            return
+        if not raw:
+            return
+        turn_writer.submit([json_util.loads(item) for item in raw])
+
+
+turn_writer = TurnWriter()
+submit = turn_writer.submit
+flush = turn_writer.flush
+atexit.register(flush)
@@ -18,6 +18,7 @@ export const connectConsumer = async () => {
 
           if (type === "send_message") {
             let savedMessage = await Message.create({
+              _id: payload.messageId || undefined,
               channelId: payload.channelId,
               sender: payload.sender ? payload.sender._id : null,
               text: payload.text,
@@ -32,7 +32,8 @@ export default function socketHandler(io) {
         } = body;
 
         const message = {
-          messageId: null,
+          // Assigned here so downstream consumers (AI ingest) key on the final Mongo _id.
+          messageId: new mongoose.Types.ObjectId().toString(),
           tempId,
           channelId,
           sender: sender,